@@ -0,0 +1,39 @@
+"""Administración de la plataforma.
+
+    python -m app iniciar              aplica las migraciones, crea el jefe inicial y precompila las plantillas
+    python -m app migrar [--hasta N]   solo aplica las migraciones
+    python -m app estado               versión del esquema de la base y la que espera el código
+
+`iniciar` se ejecuta una vez por despliegue, antes de arrancar uvicorn/gunicorn; los workers
+solo verifican la versión del esquema al arrancar.
+"""
+import argparse
+import time
+
+def main():
+    parser = argparse.ArgumentParser(description="Administración de la plataforma")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    sub.add_parser("iniciar", help="Aplica las migraciones pendientes y crea el jefe inicial")
+    migrar = sub.add_parser("migrar", help="Aplica las migraciones pendientes")
+    migrar.add_argument("--hasta", type=int, default=None)
+    sub.add_parser("estado", help="Muestra la versión actual y la esperada")
+    args = parser.parse_args()
+
+    from app.basedatos import crear_jefe, motor
+    from app.migraciones import migrar as aplicar_migraciones, version_actual, version_esperada
+    inicio = time.perf_counter()
+    if args.comando == "estado":
+        with motor.connect() as conexion:
+            print(f"{motor.url.render_as_string(hide_password=True)}: versión {version_actual(conexion)} de {version_esperada()}")
+        return
+    aplicadas = aplicar_migraciones(motor, args.hasta if args.comando == "migrar" else None)
+    print(f"Migraciones aplicadas: {aplicadas or 'ninguna'}")
+    if args.comando == "iniciar":
+        crear_jefe()
+        # Deja el bytecode de las plantillas en la caché de disco que comparten los workers
+        from app.plantillas import precompilar
+        print(f"Plantillas precompiladas: {precompilar()}")
+    print(f"Listo en {time.perf_counter() - inicio:.2f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import argparse
+import base64
+import hashlib
+import mmap
+import os
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TAMANO_BLOQUE = 64 * 1024
+# Un blob recién guardado puede no tener aún su documento confirmado: la recolección no lo toca hasta que pase esto
+GRACIA_HUERFANOS = float(os.getenv("Gracia_Huerfanos", "3600"))
+
+class AlmacenBlobs(ABC):
+    """Interfaz de los backends que guardan el cifrado de los documentos."""
+
+    @abstractmethod
+    def guardar(self, bloques) -> str:
+        ...
+
+    @abstractmethod
+    def leer_bloques(self, referencia: str, tamano_bloque: int = TAMANO_BLOQUE, desde: int = 0):
+        ...
+
+    def leer(self, referencia: str) -> bytes:
+        return b"".join(self.leer_bloques(referencia))
+
+    @abstractmethod
+    def tamano(self, referencia: str) -> int:
+        ...
+
+    @abstractmethod
+    def modificado(self, referencia: str) -> float:
+        """Última vez (epoch) que se guardó el blob, incluso si ya existía con el mismo contenido."""
+
+    @abstractmethod
+    def existe(self, referencia: str) -> bool:
+        ...
+
+    @abstractmethod
+    def eliminar(self, referencia: str):
+        ...
+
+    @abstractmethod
+    def referencias(self):
+        ...
+
+class AlmacenDisco(AlmacenBlobs):
+    """Guarda cada blob en un archivo nombrado por su SHA-256 (blobs/ab/cd/abcd...)."""
+
+    def __init__(self, directorio: str):
+        self.directorio = directorio
+        os.makedirs(directorio, exist_ok=True)
+
+    def ruta(self, referencia: str) -> str:
+        return os.path.join(self.directorio, referencia[:2], referencia[2:4], referencia)
+
+    def guardar(self, bloques) -> str:
+        if isinstance(bloques, (bytes, bytearray)):
+            bloques = [bloques]
+        sha = hashlib.sha256()
+        fd, temporal = tempfile.mkstemp(dir=self.directorio, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as archivo:
+                for bloque in bloques:
+                    sha.update(bloque)
+                    archivo.write(bloque)
+                archivo.flush()
+                os.fsync(archivo.fileno())
+            referencia = sha.hexdigest()
+            destino = self.ruta(referencia)
+            if os.path.exists(destino):
+                # Mismo contenido ya almacenado; se renueva su fecha para que la recolección no lo tome por huérfano
+                os.remove(temporal)
+                os.utime(destino)
+            else:
+                os.makedirs(os.path.dirname(destino), exist_ok=True)
+                os.replace(temporal, destino)
+            return referencia
+        except BaseException:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+
+    def leer_bloques(self, referencia: str, tamano_bloque: int = TAMANO_BLOQUE, desde: int = 0):
+        with open(self.ruta(referencia), "rb") as archivo:
+            if desde:
+                archivo.seek(desde)
+            while True:
+                bloque = archivo.read(tamano_bloque)
+                if not bloque:
+                    break
+                yield bloque
+
+    def tamano(self, referencia: str) -> int:
+        return os.path.getsize(self.ruta(referencia))
+
+    def modificado(self, referencia: str) -> float:
+        return os.path.getmtime(self.ruta(referencia))
+
+    @contextmanager
+    def abrir_mmap(self, referencia: str):
+        with open(self.ruta(referencia), "rb") as archivo:
+            if os.fstat(archivo.fileno()).st_size == 0:
+                yield b""
+                return
+            with mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+                yield mapa
+
+    def existe(self, referencia: str) -> bool:
+        return os.path.exists(self.ruta(referencia))
+
+    def eliminar(self, referencia: str):
+        try:
+            os.remove(self.ruta(referencia))
+        except FileNotFoundError:
+            pass
+
+    def referencias(self):
+        for raiz, _, archivos in os.walk(self.directorio):
+            for nombre in archivos:
+                if not nombre.endswith(".tmp"):
+                    yield nombre
+
+BACKENDS = {
+    "disco": lambda: AlmacenDisco(os.getenv("Directorio_Blobs", "./blobs")),
+}
+
+_almacen = None
+
+def obtener_almacen() -> AlmacenBlobs:
+    global _almacen
+    if _almacen is None:
+        backend = os.getenv("Almacen_Blobs", "disco")
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend de blobs desconocido: {backend}")
+        _almacen = BACKENDS[backend]()
+    return _almacen
+
+def migrar_documentos(db, lote: int = 100) -> int:
+    """Mueve el cifrado de documentos.datos (base64) al almacén de blobs."""
+    from app.modelos import Documento
+    almacen = obtener_almacen()
+    migrados = 0
+    while True:
+        documentos = (
+            db.query(Documento)
+            .filter(Documento.referencia_blob.is_(None), Documento.datos.isnot(None))
+            .order_by(Documento.id)
+            .limit(lote)
+            .all()
+        )
+        if not documentos:
+            break
+        for doc in documentos:
+            doc.referencia_blob = almacen.guardar(base64.b64decode(doc.datos))
+            doc.datos = None
+        db.commit()
+        migrados += len(documentos)
+        db.expunge_all()
+    return migrados
+
+def recolectar_huerfanos(db, gracia: float = GRACIA_HUERFANOS) -> int:
+    """Elimina los blobs que ya no referencia ningún documento y que tienen más de `gracia` segundos.
+
+    Una subida guarda el blob antes de confirmar su documento; sin la gracia se borraría a medio camino.
+    """
+    from app.modelos import Documento
+    almacen = obtener_almacen()
+    # El corte se fija antes de leer las referencias: un blob más viejo ya tenía su documento confirmado
+    corte = time.time() - gracia
+    usadas = {r for (r,) in db.query(Documento.referencia_blob).filter(Documento.referencia_blob.isnot(None))}
+    eliminados = 0
+    for referencia in list(almacen.referencias()):
+        if referencia in usadas:
+            continue
+        try:
+            if almacen.modificado(referencia) > corte:
+                continue
+        except FileNotFoundError:
+            continue
+        almacen.eliminar(referencia)
+        eliminados += 1
+    return eliminados
+
+def main():
+    from app.basedatos import SesionLocal, iniciar_bd, motor
+    parser = argparse.ArgumentParser(description="Mantenimiento del almacén de documentos cifrados")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    migrar = sub.add_parser("migrar", help="Mueve documentos.datos al almacén de blobs")
+    migrar.add_argument("--lote", type=int, default=100)
+    migrar.add_argument("--vacuum", action="store_true", help="Ejecuta VACUUM al terminar")
+    huerfanos = sub.add_parser("huerfanos", help="Elimina blobs sin documento")
+    huerfanos.add_argument("--gracia", type=float, default=GRACIA_HUERFANOS,
+                           help="Segundos que se respeta un blob recién guardado")
+    args = parser.parse_args()
+
+    iniciar_bd()
+    db = SesionLocal()
+    try:
+        if args.comando == "migrar":
+            print(f"Documentos migrados: {migrar_documentos(db, args.lote)}")
+            if args.vacuum:
+                # VACUUM no puede ejecutarse dentro de una transacción
+                with motor.connect().execution_options(isolation_level="AUTOCOMMIT") as conexion:
+                    conexion.exec_driver_sql("VACUUM")
+        else:
+            print(f"Blobs eliminados: {recolectar_huerfanos(db, args.gracia)}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
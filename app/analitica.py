@@ -0,0 +1,162 @@
+import argparse
+import math
+import os
+from collections import defaultdict
+from sqlalchemy import Integer, case, cast, func, insert, select
+from sqlalchemy.orm import Session
+from app.modelos import Historial_Academico, Estadistica_Calificacion
+
+# Estadísticas de calificaciones. El tablero lee solo estadisticas_calificaciones, cuyo tamaño depende
+# de materias x semestres y no del número de estudiantes; los reportes a la medida cargan la columna
+# numérica y la procesan con NumPy.
+CALIFICACION_APROBATORIA = float(os.getenv("Calificacion_Aprobatoria", "6"))
+CALIFICACION_MAXIMA = int(os.getenv("Calificacion_Maxima", "10"))
+TAMANO_LOTE_ANALITICA = 1000
+
+def a_numero(calificacion):
+    """Valor numérico de una calificación ("9", "8.5", "8,5"); None si no es un número."""
+    if calificacion is None:
+        return None
+    try:
+        valor = float(str(calificacion).strip().replace(",", "."))
+    except ValueError:
+        return None
+    return valor if math.isfinite(valor) else None
+
+def cubeta(valor: float) -> int:
+    return min(max(int(valor), 0), CALIFICACION_MAXIMA)
+
+def nuevos_deltas():
+    # (materia, semestre, cubeta) -> [conteo, suma, suma_cuadrados]
+    return defaultdict(lambda: [0, 0.0, 0.0])
+
+def acumular(deltas, materia: str, semestre: str, valor, signo: int):
+    if valor is None:
+        return
+    delta = deltas[(materia, semestre or "", cubeta(valor))]
+    delta[0] += signo
+    delta[1] += signo * valor
+    delta[2] += signo * valor * valor
+
+def filas_deltas(deltas) -> list:
+    """Filas para el upsert de estadisticas_calificaciones; omite las que no cambian nada."""
+    return [{"materia": materia, "semestre": semestre, "cubeta": c, "conteo": conteo, "suma": suma,
+             "suma_cuadrados": cuadrados}
+            for (materia, semestre, c), (conteo, suma, cuadrados) in deltas.items() if conteo or suma or cuadrados]
+
+def _estadisticas(conteo: int, suma: float, cuadrados: float, distribucion: list) -> dict:
+    promedio = suma / conteo if conteo else None
+    # Varianza poblacional a partir de las sumas; max() absorbe el error de redondeo
+    desviacion = math.sqrt(max(cuadrados / conteo - promedio * promedio, 0.0)) if conteo else None
+    # Las cubetas son la parte entera: exacto mientras la calificación aprobatoria sea entera
+    reprobados = sum(n for c, n in enumerate(distribucion) if c < CALIFICACION_APROBATORIA)
+    return {"n": conteo,
+            "promedio": round(promedio, 3) if promedio is not None else None,
+            "desviacion": round(desviacion, 3) if desviacion is not None else None,
+            "tasa_reprobacion": round(reprobados / conteo, 4) if conteo else None,
+            "distribucion": distribucion}
+
+def resumen_materias(db: Session, semestre: str = None) -> list:
+    """Promedio, desviación, tasa de reprobación y distribución por materia desde los agregados."""
+    E = Estadistica_Calificacion
+    consulta = db.query(E.materia, E.cubeta, func.sum(E.conteo), func.sum(E.suma), func.sum(E.suma_cuadrados))
+    if semestre is not None:
+        consulta = consulta.filter(E.semestre == semestre)
+    materias = {}
+    for materia, c, conteo, suma, cuadrados in consulta.group_by(E.materia, E.cubeta):
+        acumulado = materias.setdefault(materia, [0, 0.0, 0.0, [0] * (CALIFICACION_MAXIMA + 1)])
+        acumulado[0] += conteo
+        acumulado[1] += suma
+        acumulado[2] += cuadrados
+        acumulado[3][c] += conteo
+    return [{"materia": materia, **_estadisticas(*acumulado)}
+            for materia, acumulado in sorted(materias.items()) if acumulado[0] > 0]
+
+def reporte(db: Session, semestre: str = None, materias: list = None) -> list:
+    """Reporte a la medida con percentiles, calculado con NumPy sobre la columna numérica."""
+    # NumPy solo se carga al pedir un reporte
+    import numpy as np
+
+    H = Historial_Academico
+    consulta = select(H.materia, H.calificacion_numerica).where(
+        H.calificacion_numerica.isnot(None), H.id_estudiante.isnot(None))
+    if semestre is not None:
+        consulta = consulta.where(H.semestre == semestre)
+    if materias:
+        consulta = consulta.where(H.materia.in_(materias))
+    filas = db.execute(consulta).all()
+    if not filas:
+        return []
+    nombres, codigos = np.unique(np.array([f[0] for f in filas], dtype=object).astype(str), return_inverse=True)
+    valores = np.fromiter((f[1] for f in filas), dtype=np.float64, count=len(filas))
+
+    conteos = np.bincount(codigos, minlength=len(nombres))
+    promedios = np.bincount(codigos, weights=valores, minlength=len(nombres)) / conteos
+    reprobados = np.bincount(codigos, weights=valores < CALIFICACION_APROBATORIA, minlength=len(nombres))
+    # Ordenados por materia y calificación: cada materia queda en un tramo contiguo
+    orden = np.lexsort((valores, codigos))
+    tramos = np.split(valores[orden], np.cumsum(conteos)[:-1])
+    resultado = []
+    for i, nombre in enumerate(nombres):
+        tramo = tramos[i]
+        p10, mediana, p90 = np.percentile(tramo, [10, 50, 90])
+        resultado.append({
+            "materia": str(nombre), "n": int(conteos[i]),
+            "promedio": round(float(promedios[i]), 3), "desviacion": round(float(tramo.std()), 3),
+            "minimo": float(tramo[0]), "p10": round(float(p10), 3), "mediana": round(float(mediana), 3),
+            "p90": round(float(p90), 3), "maximo": float(tramo[-1]),
+            "tasa_reprobacion": round(float(reprobados[i] / conteos[i]), 4),
+        })
+    return resultado
+
+def rellenar_numericas(db: Session) -> int:
+    """Calcula calificacion_numerica de las filas que aún no la tienen."""
+    H = Historial_Academico
+    actualizadas, ultimo_id = 0, 0
+    while True:
+        filas = (db.query(H.id, H.calificacion)
+                 .filter(H.id > ultimo_id, H.calificacion_numerica.is_(None), H.calificacion.isnot(None))
+                 .order_by(H.id).limit(TAMANO_LOTE_ANALITICA).all())
+        if not filas:
+            return actualizadas
+        valores = [{"id": f.id, "calificacion_numerica": a_numero(f.calificacion)} for f in filas]
+        valores = [v for v in valores if v["calificacion_numerica"] is not None]
+        if valores:
+            db.bulk_update_mappings(H, valores)
+        db.commit()
+        actualizadas += len(valores)
+        ultimo_id = filas[-1].id
+
+def reconstruir(db: Session) -> int:
+    """Recalcula estadisticas_calificaciones desde historiales con un solo INSERT ... SELECT."""
+    H, E = Historial_Academico, Estadistica_Calificacion
+    valor = H.calificacion_numerica
+    # En SQLite CAST trunca hacia cero (la parte entera, descartados los negativos); PostgreSQL redondea
+    entera = cast(func.floor(valor), Integer) if db.get_bind().dialect.name == "postgresql" else cast(valor, Integer)
+    c = case((valor < 0, 0), (valor >= CALIFICACION_MAXIMA, CALIFICACION_MAXIMA), else_=entera)
+    consulta = (select(H.materia, H.semestre, c, func.count(), func.sum(valor), func.sum(valor * valor))
+                .where(valor.isnot(None), H.id_estudiante.isnot(None))
+                .group_by(H.materia, H.semestre, c))
+    db.query(E).delete()
+    db.execute(insert(E).from_select(["materia", "semestre", "cubeta", "conteo", "suma", "suma_cuadrados"], consulta))
+    db.commit()
+    return db.query(func.count()).select_from(E).scalar()
+
+def main():
+    from app.basedatos import SesionLocal, iniciar_bd
+    parser = argparse.ArgumentParser(description="Estadísticas de calificaciones")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    sub.add_parser("reconstruir", help="Recalcula las calificaciones numéricas y los agregados")
+    args = parser.parse_args()
+
+    iniciar_bd()
+    db = SesionLocal()
+    try:
+        if args.comando == "reconstruir":
+            print(f"Calificaciones numéricas calculadas: {rellenar_numericas(db)}")
+            print(f"Filas de agregados: {reconstruir(db)}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,146 @@
-from email.mime.application import MIMEApplication
-from email.mime.multipart import MIMEMultipart
 from jose import JWTError, jwt
 import os
-import smtplib
-from email.mime.text import MIMEText
 from dotenv import load_dotenv
 #from fastapi.security import OAuth2PasswordBearer
 from fastapi import Depends, HTTPException, status, Request
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
 from app.crud import obtener_usuario
-from app.basedatos import SesionLocal
+from app import crud_async
+from app.basedatos import obtener_bd
+from app.cache import cache_usuarios
+from app.modelos import Usuario
 from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
+import secrets
+import string
+import time
+from app.metricas import registrar_argon2
 
 load_dotenv()
 llave = os.getenv("Clave_Secreta")
 #esquema = OAuth2PasswordBearer(tokenUrl="/auth/login")
-ph = PasswordHasher()
 
-def obtener_bd():
-    db = SesionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Perfiles de costo de Argon2id; los hashes con parámetros anteriores se recalculan al iniciar sesión
+PERFILES_ARGON2 = {
+    "bajo": PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1),
+    "estandar": PasswordHasher(),
+    "alto": PasswordHasher(time_cost=4, memory_cost=131072, parallelism=4),
+}
+
+class ServicioHash:
+    """Ejecuta Argon2 en un pool de hilos acotado; rechaza con 503 cuando la cola está llena."""
+
+    def __init__(self, hasher: PasswordHasher, trabajadores: int, max_pendientes: int):
+        self.hasher = hasher
+        self.trabajadores = trabajadores
+        self.max_pendientes = max_pendientes
+        self._ejecutor = ThreadPoolExecutor(max_workers=trabajadores, thread_name_prefix="argon2")
+        self._candado = threading.Lock()
+        self._pendientes = 0
+        self._rechazados = 0
+        self._completados = 0
+
+    @staticmethod
+    def _medir(funcion, *args):
+        inicio = time.perf_counter()
+        resultado = funcion(*args)
+        return resultado, time.perf_counter() - inicio
+
+    async def _ejecutar(self, operacion: str, funcion, *args):
+        with self._candado:
+            if self._pendientes >= self.max_pendientes:
+                self._rechazados += 1
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                    detail="Servidor ocupado, intenta de nuevo",
+                                    headers={"Retry-After": "1"})
+            self._pendientes += 1
+        try:
+            resultado, duracion = await asyncio.get_running_loop().run_in_executor(self._ejecutor, self._medir, funcion, *args)
+            # Se registra aquí y no en el hilo: run_in_executor no copia el contexto de la petición
+            registrar_argon2(operacion, duracion)
+            return resultado
+        finally:
+            with self._candado:
+                self._pendientes -= 1
+                self._completados += 1
+
+    def _verificar(self, hash_contraseña: str, contraseña: str) -> bool:
+        try:
+            return self.hasher.verify(hash_contraseña, contraseña)
+        except (VerificationError, InvalidHashError):
+            return False
+
+    async def hash(self, contraseña: str) -> str:
+        return await self._ejecutar("hash", self.hasher.hash, contraseña)
+
+    async def verificar(self, hash_contraseña: str, contraseña: str) -> bool:
+        return await self._ejecutar("verificar", self._verificar, hash_contraseña, contraseña)
+
+    def necesita_rehash(self, hash_contraseña: str) -> bool:
+        try:
+            return self.hasher.check_needs_rehash(hash_contraseña)
+        except InvalidHashError:
+            return True
+
+    def hash_lote(self, contraseñas: list) -> list:
+        # Para trabajos en segundo plano: comparte el pool sin pasar por el límite de la cola,
+        # en tandas del tamaño del pool para que los inicios de sesión no esperen todo el lote
+        hashes = []
+        for inicio in range(0, len(contraseñas), self.trabajadores):
+            tanda = contraseñas[inicio:inicio + self.trabajadores]
+            for resultado, duracion in self._ejecutor.map(self._medir, [self.hasher.hash] * len(tanda), tanda):
+                registrar_argon2("hash", duracion)
+                hashes.append(resultado)
+        return hashes
+
+    def metricas(self) -> dict:
+        with self._candado:
+            return {
+                "pendientes": self._pendientes,
+                "max_pendientes": self.max_pendientes,
+                "trabajadores": self.trabajadores,
+                "completados": self._completados,
+                "rechazados": self._rechazados,
+            }
+
+def generar_contraseña_provisional(longitud: int = 10) -> str:
+    caracteres = string.ascii_letters + string.digits
+    return ''.join(secrets.choice(caracteres) for _ in range(longitud))
 
-def verificar_usuario(db: Session, matricula: str, contraseña: str):
-    user = obtener_usuario(db, matricula)
+servicio_hash = ServicioHash(
+    PERFILES_ARGON2[os.getenv("Perfil_Argon2", "estandar")],
+    trabajadores=int(os.getenv("Hilos_Argon2", min(4, os.cpu_count() or 1))),
+    max_pendientes=int(os.getenv("Max_Pendientes_Argon2", "64")),
+)
+
+async def verificar_usuario(db: AsyncSession, matricula: str, contraseña: str):
+    user = await crud_async.obtener_usuario(db, matricula)
     if not user:
         return None
-    try:
-        ph.verify(user.contraseña, contraseña
-        )
-    except:
+    if not await servicio_hash.verificar(user.contraseña, contraseña):
         return None
+    if servicio_hash.necesita_rehash(user.contraseña):
+        await crud_async.actualizar_hash_contraseña(db, user, await servicio_hash.hash(contraseña))
     return user
 
+def copiar_usuario(usuario: Usuario) -> Usuario:
+    # Copia sin sesión: se comparte entre peticiones sin riesgo de quedar expirada por un commit
+    return Usuario(
+        id=usuario.id,
+        nombre=usuario.nombre,
+        correo=usuario.correo,
+        matricula=usuario.matricula,
+        rol=usuario.rol,
+        primer_login=usuario.primer_login,
+        clave_publica=usuario.clave_publica,
+        version=usuario.version,
+    )
+
 def obtener_usuario_actual(request: Request, token: Optional[str] = None, db: Session = Depends(obtener_bd)):
     error_credenciales = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -59,30 +164,20 @@ def obtener_usuario_actual(request: Request, token: Optional[str] = None, db: Se
     except JWTError:
         raise error_credenciales
     
-    usuario = obtener_usuario(db, matricula)
+    usuario = cache_usuarios.obtener(matricula)
+    if usuario is not None:
+        # La copia vale mientras la fila siga existiendo con la misma versión; otro worker pudo
+        # eliminar o cambiar al usuario sin poder invalidar la caché de este proceso
+        version = db.query(Usuario.version).filter(Usuario.matricula == matricula).scalar()
+        if version is None:
+            cache_usuarios.invalidar(matricula)
+            raise error_credenciales
+        if version != usuario.version:
+            usuario = None
     if usuario is None:
-        raise error_credenciales
+        persistente = obtener_usuario(db, matricula)
+        if persistente is None:
+            raise error_credenciales
+        usuario = copiar_usuario(persistente)
+        cache_usuarios.guardar(matricula, usuario)
     return usuario
-
-def enviar_correo(destinatario: str, asunto: str, cuerpo: str, adjunto: bytes = None, nombre_adjunto: str = None):
-    smtp_servidor = os.getenv("Servidor_SMTP")
-    smtp_puerto = os.getenv("Puerto_SMTP")
-    smtp_usuario = os.getenv("Usuario_SMTP")
-    smtp_contraseña = os.getenv("Contrasena_SMTP")
-
-    mensaje = MIMEMultipart()
-    mensaje["From"] = smtp_usuario
-    mensaje["To"] = destinatario
-    mensaje["Subject"] = asunto
-
-    mensaje.attach(MIMEText(cuerpo, "plain"))
-
-    if adjunto and nombre_adjunto:
-        parte = MIMEApplication(adjunto)
-        parte.add_header("Content-Disposition", f'attachment; filename="{nombre_adjunto}"')
-        mensaje.attach(parte)
-
-    with smtplib.SMTP(smtp_servidor, smtp_puerto) as server:
-        server.starttls()
-        server.login(smtp_usuario, smtp_contraseña)
-        server.send_message(mensaje)
\ No newline at end of file
@@ -0,0 +1,56 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class CacheTTL:
+    """LRU acotado con expiración por entrada, seguro entre hilos."""
+
+    def __init__(self, maximo: int, ttl: float):
+        self.maximo = maximo
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._candado = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave):
+        with self._candado:
+            entrada = self._datos.get(clave)
+            if entrada is None or entrada[0] < time.monotonic():
+                if entrada is not None:
+                    del self._datos[clave]
+                self.fallos += 1
+                return None
+            self._datos.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[1]
+
+    def guardar(self, clave, valor):
+        with self._candado:
+            self._datos[clave] = (time.monotonic() + self.ttl, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.maximo:
+                self._datos.popitem(last=False)
+
+    def invalidar(self, clave):
+        with self._candado:
+            self._datos.pop(clave, None)
+
+    def limpiar(self):
+        with self._candado:
+            self._datos.clear()
+
+    def metricas(self) -> dict:
+        with self._candado:
+            return {"entradas": len(self._datos), "aciertos": self.aciertos, "fallos": self.fallos}
+
+# Usuarios autenticados por matrícula (el "sub" del JWT). invalidar() solo llega al proceso que hizo
+# el cambio; los demás workers comparan la copia con Usuario.version en cada petición (ver auth).
+cache_usuarios = CacheTTL(
+    maximo=int(os.getenv("Max_Cache_Usuarios", "1024")),
+    ttl=float(os.getenv("TTL_Cache_Usuarios", "60")),
+)
@@ -1,28 +1,180 @@
-from Crypto.PublicKey import RSA
-from Crypto.Cipher import PKCS1_OAEP, ChaCha20_Poly1305
+import base64
+import binascii
 import secrets
+import itertools
+import struct
+import time
+from app.metricas import registrar_cifrado
+
+TAMANO_NONCE = 12
+TAMANO_TAG = 16
 
 def generar_clave_chacha():
     return secrets.token_bytes(32)
 
-def cifrar_clave(clave: bytes, llave_publica_pem: str) -> bytes:
-    llave_publica = RSA.import_key(llave_publica_pem.encode())
-    rsa = PKCS1_OAEP.new(llave_publica)
-    clave_cifrada = rsa.encrypt(clave)
-    return clave_cifrada
+def decodificar_llave(llave_bytes: bytes) -> bytes:
+    # Los archivos de clave se descargan en base64; se aceptan también los 32 bytes en crudo
+    try:
+        return base64.b64decode(llave_bytes.strip(), validate=True)
+    except binascii.Error:
+        return llave_bytes
+
+def _aead(key: bytes):
+    # cryptography se carga con el primer cifrado y no al importar la app
+    from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+    return ChaCha20Poly1305(key)
 
-def descifrar_clave(clave_cifrada: bytes, llave_privada_pem: str) -> bytes:
-    llave_privada = RSA.import_key(llave_privada_pem.encode())
-    rsa = PKCS1_OAEP.new(llave_privada)
-    clave_descifrada = rsa.decrypt(clave_cifrada)
-    return clave_descifrada
+def _descifrar(aead, nonce: bytes, datos: bytes, asociados: bytes = None) -> bytes:
+    from cryptography.exceptions import InvalidTag
+    try:
+        return aead.decrypt(nonce, datos, asociados)
+    except InvalidTag:
+        raise ValueError("MAC check failed")
 
 def cifrar_chacha20_poly1305(data: bytes, key: bytes):
-    cipher = ChaCha20_Poly1305.new(key=key)
-    nonce = cipher.nonce
-    ciphertext, tag = cipher.encrypt_and_digest(data)
-    return nonce, ciphertext, tag
+    nonce = secrets.token_bytes(TAMANO_NONCE)
+    inicio = time.perf_counter()
+    cifrado = _aead(key).encrypt(nonce, data, None)
+    registrar_cifrado("cifrar", len(data), time.perf_counter() - inicio)
+    return nonce, cifrado[:-TAMANO_TAG], cifrado[-TAMANO_TAG:]
 
 def descifrar_chacha20_poly1305(nonce: bytes, ciphertext: bytes, tag: bytes, key: bytes):
-    cipher = ChaCha20_Poly1305.new(key=key, nonce=nonce)
-    return cipher.decrypt_and_verify(ciphertext, tag)
\ No newline at end of file
+    inicio = time.perf_counter()
+    claro = _descifrar(_aead(key), nonce, ciphertext + tag)
+    registrar_cifrado("descifrar", len(claro), time.perf_counter() - inicio)
+    return claro
+
+# Cifrado de sobre: cada documento usa una llave de datos propia, guardada envuelta con la llave
+# simétrica de su versión. El contexto (la referencia del blob) impide mover la llave a otro documento.
+def envolver_llave(llave_datos: bytes, key: bytes, contexto: str) -> bytes:
+    nonce = secrets.token_bytes(TAMANO_NONCE)
+    return nonce + _aead(key).encrypt(nonce, llave_datos, contexto.encode())
+
+def desenvolver_llave(envuelta: bytes, key: bytes, contexto: str) -> bytes:
+    return _descifrar(_aead(key), envuelta[:TAMANO_NONCE], envuelta[TAMANO_NONCE:], contexto.encode())
+
+# Formato segmentado (estilo STREAM): cabecera + segmentos cifrados por separado.
+# Nonce de cada segmento = prefijo (7 bytes) || contador (4 bytes) || bandera de último (1 byte),
+# así un segmento reordenado, repetido o truncado no pasa la verificación.
+MAGIA = b"CP20S"
+VERSION_SEGMENTADO = 1
+TAMANO_SEGMENTO = 64 * 1024
+_CABECERA = struct.Struct(">5sBI7s")
+TAMANO_CABECERA = _CABECERA.size
+
+def _nonce_segmento(prefijo: bytes, contador: int, final: bool) -> bytes:
+    if contador >= 2 ** 32:
+        raise ValueError("Demasiados segmentos para un mismo archivo")
+    return prefijo + struct.pack(">IB", contador, 1 if final else 0)
+
+def _cifrar_segmento(aead, cabecera: bytes, prefijo: bytes, contador: int, final: bool, datos: bytes) -> bytes:
+    inicio = time.perf_counter()
+    cifrado = aead.encrypt(_nonce_segmento(prefijo, contador, final), datos, cabecera)
+    registrar_cifrado("cifrar", len(datos), time.perf_counter() - inicio)
+    return cifrado
+
+def _descifrar_segmento(aead, cabecera: bytes, prefijo: bytes, contador: int, final: bool, datos: bytes) -> bytes:
+    if len(datos) < TAMANO_TAG:
+        raise ValueError("Segmento truncado")
+    inicio = time.perf_counter()
+    claro = _descifrar(aead, _nonce_segmento(prefijo, contador, final), datos, cabecera)
+    registrar_cifrado("descifrar", len(claro), time.perf_counter() - inicio)
+    return claro
+
+def cifrar_segmentado(bloques, key: bytes, tamano_segmento: int = TAMANO_SEGMENTO):
+    """Cifra un iterable de bloques y produce el archivo cifrado por partes."""
+    aead = _aead(key)
+    prefijo = secrets.token_bytes(7)
+    cabecera = _CABECERA.pack(MAGIA, VERSION_SEGMENTADO, tamano_segmento, prefijo)
+    yield cabecera
+    contador = 0
+    buffer = bytearray()
+    for bloque in bloques:
+        buffer += bloque
+        # Se conserva al menos un byte para saber cuál es el último segmento
+        while len(buffer) > tamano_segmento:
+            yield _cifrar_segmento(aead, cabecera, prefijo, contador, False, bytes(buffer[:tamano_segmento]))
+            del buffer[:tamano_segmento]
+            contador += 1
+    yield _cifrar_segmento(aead, cabecera, prefijo, contador, True, bytes(buffer))
+
+def leer_cabecera(cabecera: bytes):
+    """Valida la cabecera del formato segmentado y devuelve (tamano_segmento, prefijo)."""
+    if len(cabecera) < _CABECERA.size:
+        raise ValueError("Cabecera incompleta")
+    magia, version, tamano_segmento, prefijo = _CABECERA.unpack(cabecera[:_CABECERA.size])
+    if magia != MAGIA or version != VERSION_SEGMENTADO:
+        raise ValueError("Formato de archivo cifrado no soportado")
+    return tamano_segmento, prefijo
+
+def _descifrar_desde(bloques, key: bytes, cabecera: bytes, contador: int):
+    # `bloques` empieza en el segmento `contador` y llega hasta el final del archivo
+    tamano_segmento, prefijo = leer_cabecera(cabecera)
+    aead = _aead(key)
+    tamano_cifrado = tamano_segmento + TAMANO_TAG
+    buffer = bytearray()
+    for bloque in bloques:
+        buffer += bloque
+        while len(buffer) > tamano_cifrado:
+            yield _descifrar_segmento(aead, cabecera, prefijo, contador, False, bytes(buffer[:tamano_cifrado]))
+            del buffer[:tamano_cifrado]
+            contador += 1
+    yield _descifrar_segmento(aead, cabecera, prefijo, contador, True, bytes(buffer))
+
+def descifrar_segmentado(bloques, key: bytes):
+    """Descifra y verifica segmento por segmento; falla si el archivo está truncado."""
+    buffer = bytearray()
+    bloques = iter(bloques)
+    for bloque in bloques:
+        buffer += bloque
+        if len(buffer) >= _CABECERA.size:
+            break
+    cabecera = bytes(buffer[:_CABECERA.size])
+    leer_cabecera(cabecera)
+    yield from _descifrar_desde(itertools.chain([bytes(buffer[_CABECERA.size:])], bloques), key, cabecera, 0)
+
+def tamano_claro(cabecera: bytes, tamano_cifrado: int) -> int:
+    """Bytes en claro de un archivo segmentado a partir del tamaño del cifrado, sin descifrarlo."""
+    tamano_segmento, _ = leer_cabecera(cabecera)
+    cuerpo = tamano_cifrado - _CABECERA.size
+    segmentos = max(1, -(-cuerpo // (tamano_segmento + TAMANO_TAG)))
+    return cuerpo - segmentos * TAMANO_TAG
+
+def desplazamiento_rango(cabecera: bytes, inicio: int):
+    """Segmento que contiene el byte en claro `inicio` y su posición dentro del archivo cifrado."""
+    tamano_segmento, _ = leer_cabecera(cabecera)
+    segmento = inicio // tamano_segmento
+    return segmento, _CABECERA.size + segmento * (tamano_segmento + TAMANO_TAG)
+
+def descifrar_rango(bloques, key: bytes, cabecera: bytes, inicio: int, fin: int):
+    """Descifra solo los segmentos que cubren los bytes en claro [inicio, fin].
+
+    `bloques` debe empezar en el desplazamiento que devuelve desplazamiento_rango.
+    """
+    tamano_segmento, _ = leer_cabecera(cabecera)
+    segmento = inicio // tamano_segmento
+    posicion = segmento * tamano_segmento
+    for claro in _descifrar_desde(bloques, key, cabecera, segmento):
+        siguiente = posicion + len(claro)
+        if siguiente > inicio:
+            yield claro[max(0, inicio - posicion):fin + 1 - posicion]
+        if siguiente > fin:
+            return
+        posicion = siguiente
+
+def es_segmentado(inicio: bytes) -> bool:
+    return inicio[:len(MAGIA)] == MAGIA and len(inicio) > len(MAGIA) and inicio[len(MAGIA)] == VERSION_SEGMENTADO
+
+def descifrar_documento(bloques, key: bytes):
+    """Descifra un documento en formato segmentado o en el formato anterior (nonce + tag + ciphertext)."""
+    bloques = iter(bloques)
+    inicio = bytearray()
+    for bloque in bloques:
+        inicio += bloque
+        if len(inicio) >= _CABECERA.size:
+            break
+    if es_segmentado(inicio):
+        yield from descifrar_segmentado(itertools.chain([bytes(inicio)], bloques), key)
+        return
+    datos = bytes(inicio) + b"".join(bloques)
+    yield descifrar_chacha20_poly1305(datos[:TAMANO_NONCE], datos[TAMANO_NONCE + TAMANO_TAG:], datos[TAMANO_NONCE:TAMANO_NONCE + TAMANO_TAG], key)
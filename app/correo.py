@@ -0,0 +1,232 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from app.basedatos import SesionLocal
+from app.metricas import registrar_smtp
+from app.modelos import Correo_Pendiente
+
+load_dotenv()
+
+MAX_INTENTOS = int(os.getenv("Max_Intentos_Correo", "5"))
+ESPERA_BASE = 30  # segundos; se duplica con cada intento fallido
+TAMANO_LOTE = int(os.getenv("Lote_Correo", "20"))
+# Una conexión SMTP inactiva más de este tiempo se cierra
+INACTIVIDAD_MAXIMA = 60
+# Un correo "enviando" más de este tiempo quedó huérfano (proceso caído) y se reintenta
+RECLAMO_EXPIRADO = timedelta(minutes=10)
+
+def _ahora() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def encolar_correo(db: Session, destinatario: str, asunto: str, cuerpo: str, adjunto: bytes = None, nombre_adjunto: str = None, confirmar: bool = True):
+    correo = Correo_Pendiente(
+        destinatario=destinatario,
+        asunto=asunto,
+        cuerpo=cuerpo,
+        adjunto=adjunto,
+        nombre_adjunto=nombre_adjunto,
+        estado="pendiente",
+        intentos=0,
+        siguiente_intento=_ahora(),
+        creado=_ahora(),
+    )
+    db.add(correo)
+    # Con confirmar=False el correo se guarda en la transacción de quien llama
+    if confirmar:
+        db.commit()
+        despachador.avisar()
+    return correo
+
+def cuerpo_registro_estudiante(nombre: str, matricula: str, contraseña_provisional: str) -> str:
+    enlace_cambio = f"http://localhost:8000/auth/establecer-contraseña?matricula={matricula}"
+    return (
+        f"Hola {nombre},\n\n"
+        f"Has sido registrado como estudiante.\n"
+        f"Tu matrícula es: {matricula}\n"
+        f"Tu contraseña provisional es: {contraseña_provisional}\n"
+        f"Inicia sesión y cambia tu contraseña en: {enlace_cambio}\n\n"
+    )
+
+def construir_mensaje(remitente: str, correo: Correo_Pendiente):
+    # email.mime y smtplib se cargan con el primer correo, no al arrancar cada worker
+    from email.mime.application import MIMEApplication
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    mensaje = MIMEMultipart()
+    mensaje["From"] = remitente
+    mensaje["To"] = correo.destinatario
+    mensaje["Subject"] = correo.asunto
+
+    mensaje.attach(MIMEText(correo.cuerpo, "plain"))
+
+    if correo.adjunto and correo.nombre_adjunto:
+        parte = MIMEApplication(correo.adjunto)
+        parte.add_header("Content-Disposition", f'attachment; filename="{correo.nombre_adjunto}"')
+        mensaje.attach(parte)
+    return mensaje
+
+class ConexionSMTP:
+    """Conexión autenticada que se reutiliza entre mensajes y se reabre si el servidor la cierra."""
+
+    def __init__(self):
+        self.servidor = os.getenv("Servidor_SMTP")
+        self.puerto = int(os.getenv("Puerto_SMTP", "587"))
+        self.usuario = os.getenv("Usuario_SMTP")
+        self.contraseña = os.getenv("Contrasena_SMTP")
+        self.remitente = os.getenv("Remitente_SMTP") or self.usuario
+        self.tls = os.getenv("TLS_SMTP", "1") == "1"
+        self._smtp = None
+        self._ultimo_uso = 0.0
+
+    def _abrir(self):
+        import smtplib
+        smtp = smtplib.SMTP(self.servidor, self.puerto, timeout=30)
+        if self.tls:
+            smtp.starttls()
+        if self.usuario and self.contraseña:
+            smtp.login(self.usuario, self.contraseña)
+        self._smtp = smtp
+
+    def enviar(self, mensaje):
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] != 250:
+                    self.cerrar()
+            except OSError:
+                self.cerrar()
+        inicio = time.perf_counter()
+        try:
+            if self._smtp is None:
+                self._abrir()
+            self._smtp.send_message(mensaje)
+        except Exception:
+            registrar_smtp(time.perf_counter() - inicio, error=True)
+            raise
+        registrar_smtp(time.perf_counter() - inicio)
+        self._ultimo_uso = datetime.now().timestamp()
+
+    def cerrar_si_inactiva(self):
+        if self._smtp is not None and datetime.now().timestamp() - self._ultimo_uso > INACTIVIDAD_MAXIMA:
+            self.cerrar()
+
+    def cerrar(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except OSError:
+                pass
+            self._smtp = None
+
+class DespachadorCorreo:
+    """Hilos en segundo plano que envían la bandeja de salida en lotes, cada uno con su conexión SMTP."""
+
+    def __init__(self, hilos: int):
+        self.hilos = hilos
+        self._aviso = threading.Event()
+        self._detener = threading.Event()
+        self._trabajadores = []
+        self.enviados = 0
+        self.fallidos = 0
+
+    def avisar(self):
+        self._aviso.set()
+
+    def iniciar(self):
+        if self._trabajadores:
+            return
+        self._detener.clear()
+        for i in range(self.hilos):
+            hilo = threading.Thread(target=self._ciclo, name=f"correo-{i}", daemon=True)
+            hilo.start()
+            self._trabajadores.append(hilo)
+
+    def detener(self):
+        self._detener.set()
+        self._aviso.set()
+        for hilo in self._trabajadores:
+            hilo.join(timeout=10)
+        self._trabajadores = []
+
+    def pendientes(self) -> int:
+        db = SesionLocal()
+        try:
+            return db.query(Correo_Pendiente).filter(Correo_Pendiente.estado.in_(["pendiente", "enviando"])).count()
+        finally:
+            db.close()
+
+    def _reclamar(self, db: Session):
+        ahora = _ahora()
+        db.execute(
+            update(Correo_Pendiente)
+            .where(Correo_Pendiente.estado == "enviando", Correo_Pendiente.siguiente_intento < ahora - RECLAMO_EXPIRADO)
+            .values(estado="pendiente")
+        )
+        candidatos = [
+            i for (i,) in db.query(Correo_Pendiente.id)
+            .filter(Correo_Pendiente.estado == "pendiente", Correo_Pendiente.siguiente_intento <= ahora)
+            .order_by(Correo_Pendiente.siguiente_intento)
+            .limit(TAMANO_LOTE)
+        ]
+        reclamados = []
+        for id_correo in candidatos:
+            # El UPDATE condicional es atómico: otro hilo o proceso no puede reclamar el mismo correo
+            resultado = db.execute(
+                update(Correo_Pendiente)
+                .where(Correo_Pendiente.id == id_correo, Correo_Pendiente.estado == "pendiente")
+                .values(estado="enviando", siguiente_intento=ahora)
+            )
+            if resultado.rowcount == 1:
+                reclamados.append(id_correo)
+        db.commit()
+        if not reclamados:
+            return []
+        return db.query(Correo_Pendiente).filter(Correo_Pendiente.id.in_(reclamados)).all()
+
+    def procesar_lote(self, conexion: ConexionSMTP) -> int:
+        db = SesionLocal()
+        try:
+            lote = self._reclamar(db)
+            for correo in lote:
+                try:
+                    conexion.enviar(construir_mensaje(conexion.remitente, correo))
+                    correo.estado = "enviado"
+                    correo.adjunto = None
+                    self.enviados += 1
+                except Exception as error:
+                    conexion.cerrar()
+                    correo.intentos += 1
+                    correo.ultimo_error = str(error)[:300]
+                    if correo.intentos >= MAX_INTENTOS:
+                        correo.estado = "fallido"
+                        self.fallidos += 1
+                    else:
+                        correo.estado = "pendiente"
+                        correo.siguiente_intento = _ahora() + timedelta(seconds=ESPERA_BASE * 2 ** (correo.intentos - 1))
+            db.commit()
+            return len(lote)
+        finally:
+            db.close()
+
+    def _ciclo(self):
+        conexion = ConexionSMTP()
+        try:
+            while not self._detener.is_set():
+                try:
+                    procesados = self.procesar_lote(conexion)
+                except Exception:
+                    logging.getLogger("app.correo").exception("Error en el despachador de correo")
+                    procesados = 0
+                if procesados:
+                    continue
+                conexion.cerrar_si_inactiva()
+                self._aviso.wait(timeout=5)
+                self._aviso.clear()
+        finally:
+            conexion.cerrar()
+
+despachador = DespachadorCorreo(hilos=int(os.getenv("Hilos_Correo", "1")))
@@ -1,5 +1,14 @@
-from sqlalchemy.orm import Session
-from app import modelos
+import base64
+import hashlib
+from datetime import datetime, timezone
+from sqlalchemy import text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload, selectinload
+from app import analitica, modelos, versiones
+from app.almacen import obtener_almacen
+from app.cifrado import cifrar_segmentado, descifrar_documento, generar_clave_chacha, envolver_llave, desenvolver_llave
+from app.llaves import huella_clave, cifrar_clave_para
+from app.cache import cache_usuarios
 from fastapi import HTTPException
 
 def obtener_usuario(db: Session, matricula: str):
@@ -8,6 +17,8 @@ def obtener_usuario(db: Session, matricula: str):
 def crear_usuario(db: Session, nombre: str, correo: str, rol: str, contraseña: str, matricula: str):
     usuario = modelos.Usuario(nombre=nombre, correo=correo, rol=rol, contraseña=contraseña, matricula=matricula)
     db.add(usuario)
+    db.flush()
+    versiones.usuario_cambiado(db, usuario)
     db.commit()
     db.refresh(usuario)
     return usuario
@@ -15,48 +26,408 @@ def crear_usuario(db: Session, nombre: str, correo: str, rol: str, contraseña:
 def crear_estudiante(db: Session, matricula: str, telefono: int):
     estudiante = modelos.Estudiante(id=matricula, telefono=telefono)
     db.add(estudiante)
+    versiones.incrementar(db, "estudiantes", estudiantes=[matricula])
     db.commit()
     db.refresh(estudiante)
     return estudiante
 
+def actualizar_clave_publica(db: Session, id_usuario: int, clave_publica: str):
+    usuario = db.get(modelos.Usuario, id_usuario)
+    usuario.clave_publica = clave_publica
+    usuario.version += 1
+    # Las llaves de datos cifradas para la llave pública anterior ya no sirven; el jefe vuelve a concederlas
+    db.query(modelos.Acceso_Documento).filter(modelos.Acceso_Documento.id_usuario == id_usuario).delete()
+    db.commit()
+    cache_usuarios.invalidar(usuario.matricula)
+    return usuario
+
+def obtener_historial(db: Session, id_estudiante: int):
+    return db.query(modelos.Historial_Academico).filter(modelos.Historial_Academico.id_estudiante == id_estudiante).all()
+
+def _ahora() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+# Roles que reciben la llave de datos de cada documento cifrada con su llave pública
+ROLES_DOCUMENTOS = ("jefe", "staff")
+# Candado de transacción de PostgreSQL para los lotes de calificaciones (ver _bloquear_calificaciones)
+CANDADO_CALIFICACIONES = 7215002
+
+def cifrar_y_guardar(bloques, llave: bytes) -> dict:
+    """Cifra los bloques con una llave de datos nueva, la envuelve con `llave` y devuelve las columnas del catálogo."""
+    llave_datos = generar_clave_chacha()
+    sha = hashlib.sha256()
+    tamano = 0
+
+    def medir():
+        nonlocal tamano
+        for bloque in bloques:
+            sha.update(bloque)
+            tamano += len(bloque)
+            yield bloque
+
+    referencia = obtener_almacen().guardar(cifrar_segmentado(medir(), llave_datos))
+    return {"referencia_blob": referencia, "tamano": tamano, "hash_contenido": sha.hexdigest(), "subido": _ahora(),
+            "llave_envuelta": envolver_llave(llave_datos, llave, referencia)}
+
+def llave_de_datos(documento, llave: bytes) -> bytes:
+    """Llave que descifra el contenido: la de datos desenvuelta o, en documentos anteriores al sobre, la misma `llave`."""
+    if documento.llave_envuelta is None:
+        return llave
+    return desenvolver_llave(documento.llave_envuelta, llave, documento.referencia_blob)
+
+def obtener_titulares(db: Session) -> dict:
+    filas = db.query(modelos.Usuario.id, modelos.Usuario.clave_publica).filter(
+        modelos.Usuario.rol.in_(ROLES_DOCUMENTOS), modelos.Usuario.clave_publica.isnot(None))
+    return dict(filas.all())
+
+def accesos_documento(documento, llave: bytes, titulares: dict) -> list:
+    """Una fila por titular con la llave de datos cifrada con su llave pública."""
+    if not titulares:
+        return []
+    ahora = _ahora()
+    return [modelos.Acceso_Documento(id_documento=documento.id, id_usuario=id_usuario, llave_cifrada=cifrada, creado=ahora)
+            for id_usuario, cifrada in cifrar_clave_para(llave_de_datos(documento, llave), titulares).items()]
+
+def _abre_documentos(db: Session, id_version: int, llave: bytes) -> bool:
+    # La llave envuelta o el primer segmento de un documento de la versión bastan: ChaCha20-Poly1305 rechaza otra llave
+    documento = (db.query(modelos.Documento)
+                 .filter(modelos.Documento.version_llave == id_version)
+                 .order_by(modelos.Documento.id).first())
+    if documento is None:
+        return False
+    if documento.llave_envuelta is not None:
+        try:
+            llave_de_datos(documento, llave)
+        except ValueError:
+            return False
+        return True
+    if documento.referencia_blob:
+        bloques = obtener_almacen().leer_bloques(documento.referencia_blob)
+    else:
+        bloques = iter([base64.b64decode(documento.datos)])
+    try:
+        next(descifrar_documento(bloques, llave), None)
+    except ValueError:
+        return False
+    return True
+
+def resolver_version_llave(db: Session, llave: bytes, registrar: bool = False):
+    """Versión del registro que corresponde a la llave; con `registrar`, una llave desconocida crea una versión nueva.
+
+    Solo /jefe/generar-clave registra: una llave mal copiada no debe convertirse en una versión activa.
+    """
+    huella = huella_clave(llave)
+    version = db.query(modelos.Version_Llave).filter(modelos.Version_Llave.huella == huella).first()
+    if version is not None:
+        return version
+    # Versiones anteriores al registro: la llave se reconoce si abre uno de sus documentos
+    for heredada in db.query(modelos.Version_Llave).filter(modelos.Version_Llave.huella.is_(None)).all():
+        if _abre_documentos(db, heredada.id, llave):
+            heredada.huella = huella
+            db.commit()
+            return heredada
+    if not registrar:
+        return None
+    version = modelos.Version_Llave(huella=huella, estado="activa", creada=_ahora())
+    db.add(version)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Otra petición registró la misma llave al mismo tiempo
+        db.rollback()
+        return db.query(modelos.Version_Llave).filter(modelos.Version_Llave.huella == huella).one()
+    db.refresh(version)
+    return version
+
+def comprobar_version_para_subir(version):
+    """400 si la llave no tiene versión registrada o su versión ya no recibe documentos."""
+    if version is None:
+        raise HTTPException(status_code=400, detail="La llave no corresponde a ninguna versión registrada; genera una con /jefe/generar-clave")
+    if version.estado != "activa":
+        raise HTTPException(status_code=400, detail=f"La llave de la versión {version.id} está {version.estado}; usa la llave vigente")
+    return version
+
+def version_para_subir(db: Session, llave: bytes):
+    if len(llave) != 32:
+        raise HTTPException(status_code=400, detail="La llave simétrica debe ser de 32 bytes")
+    return comprobar_version_para_subir(resolver_version_llave(db, llave))
+
+def crear_documento(db: Session, id_estudiante: int, nombre_archivo: str, bloques, llave: bytes, version_llave: int,
+                    tipo: str = "expediente", id_subido_por: int = None):
+    documento = modelos.Documento(id_estudiante=id_estudiante, nombre_archivo=nombre_archivo, tipo=tipo,
+                                  id_subido_por=id_subido_por, version_llave=version_llave,
+                                  **cifrar_y_guardar(bloques, llave))
+    db.add(documento)
+    db.flush()
+    db.add_all(accesos_documento(documento, llave, obtener_titulares(db)))
+    versiones.incrementar(db, "estudiantes", estudiantes=[id_estudiante])
+    db.commit()
+    db.refresh(documento)
+    return documento
+
+def conceder_accesos(db: Session, usuario: modelos.Usuario, llave: bytes, lote: int = 500) -> dict:
+    """Da a `usuario` la llave de datos de cada documento de la versión de `llave`; no lee ningún blob."""
+    if not usuario.clave_publica:
+        raise ValueError("El usuario no tiene llave pública registrada")
+    version = resolver_version_llave(db, llave, registrar=False)
+    if version is None:
+        raise ValueError("La llave no corresponde a ninguna versión registrada")
+    D = modelos.Documento
+    concedidos, ultimo_id = 0, 0
+    while True:
+        documentos = (db.query(D.id, D.referencia_blob, D.llave_envuelta)
+                      .filter(D.version_llave == version.id, D.llave_envuelta.isnot(None), D.id > ultimo_id)
+                      .order_by(D.id).limit(lote).all())
+        if not documentos:
+            break
+        ids = [d.id for d in documentos]
+        db.query(modelos.Acceso_Documento).filter(modelos.Acceso_Documento.id_usuario == usuario.id,
+                                                  modelos.Acceso_Documento.id_documento.in_(ids)).delete(synchronize_session=False)
+        db.add_all(accesos_documento(d, llave, {usuario.id: usuario.clave_publica})[0] for d in documentos)
+        db.commit()
+        concedidos += len(ids)
+        ultimo_id = ids[-1]
+    # Los documentos anteriores al sobre no tienen llave de datos: los convierte un recifrado
+    sin_sobre = db.query(D.id).filter(D.version_llave == version.id, D.llave_envuelta.is_(None)).count()
+    return {"version": version.id, "concedidos": concedidos, "sin_sobre": sin_sobre}
+
+def revocar_accesos(db: Session, usuario: modelos.Usuario) -> int:
+    eliminados = db.query(modelos.Acceso_Documento).filter(modelos.Acceso_Documento.id_usuario == usuario.id).delete()
+    db.commit()
+    return eliminados
+
+def listar_documentos(db: Session, id_estudiante: int = None, matricula: str = None, tipo: str = None,
+                      despues_de: int = None, limite: int = 50):
+    """Página de metadatos del catálogo; `datos` es diferido y el cifrado vive en el almacén, así que no se lee."""
+    consulta = db.query(modelos.Documento)
+    if matricula:
+        consulta = consulta.join(modelos.Usuario, modelos.Usuario.id == modelos.Documento.id_estudiante).filter(
+            modelos.Usuario.matricula == matricula)
+    if id_estudiante is not None:
+        consulta = consulta.filter(modelos.Documento.id_estudiante == id_estudiante)
+    if tipo:
+        consulta = consulta.filter(modelos.Documento.tipo == tipo)
+    if despues_de is not None:
+        consulta = consulta.filter(modelos.Documento.id > despues_de)
+    documentos = consulta.order_by(modelos.Documento.id).limit(limite + 1).all()
+    siguiente = documentos[limite - 1].id if len(documentos) > limite else None
+    return documentos[:limite], siguiente
+
 def actualizar_contraseña(db: Session, matricula: str, nueva_contraseña_hash: str):
     usuario = db.query(modelos.Usuario).filter(modelos.Usuario.matricula == matricula).first()
     if usuario:
         usuario.contraseña = nueva_contraseña_hash
         usuario.primer_login = False
+        usuario.version += 1
         db.commit()
         db.refresh(usuario)
+    cache_usuarios.invalidar(matricula)
+    return usuario
+
+def actualizar_hash_contraseña(db: Session, usuario: modelos.Usuario, nuevo_hash: str):
+    usuario.contraseña = nuevo_hash
+    db.commit()
     return usuario
 
 def eliminar_usuario(db: Session, matricula: str):
     usuario = db.query(modelos.Usuario).filter(modelos.Usuario.matricula == matricula).first()
     if usuario:
+        if usuario.rol == "estudiante":
+            # Sus calificaciones dejan de contar en los agregados
+            deltas = analitica.nuevos_deltas()
+            for h in db.query(modelos.Historial_Academico).filter(modelos.Historial_Academico.id_estudiante == usuario.id):
+                analitica.acumular(deltas, h.materia, h.semestre, h.calificacion_numerica, -1)
+            _aplicar_estadisticas(db, deltas)
+        versiones.usuario_cambiado(db, usuario)
+        # Lo que subió o ejecutó se conserva sin autor (en PostgreSQL también lo hace ON DELETE SET NULL)
+        for tabla, columna in ((modelos.Documento, "id_subido_por"), (modelos.Importacion, "id_usuario"),
+                               (modelos.Recifrado, "id_usuario")):
+            db.execute(update(tabla).where(getattr(tabla, columna) == usuario.id).values({columna: None})
+                       .execution_options(synchronize_session=False))
         db.delete(usuario)
         db.commit()
+        cache_usuarios.invalidar(matricula)
         return True
     return False
 
-def actualizar_calificaciones(db: Session, matricula_estudiante: str, calificaciones: dict, matricula_modificador: str, llave_privada: str):
-    usuario = db.query(modelos.Usuario).filter_by(matricula=matricula_estudiante, rol="estudiante").first()
-    if not usuario:
-        raise HTTPException(status_code=404, detail="Estudiante no encontrado")
-    estudiante = db.query(modelos.Estudiante).filter_by(id=usuario.id).first()
-    if not estudiante:
-        raise HTTPException(status_code=404, detail="Estudiante no encontrado")
-    modificador = db.query(modelos.Usuario).filter_by(matricula=matricula_modificador).first()
+def _insertar_o_actualizar(db: Session, modelo):
+    # SQLite y PostgreSQL comparten la misma API de ON CONFLICT
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(modelo)
+
+def _bloquear_calificaciones(db: Session):
+    """Toma el escritor y serializa los lotes de calificaciones hasta el commit.
+
+    Los deltas de los agregados restan el valor anterior de cada fila: si dos lotes leyeran el mismo valor
+    anterior antes de que el otro confirme, ambos lo restarían y los agregados se desviarían.
+    """
+    db.escribiendo = True
+    conexion = db.connection()
+    if conexion.dialect.name == "postgresql":
+        # FOR UPDATE no alcanza: no bloquea las filas que el lote va a crear
+        conexion.execute(text("SELECT pg_advisory_xact_lock(:candado)"), {"candado": CANDADO_CALIFICACIONES})
+    elif conexion.dialect.name == "sqlite" and not conexion.connection.dbapi_connection.in_transaction:
+        # pysqlite abriría la transacción hasta el primer INSERT, después de leer los valores anteriores
+        conexion.exec_driver_sql("BEGIN IMMEDIATE")
+
+def actualizar_calificaciones_lote(db: Session, registros: list, modificador: modelos.Usuario):
+    """Aplica muchas calificaciones (matricula, materia, semestre, calificacion) con un solo commit.
+
+    Los errores señalan la posición del registro en el lote, o su `fila` si la trae (la línea de un CSV).
+    """
     if not modificador or modificador.rol not in ["jefe", "staff"]:
         raise HTTPException(status_code=403, detail="No autorizado para modificar calificaciones")
-    for materia, calificacion in calificaciones.items():
-        historial = db.query(modelos.Historial_Academico).filter_by(id_estudiante=estudiante.id, materia=materia).first()
-        if historial:
-            historial.calificacion = calificacion
-            historial.ultima_modificacion = f"Modificado por {modificador.nombre} ({modificador.matricula})"
-        else:
-            new_historial = modelos.Historial_Academico(
-                id_estudiante=estudiante.id,
-                materia=materia,
-                calificacion=calificacion,
-                ultima_modificacion=f"Modificado por {modificador.nombre} ({modificador.matricula})"
+    matriculas = list({r["matricula"] for r in registros})
+    ids = {}
+    for inicio in range(0, len(matriculas), 500):
+        ids.update(
+            db.query(modelos.Usuario.matricula, modelos.Estudiante.id)
+            .join(modelos.Estudiante, modelos.Estudiante.id == modelos.Usuario.id)
+            .filter(modelos.Usuario.rol == "estudiante", modelos.Usuario.matricula.in_(matriculas[inicio:inicio + 500]))
+            .all()
+        )
+    modificacion = f"Modificado por {modificador.nombre} ({modificador.matricula})"
+    filas, errores = {}, []
+    for numero, registro in enumerate(registros, start=1):
+        id_estudiante = ids.get(registro["matricula"])
+        if id_estudiante is None:
+            errores.append({"fila": registro.get("fila", numero), "matricula": registro["matricula"],
+                            "error": "Estudiante no encontrado"})
+            continue
+        semestre = registro.get("semestre") or ""
+        # Si una misma materia viene repetida gana la última
+        filas[(id_estudiante, registro["materia"], semestre)] = {
+            "id_estudiante": id_estudiante,
+            "materia": registro["materia"],
+            "semestre": semestre,
+            "calificacion": registro["calificacion"],
+            "calificacion_numerica": analitica.a_numero(registro["calificacion"]),
+            "ultima_modificacion": modificacion,
+        }
+    tabla = modelos.Historial_Academico
+    # Los agregados se ajustan con la diferencia entre el valor anterior y el nuevo de cada fila; los anteriores
+    # se leen en el escritor, dentro de la transacción que escribe
+    deltas = analitica.nuevos_deltas()
+    estudiantes = list({id_estudiante for id_estudiante, _, _ in filas})
+    if filas:
+        _bloquear_calificaciones(db)
+    for inicio in range(0, len(estudiantes), 500):
+        anteriores = db.query(tabla.id_estudiante, tabla.materia, tabla.semestre, tabla.calificacion_numerica).filter(
+            tabla.id_estudiante.in_(estudiantes[inicio:inicio + 500]))
+        for anterior in anteriores:
+            if (anterior.id_estudiante, anterior.materia, anterior.semestre) in filas:
+                analitica.acumular(deltas, anterior.materia, anterior.semestre, anterior.calificacion_numerica, -1)
+    for fila in filas.values():
+        analitica.acumular(deltas, fila["materia"], fila["semestre"], fila["calificacion_numerica"], 1)
+    filas = list(filas.values())
+    for inicio in range(0, len(filas), 500):
+        sentencia = _insertar_o_actualizar(db, tabla).values(filas[inicio:inicio + 500])
+        db.execute(sentencia.on_conflict_do_update(
+            index_elements=[tabla.id_estudiante, tabla.materia, tabla.semestre],
+            set_={
+                "calificacion": sentencia.excluded.calificacion,
+                "calificacion_numerica": sentencia.excluded.calificacion_numerica,
+                "ultima_modificacion": sentencia.excluded.ultima_modificacion,
+            },
+        ))
+    _aplicar_estadisticas(db, deltas)
+    if filas:
+        versiones.incrementar(db, "estudiantes", "calificaciones", estudiantes=estudiantes)
+    db.commit()
+    return {"actualizadas": len(filas), "errores": errores}
+
+def _aplicar_estadisticas(db: Session, deltas):
+    # En la misma transacción que las calificaciones: los agregados nunca quedan a medias
+    tabla = modelos.Estadistica_Calificacion
+    filas = analitica.filas_deltas(deltas)
+    for inicio in range(0, len(filas), 500):
+        sentencia = _insertar_o_actualizar(db, tabla).values(filas[inicio:inicio + 500])
+        db.execute(sentencia.on_conflict_do_update(
+            index_elements=[tabla.materia, tabla.semestre, tabla.cubeta],
+            set_={
+                "conteo": tabla.conteo + sentencia.excluded.conteo,
+                "suma": tabla.suma + sentencia.excluded.suma,
+                "suma_cuadrados": tabla.suma_cuadrados + sentencia.excluded.suma_cuadrados,
+            },
+        ))
+
+def actualizar_calificaciones(db: Session, matricula_estudiante: str, calificaciones: dict, matricula_modificador: str, llave_privada: str):
+    modificador = db.query(modelos.Usuario).filter_by(matricula=matricula_modificador).first()
+    registros = [{"matricula": matricula_estudiante, "materia": materia, "calificacion": calificacion}
+                 for materia, calificacion in calificaciones.items()]
+    resultado = actualizar_calificaciones_lote(db, registros, modificador)
+    if resultado["errores"]:
+        raise HTTPException(status_code=404, detail="Estudiante no encontrado")
+
+def obtener_staff(db: Session):
+    return db.query(modelos.Usuario).filter(modelos.Usuario.rol == "staff").all()
+
+def _consulta_estudiantes(db: Session):
+    # Número constante de consultas: usuarios+estudiantes, historiales y metadatos de documentos
+    return (
+        db.query(modelos.Usuario)
+        .filter(modelos.Usuario.rol == "estudiante")
+        .options(
+            joinedload(modelos.Usuario.estudiante).options(
+                selectinload(modelos.Estudiante.historial),
+                selectinload(modelos.Estudiante.documentos).load_only(
+                    modelos.Documento.id,
+                    modelos.Documento.id_estudiante,
+                    modelos.Documento.tipo,
+                    modelos.Documento.nombre_archivo,
+                    modelos.Documento.tamano,
+                    modelos.Documento.subido,
+                ),
             )
-            db.add(new_historial)
-    db.commit()
\ No newline at end of file
+        )
+        .order_by(modelos.Usuario.id)
+    )
+
+def listar_estudiantes(db: Session, despues_de: int = None, limite: int = 50, nombre: str = None,
+                       matricula: str = None, semestre: str = None,
+                       calificacion_min: str = None, calificacion_max: str = None):
+    consulta = _consulta_estudiantes(db)
+    if despues_de is not None:
+        consulta = consulta.filter(modelos.Usuario.id > despues_de)
+    if nombre:
+        # Rango en lugar de LIKE para aprovechar ix_usuarios_nombre
+        consulta = consulta.filter(modelos.Usuario.nombre >= nombre, modelos.Usuario.nombre < nombre + "\uffff")
+    if matricula:
+        consulta = consulta.filter(modelos.Usuario.matricula == matricula)
+    if semestre or calificacion_min or calificacion_max:
+        historial = db.query(modelos.Historial_Academico.id).filter(
+            modelos.Historial_Academico.id_estudiante == modelos.Usuario.id
+        )
+        if semestre:
+            historial = historial.filter(modelos.Historial_Academico.semestre == semestre)
+        # Comparación numérica ("10" > "9"); un límite que no es número se compara como texto
+        H = modelos.Historial_Academico
+        if calificacion_min:
+            valor = analitica.a_numero(calificacion_min)
+            historial = historial.filter(H.calificacion_numerica >= valor if valor is not None else H.calificacion >= calificacion_min)
+        if calificacion_max:
+            valor = analitica.a_numero(calificacion_max)
+            historial = historial.filter(H.calificacion_numerica <= valor if valor is not None else H.calificacion <= calificacion_max)
+        consulta = consulta.filter(historial.exists())
+    estudiantes = consulta.limit(limite + 1).all()
+    siguiente = estudiantes[limite - 1].id if len(estudiantes) > limite else None
+    return estudiantes[:limite], siguiente
+
+def listar_versiones_estudiantes(db: Session, limite: int = 50):
+    """(id, versión) de la primera página de estudiantes, sin cargar historiales ni documentos."""
+    filas = (db.query(modelos.Usuario.id, modelos.Estudiante.version)
+             .outerjoin(modelos.Estudiante, modelos.Estudiante.id == modelos.Usuario.id)
+             .filter(modelos.Usuario.rol == "estudiante")
+             .order_by(modelos.Usuario.id)
+             .limit(limite + 1).all())
+    siguiente = filas[limite - 1].id if len(filas) > limite else None
+    # Sin fila en estudiantes (registro a medias) la versión es 0; al crearse pasa a 1
+    return [(f.id, f.version or 0) for f in filas[:limite]], siguiente
+
+def contextos_estudiantes(db: Session, ids: list) -> dict:
+    """Contexto de la plantilla fila_estudiante.html para cada id."""
+    return {e.id: {"estudiante": e, "historial": e.estudiante.historial if e.estudiante else []}
+            for e in _consulta_estudiantes(db).filter(modelos.Usuario.id.in_(ids))}
@@ -0,0 +1,125 @@
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from app import crud, modelos, versiones
+from app.basedatos import en_sesion
+from app.cache import cache_usuarios
+from app.llaves import huella_clave
+
+# Versiones async de app.crud para los handlers `async def`. Las consultas se esperan con await
+# y el trabajo de CPU o de disco (cifrado, escritura de blobs) se hace en el pool de hilos.
+
+async def obtener_usuario(db: AsyncSession, matricula: str):
+    return (await db.execute(select(modelos.Usuario).filter(modelos.Usuario.matricula == matricula))).scalars().first()
+
+async def crear_usuario(db: AsyncSession, nombre: str, correo: str, rol: str, contraseña: str, matricula: str):
+    usuario = modelos.Usuario(nombre=nombre, correo=correo, rol=rol, contraseña=contraseña, matricula=matricula)
+    db.add(usuario)
+    await db.flush()
+    await db.run_sync(versiones.usuario_cambiado, usuario)
+    await db.commit()
+    await db.refresh(usuario)
+    return usuario
+
+async def crear_estudiante(db: AsyncSession, matricula: str, telefono: int):
+    estudiante = modelos.Estudiante(id=matricula, telefono=telefono)
+    db.add(estudiante)
+    await db.run_sync(versiones.incrementar, "estudiantes", estudiantes=[matricula])
+    await db.commit()
+    await db.refresh(estudiante)
+    return estudiante
+
+def _id_version_heredada(db, llave: bytes):
+    version = crud.resolver_version_llave(db, llave)
+    return version.id if version is not None else None
+
+async def version_para_subir(db: AsyncSession, llave: bytes):
+    if len(llave) != 32:
+        raise HTTPException(status_code=400, detail="La llave simétrica debe ser de 32 bytes")
+    # Normalmente es una consulta por huella
+    version = (await db.execute(select(modelos.Version_Llave)
+                                .filter(modelos.Version_Llave.huella == huella_clave(llave)))).scalars().first()
+    if version is None:
+        # Llave heredada o desconocida: el descifrado de prueba de un documento va al pool de hilos con su propia sesión
+        id_version = await run_in_threadpool(en_sesion, _id_version_heredada, llave)
+        version = await db.get(modelos.Version_Llave, id_version) if id_version is not None else None
+    return crud.comprobar_version_para_subir(version)
+
+async def obtener_version_llave(db: AsyncSession, id_version: int):
+    return await db.get(modelos.Version_Llave, id_version)
+
+async def crear_documento(db: AsyncSession, id_estudiante: int, nombre_archivo: str, bloques, llave: bytes, version_llave: int,
+                          tipo: str = "expediente", id_subido_por: int = None):
+    # Los bloques se leen, cifran y escriben al almacén en el pool de hilos
+    contenido = await run_in_threadpool(crud.cifrar_y_guardar, bloques, llave)
+    documento = modelos.Documento(id_estudiante=id_estudiante, nombre_archivo=nombre_archivo, tipo=tipo,
+                                  id_subido_por=id_subido_por, version_llave=version_llave, **contenido)
+    db.add(documento)
+    await db.flush()
+    # La llave de datos se cifra con la llave pública de cada titular (RSA, en el pool de hilos)
+    titulares = await obtener_titulares(db)
+    db.add_all(await run_in_threadpool(crud.accesos_documento, documento, llave, titulares))
+    await db.run_sync(versiones.incrementar, "estudiantes", estudiantes=[id_estudiante])
+    await db.commit()
+    await db.refresh(documento)
+    return documento
+
+async def obtener_titulares(db: AsyncSession) -> dict:
+    consulta = select(modelos.Usuario.id, modelos.Usuario.clave_publica).filter(
+        modelos.Usuario.rol.in_(crud.ROLES_DOCUMENTOS), modelos.Usuario.clave_publica.isnot(None))
+    return dict((await db.execute(consulta)).all())
+
+async def obtener_documento(db: AsyncSession, id_documento: int):
+    # Solo los metadatos por llave primaria; `datos` (formato anterior) se pide aparte si hace falta
+    D = modelos.Documento
+    consulta = select(D.id, D.id_estudiante, D.nombre_archivo, D.tamano, D.referencia_blob, D.version_llave,
+                      D.llave_envuelta).filter(D.id == id_documento)
+    return (await db.execute(consulta)).first()
+
+async def obtener_acceso(db: AsyncSession, id_documento: int, id_usuario: int):
+    return await db.get(modelos.Acceso_Documento, (id_documento, id_usuario))
+
+async def obtener_datos_documento(db: AsyncSession, id_documento: int):
+    return (await db.execute(select(modelos.Documento.datos).filter(modelos.Documento.id == id_documento))).scalar()
+
+async def obtener_staff_con_clave(db: AsyncSession, matricula: str = None):
+    consulta = select(modelos.Usuario).filter(modelos.Usuario.rol == "staff", modelos.Usuario.clave_publica.isnot(None))
+    if matricula is not None:
+        consulta = consulta.filter(modelos.Usuario.matricula == matricula)
+    return (await db.execute(consulta)).scalars().all()
+
+async def actualizar_contraseña(db: AsyncSession, matricula: str, nueva_contraseña_hash: str):
+    usuario = await obtener_usuario(db, matricula)
+    if usuario:
+        usuario.contraseña = nueva_contraseña_hash
+        usuario.primer_login = False
+        usuario.version += 1
+        await db.commit()
+    cache_usuarios.invalidar(matricula)
+    return usuario
+
+async def actualizar_hash_contraseña(db: AsyncSession, usuario: modelos.Usuario, nuevo_hash: str):
+    usuario.contraseña = nuevo_hash
+    await db.commit()
+    return usuario
+
+async def actualizar_calificaciones_lote(db: AsyncSession, registros: list, modificador: modelos.Usuario):
+    # Se comparte con la versión síncrona y corre en el pool de hilos con su propia sesión: armar las filas
+    # y los deltas de los agregados es trabajo de CPU que no debe ocupar el event loop
+    return await run_in_threadpool(en_sesion, crud.actualizar_calificaciones_lote, registros, modificador)
+
+async def actualizar_calificaciones(db: AsyncSession, matricula_estudiante: str, calificaciones: dict, matricula_modificador: str):
+    modificador = await obtener_usuario(db, matricula_modificador)
+    if not modificador or modificador.rol not in ["jefe", "staff"]:
+        raise HTTPException(status_code=403, detail="No autorizado para modificar calificaciones")
+    estudiante = await obtener_usuario(db, matricula_estudiante)
+    if estudiante is None or estudiante.rol != "estudiante":
+        raise HTTPException(status_code=404, detail="Estudiante no encontrado")
+    registros = [{"matricula": matricula_estudiante, "materia": materia, "calificacion": calificacion}
+                 for materia, calificacion in calificaciones.items()]
+    resultado = await actualizar_calificaciones_lote(db, registros, modificador)
+    if resultado["errores"]:
+        # Cualquier otro error es de filas concretas: se devuelven tal cual en lugar de un 404 genérico
+        raise HTTPException(status_code=400, detail=resultado["errores"])
+    return resultado
@@ -0,0 +1,144 @@
+import base64
+import hashlib
+import itertools
+import re
+from fastapi import HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from app import crud_async
+from app.almacen import obtener_almacen
+from app.crud import ROLES_DOCUMENTOS, llave_de_datos
+from app.llaves import huella_clave, descifrar_clave
+from app.versiones import coincide
+from app.cifrado import (TAMANO_CABECERA, es_segmentado, tamano_claro, desplazamiento_rango, descifrar_rango,
+                         descifrar_documento)
+
+# Descarga de documentos: una consulta por llave primaria, permisos por rol y dueño,
+# ETag del hash del cifrado y Range descifrando solo los segmentos que cubren el rango.
+# Cada documento tiene su propia llave de datos; se obtiene desenvolviéndola con la llave
+# simétrica de su versión o descifrando con la llave privada la copia RSA del titular.
+
+_RANGO = re.compile(r"bytes=(\d*)-(\d*)$")
+
+async def obtener_documento_autorizado(db: AsyncSession, id_documento: int, usuario):
+    """Metadatos del documento si el usuario puede verlo; 404 también para documentos ajenos."""
+    if usuario.rol not in ROLES_DOCUMENTOS and usuario.rol != "estudiante":
+        raise HTTPException(403, "No autorizado")
+    documento = await crud_async.obtener_documento(db, id_documento)
+    if documento is None or (usuario.rol == "estudiante" and documento.id_estudiante != usuario.id):
+        raise HTTPException(404, "Documento no encontrado")
+    return documento
+
+def parsear_rango(encabezado: str, tamano: int):
+    """(inicio, fin) inclusivos de un `Range: bytes=...`, o None si se debe enviar el documento completo.
+
+    Solo se atiende un rango; varios rangos o una sintaxis inválida se ignoran como permite RFC 9110.
+    """
+    coincidencia = _RANGO.match(encabezado.strip()) if encabezado else None
+    if coincidencia is None or coincidencia.group(1) == coincidencia.group(2) == "":
+        return None
+    inicio, fin = coincidencia.groups()
+    if inicio == "":
+        # Sufijo: los últimos N bytes
+        if int(fin) == 0 or tamano == 0:
+            raise _fuera_de_rango(tamano)
+        return max(0, tamano - int(fin)), tamano - 1
+    inicio = int(inicio)
+    if fin != "" and int(fin) < inicio:
+        return None
+    if inicio >= tamano:
+        raise _fuera_de_rango(tamano)
+    return inicio, tamano - 1 if fin == "" else min(int(fin), tamano - 1)
+
+def _fuera_de_rango(tamano: int) -> HTTPException:
+    return HTTPException(416, "Rango no satisfacible", headers={"Content-Range": f"bytes */{tamano}"})
+
+def _leer_cabecera(referencia: str) -> bytes:
+    return next(obtener_almacen().leer_bloques(referencia, TAMANO_CABECERA), b"")
+
+def _descifrar_completo(cifrado: bytes, llave: bytes) -> bytes:
+    try:
+        return b"".join(descifrar_documento(iter([cifrado]), llave))
+    except ValueError:
+        raise HTTPException(400, "Llave incorrecta o documento dañado")
+
+async def llave_de_documento(db: AsyncSession, documento, usuario, llave: bytes = None, llave_privada_pem: str = None) -> bytes:
+    """Llave de datos del documento a partir de la llave simétrica de su versión o de la llave privada del usuario."""
+    if llave_privada_pem is not None:
+        if documento.llave_envuelta is None:
+            raise HTTPException(400, "El documento se cifró antes de las llaves por documento: usa la llave simétrica")
+        acceso = await crud_async.obtener_acceso(db, documento.id, usuario.id)
+        if acceso is None:
+            raise HTTPException(403, "No tienes acceso a la llave de este documento")
+        try:
+            return await run_in_threadpool(descifrar_clave, acceso.llave_cifrada, llave_privada_pem)
+        except (ValueError, TypeError):
+            raise HTTPException(400, "Llave privada incorrecta")
+    if llave is None:
+        raise HTTPException(400, "Se requiere la llave simétrica o la llave privada")
+    # Con la versión registrada, una llave equivocada se rechaza sin leer el blob
+    version = await crud_async.obtener_version_llave(db, documento.version_llave) if documento.version_llave else None
+    if version is not None and version.huella and version.huella != huella_clave(llave):
+        raise HTTPException(400, f"La llave no corresponde a la versión {version.id} con la que se cifró el documento")
+    try:
+        return llave_de_datos(documento, llave)
+    except ValueError:
+        raise HTTPException(400, "Llave incorrecta o documento dañado")
+
+async def respuesta_documento(request: Request, db: AsyncSession, documento, usuario, llave: bytes = None,
+                              llave_privada_pem: str = None) -> Response:
+    """Respuesta 200, 206 o 304 para un documento ya autorizado con obtener_documento_autorizado."""
+    almacen = obtener_almacen()
+    cifrado = None
+    if documento.referencia_blob:
+        referencia = documento.referencia_blob
+    else:
+        # Formato anterior en base64 dentro de la fila: se carga solo para este documento
+        datos = await crud_async.obtener_datos_documento(db, documento.id)
+        if datos is None:
+            raise HTTPException(404, "Documento no encontrado")
+        cifrado = base64.b64decode(datos)
+        referencia = hashlib.sha256(cifrado).hexdigest()
+
+    etag = f'"{referencia}"'
+    encabezados = {"ETag": etag, "Accept-Ranges": "bytes",
+                   "Content-Disposition": f"attachment; filename={documento.nombre_archivo}"}
+    if coincide(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    encabezado_rango = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range.strip() != etag:
+        # El cliente tiene otra versión: se le envía el documento completo
+        encabezado_rango = None
+
+    llave = await llave_de_documento(db, documento, usuario, llave, llave_privada_pem)
+    cabecera = await run_in_threadpool(_leer_cabecera, referencia) if cifrado is None else cifrado[:TAMANO_CABECERA]
+    if cifrado is None and es_segmentado(cabecera):
+        tamano = tamano_claro(cabecera, await run_in_threadpool(almacen.tamano, referencia))
+        rango = parsear_rango(encabezado_rango, tamano)
+        inicio, fin = rango or (0, tamano - 1)
+        _, desplazamiento = desplazamiento_rango(cabecera, inicio)
+        partes = descifrar_rango(almacen.leer_bloques(referencia, desde=desplazamiento), llave, cabecera, inicio, fin)
+        # El primer segmento se verifica antes de responder para devolver 400 con una llave incorrecta;
+        # StreamingResponse descifra el resto en el pool de hilos
+        try:
+            primero = await run_in_threadpool(next, partes, b"")
+        except ValueError:
+            raise HTTPException(400, "Llave incorrecta o documento dañado")
+        cuerpo = itertools.chain([primero], partes)
+    else:
+        # Formato de un solo bloque: no admite acceso aleatorio, se descifra completo y se recorta
+        if cifrado is None:
+            cifrado = await run_in_threadpool(almacen.leer, referencia)
+        claro = await run_in_threadpool(_descifrar_completo, cifrado, llave)
+        tamano = len(claro)
+        rango = parsear_rango(encabezado_rango, tamano)
+        inicio, fin = rango or (0, tamano - 1)
+        cuerpo = iter([claro[inicio:fin + 1]])
+
+    encabezados["Content-Length"] = str(fin + 1 - inicio)
+    if rango is None:
+        return StreamingResponse(cuerpo, media_type="application/pdf", headers=encabezados)
+    encabezados["Content-Range"] = f"bytes {inicio}-{fin}/{tamano}"
+    return StreamingResponse(cuerpo, status_code=206, media_type="application/pdf", headers=encabezados)
@@ -0,0 +1,209 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from app.basedatos import en_sesion
+from app.crud import contextos_estudiantes
+from app.modelos import Usuario, Estudiante, Evento_Cambio
+from app.plantillas import fragmentos
+
+# Actualizaciones en vivo de los tableros por server-sent events. Las escrituras dejan sus eventos en
+# eventos_cambios (ver app.versiones); un solo difusor por worker los lee de la base, renderiza cada fila
+# una vez y la reparte a las conexiones abiertas. Así se ven también los cambios hechos en otros workers.
+# Leer por `id > desde` es seguro porque los ids se confirman en orden: en SQLite hay un solo escritor y en
+# PostgreSQL las inserciones se serializan con un candado (ver app.versiones.incrementar).
+INTERVALO_EVENTOS = float(os.getenv("Intervalo_Eventos", "1"))
+# Mensajes en espera por conexión; un cliente que no los consume se desconecta y se reanuda con Last-Event-ID
+BUFFER_EVENTOS = int(os.getenv("Buffer_Eventos", "256"))
+# Con más eventos pendientes que esto al reconectar, es más barato recargar la página
+MAXIMO_REANUDAR = int(os.getenv("Maximo_Reanudar_Eventos", "1000"))
+RETENCION_EVENTOS = timedelta(hours=float(os.getenv("Retencion_Eventos", "24")))
+LATIDO_EVENTOS = 15.0
+PODA_EVENTOS = 600.0
+
+def ultimo_evento(db: Session) -> int:
+    return db.query(func.max(Evento_Cambio.id)).scalar() or 0
+
+def leer_cambios(db: Session, desde: int, limite: int):
+    """(mensajes, último id leído, completo) de los eventos posteriores a `desde`.
+
+    Un estudiante que cambió varias veces se envía una sola vez, con su estado actual y el id de su último evento.
+    """
+    eventos = (db.query(Evento_Cambio.id, Evento_Cambio.tipo, Evento_Cambio.id_usuario)
+               .filter(Evento_Cambio.id > desde).order_by(Evento_Cambio.id).limit(limite).all())
+    if not eventos:
+        return [], desde, True
+    ultimos = {(e.tipo, e.id_usuario): e.id for e in eventos}
+    ids = [id_usuario for tipo, id_usuario in ultimos if tipo == "estudiante"]
+    html = {}
+    for inicio in range(0, len(ids), 500):
+        versiones = (db.query(Usuario.id, Estudiante.version)
+                     .outerjoin(Estudiante, Estudiante.id == Usuario.id)
+                     .filter(Usuario.rol == "estudiante", Usuario.id.in_(ids[inicio:inicio + 500])).all())
+        # Misma caché que los tableros: una fila ya renderizada en esa versión no se vuelve a renderizar
+        html.update(fragmentos("fila_estudiante.html", [(v.id, v.version or 0) for v in versiones],
+                               lambda faltantes: contextos_estudiantes(db, faltantes)))
+    mensajes = []
+    for (tipo, id_usuario), id_evento in ultimos.items():
+        if tipo == "estudiante":
+            # Sin HTML el estudiante ya no existe y el cliente quita su fila
+            fila = html.get(id_usuario)
+            datos = {"id": id_usuario, "html": str(fila) if fila is not None else None}
+        else:
+            datos = {}
+        mensajes.append((id_evento, tipo, json.dumps(datos)))
+    mensajes.sort()
+    return mensajes, eventos[-1].id, len(eventos) < limite
+
+def podar(db: Session) -> int:
+    """Borra los eventos más viejos que la retención, conservando siempre el último."""
+    limite = datetime.now(timezone.utc).replace(tzinfo=None) - RETENCION_EVENTOS
+    borrados = (db.query(Evento_Cambio)
+                .filter(Evento_Cambio.creado < limite, Evento_Cambio.id < ultimo_evento(db))
+                .delete(synchronize_session=False))
+    db.commit()
+    return borrados
+
+def _reanudar(db: Session, desde: int):
+    # Si ya se podaron eventos posteriores a `desde` no hay forma de reconstruir lo que faltó
+    primero = db.query(func.min(Evento_Cambio.id)).scalar()
+    if primero is not None and desde < primero - 1:
+        return None
+    mensajes, ultimo, completo = leer_cambios(db, desde, MAXIMO_REANUDAR)
+    return mensajes if completo else None
+
+def _formato(id_evento: int, tipo: str, datos: str) -> bytes:
+    return f"id: {id_evento}\nevent: {tipo}\ndata: {datos}\n\n".encode("utf-8")
+
+class Suscriptor:
+    def __init__(self, tipos: set):
+        self.tipos = tipos
+        self.cola = asyncio.Queue(maxsize=BUFFER_EVENTOS)
+        self.desbordado = False
+
+    def entregar(self, mensajes: list):
+        for mensaje in mensajes:
+            if mensaje[1] not in self.tipos:
+                continue
+            if self.cola.full():
+                # No se bloquea al difusor ni se descartan eventos en silencio: la conexión se cierra
+                # y el navegador reconecta pidiendo lo que falta desde la base
+                self.desbordado = True
+                return
+            self.cola.put_nowait(mensaje)
+
+class DifusorEventos:
+    """Tarea del event loop que lee eventos_cambios mientras haya conexiones y los reparte."""
+
+    def __init__(self, intervalo: float = INTERVALO_EVENTOS):
+        self.intervalo = intervalo
+        self.suscriptores = set()
+        self.ultimo_id = None
+        self._tarea = None
+        self._detenido = False
+        self.enviados = 0
+        self.desconectados = 0
+
+    async def _ciclo(self):
+        ultima_poda = asyncio.get_running_loop().time()
+        while True:
+            await asyncio.sleep(self.intervalo)
+            try:
+                ahora = asyncio.get_running_loop().time()
+                if ahora - ultima_poda > PODA_EVENTOS:
+                    ultima_poda = ahora
+                    await run_in_threadpool(en_sesion, podar)
+                if not self.suscriptores:
+                    # Sin conexiones no se consulta la base; la siguiente conexión fija desde dónde leer
+                    self.ultimo_id = None
+                    continue
+                if self.ultimo_id is None:
+                    continue
+                mensajes, self.ultimo_id, _ = await run_in_threadpool(en_sesion, leer_cambios, self.ultimo_id, MAXIMO_REANUDAR)
+                for suscriptor in list(self.suscriptores):
+                    suscriptor.entregar(mensajes)
+                self.enviados += len(mensajes)
+            except Exception:
+                # Un fallo de la base no debe matar al difusor; se reintenta en el siguiente ciclo
+                logging.getLogger("app.eventos").exception("Error en el difusor de eventos")
+
+    def iniciar(self):
+        self._detenido = False
+        if self._tarea is None or self._tarea.done():
+            self._tarea = asyncio.get_running_loop().create_task(self._ciclo())
+
+    async def detener(self):
+        # Las conexiones abiertas terminan en su siguiente latido
+        self._detenido = True
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+
+    async def transmitir(self, request: Request, tipos: set, desde: int):
+        suscriptor = Suscriptor(tipos)
+        # Se suscribe antes de leer lo pendiente: un evento que llegue mientras tanto no se pierde,
+        # y los repetidos se descartan por id
+        self.suscriptores.add(suscriptor)
+        try:
+            if self.ultimo_id is None:
+                # El difusor estaba inactivo: lee desde antes de lo pendiente de esta conexión
+                ultimo = await run_in_threadpool(en_sesion, ultimo_evento)
+                if self.ultimo_id is None:
+                    self.ultimo_id = ultimo
+            if desde is None:
+                # Conexión nueva sin punto de partida: solo los cambios de aquí en adelante
+                desde = await run_in_threadpool(en_sesion, ultimo_evento)
+                pendientes = []
+            else:
+                pendientes = await run_in_threadpool(en_sesion, _reanudar, desde)
+            enviado = desde
+            if pendientes is None:
+                yield _formato(desde, "recargar", "{}")
+                return
+            # Cada cuánto debe reconectar el navegador si se corta la conexión
+            yield f"retry: {int(self.intervalo * 3000)}\n\n".encode("utf-8")
+            for id_evento, tipo, datos in pendientes:
+                if tipo in tipos:
+                    yield _formato(id_evento, tipo, datos)
+                enviado = max(enviado, id_evento)
+            while not self._detenido:
+                if suscriptor.desbordado and suscriptor.cola.empty():
+                    self.desconectados += 1
+                    return
+                try:
+                    id_evento, tipo, datos = await asyncio.wait_for(suscriptor.cola.get(), timeout=LATIDO_EVENTOS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    # Comentario SSE: mantiene viva la conexión a través de proxies
+                    yield b": latido\n\n"
+                    continue
+                if id_evento > enviado:
+                    enviado = id_evento
+                    yield _formato(id_evento, tipo, datos)
+        finally:
+            self.suscriptores.discard(suscriptor)
+
+    def metricas(self) -> dict:
+        return {"conexiones": len(self.suscriptores), "enviados": self.enviados, "desconectados": self.desconectados}
+
+difusor = DifusorEventos()
+
+def respuesta_eventos(request: Request, tipos: set, desde: int = None) -> StreamingResponse:
+    """Flujo text/event-stream de los cambios posteriores a `desde` o al Last-Event-ID del navegador."""
+    ultimo = request.headers.get("last-event-id")
+    if ultimo and ultimo.isdigit():
+        desde = int(ultimo)
+    difusor.iniciar()
+    return StreamingResponse(difusor.transmitir(request, tipos, desde), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -0,0 +1,150 @@
+import base64
+import csv
+import hashlib
+import io
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.orm import Session
+from app.almacen import obtener_almacen
+from app.basedatos import SesionLocal
+from app.cifrado import descifrar_documento
+from app.crud import llave_de_datos, resolver_version_llave
+from app.modelos import Usuario, Documento, Historial_Academico
+
+# Exportación de expedientes: los documentos seleccionados se descifran en paralelo y se escriben
+# en un ZIP que se envía mientras se genera, sin guardar el archivo completo en memoria ni en disco.
+# cryptography libera el GIL al descifrar, así que los hilos sí se reparten el trabajo.
+HILOS_EXPORTACION = int(os.getenv("Hilos_Exportacion", "4"))
+# Documentos descifrados en espera de escribirse: acota la memoria a unos pocos documentos por hilo
+VENTANA_EXPORTACION = 2 * HILOS_EXPORTACION
+TAMANO_ESCRITURA = 64 * 1024
+
+class _Salida(io.RawIOBase):
+    """Destino sin posicionamiento para zipfile: acumula lo escrito hasta que el generador lo entrega."""
+
+    def __init__(self):
+        self.partes = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, datos) -> int:
+        self.partes.append(bytes(datos))
+        return len(datos)
+
+    def vaciar(self) -> bytes:
+        datos = b"".join(self.partes)
+        self.partes.clear()
+        return datos
+
+def seleccionar_documentos(db: Session, semestre: str = None, matriculas: list = None) -> list:
+    """Metadatos de los documentos a exportar; sin filtros, los de todos los estudiantes."""
+    consulta = (db.query(Documento.id, Documento.tipo, Documento.nombre_archivo, Documento.referencia_blob,
+                         Documento.llave_envuelta, Documento.version_llave, Documento.hash_contenido,
+                         Usuario.matricula)
+                .join(Usuario, Usuario.id == Documento.id_estudiante))
+    if matriculas:
+        consulta = consulta.filter(Usuario.matricula.in_(matriculas))
+    if semestre:
+        historial = db.query(Historial_Academico.id).filter(Historial_Academico.id_estudiante == Documento.id_estudiante,
+                                                            Historial_Academico.semestre == semestre)
+        consulta = consulta.filter(historial.exists())
+    return consulta.order_by(Usuario.matricula, Documento.id).all()
+
+def leer_calificaciones(db: Session, semestre: str = None, matriculas: list = None) -> list:
+    consulta = (db.query(Usuario.matricula, Usuario.nombre, Historial_Academico.semestre,
+                         Historial_Academico.materia, Historial_Academico.calificacion)
+                .join(Historial_Academico, Historial_Academico.id_estudiante == Usuario.id))
+    if matriculas:
+        consulta = consulta.filter(Usuario.matricula.in_(matriculas))
+    if semestre:
+        consulta = consulta.filter(Historial_Academico.semestre == semestre)
+    return consulta.order_by(Usuario.matricula, Historial_Academico.semestre, Historial_Academico.materia).all()
+
+def _leer_cifrado(documento):
+    if documento.referencia_blob:
+        return obtener_almacen().leer_bloques(documento.referencia_blob)
+    # Formato anterior en base64 dentro de la fila: cada hilo usa su propia sesión
+    db = SesionLocal()
+    try:
+        datos = db.query(Documento.datos).filter(Documento.id == documento.id).scalar()
+    finally:
+        db.close()
+    if datos is None:
+        raise FileNotFoundError
+    return iter([base64.b64decode(datos)])
+
+def _descifrar(documento, llave: bytes, id_version: int):
+    """(contenido, error) de un documento; corre en el pool de hilos y no lanza excepciones."""
+    if documento.version_llave is not None and documento.version_llave != id_version:
+        return None, f"Cifrado con la versión {documento.version_llave} de la llave"
+    try:
+        contenido = b"".join(descifrar_documento(_leer_cifrado(documento), llave_de_datos(documento, llave)))
+    except ValueError:
+        return None, "Llave incorrecta o documento dañado"
+    except FileNotFoundError:
+        return None, "Blob no encontrado en el almacén"
+    if documento.hash_contenido and hashlib.sha256(contenido).hexdigest() != documento.hash_contenido:
+        return None, "El contenido descifrado no coincide con hash_contenido"
+    return contenido, None
+
+def _descifrar_en_orden(hilos: ThreadPoolExecutor, documentos: list, llave: bytes, id_version: int):
+    # Ventana deslizante: se mantienen VENTANA_EXPORTACION documentos en curso y se entregan en orden
+    pendientes = deque()
+    documentos = iter(documentos)
+    for documento in documentos:
+        pendientes.append((documento, hilos.submit(_descifrar, documento, llave, id_version)))
+        if len(pendientes) >= VENTANA_EXPORTACION:
+            break
+    while pendientes:
+        documento, futuro = pendientes.popleft()
+        siguiente = next(documentos, None)
+        if siguiente is not None:
+            pendientes.append((siguiente, hilos.submit(_descifrar, siguiente, llave, id_version)))
+        yield documento, futuro.result()
+
+def _csv(filas, encabezado) -> bytes:
+    texto = io.StringIO()
+    escritor = csv.writer(texto)
+    escritor.writerow(encabezado)
+    escritor.writerows(filas)
+    # utf-8-sig para que Excel reconozca los acentos
+    return texto.getvalue().encode("utf-8-sig")
+
+def _nombre_en_zip(documento) -> str:
+    nombre = os.path.basename((documento.nombre_archivo or "").replace("\\", "/")) or "documento.pdf"
+    return f"{documento.matricula}/{documento.id}_{nombre}"
+
+def generar_zip(documentos: list, calificaciones: list, llave: bytes, id_version: int):
+    """Genera el ZIP por partes: un PDF por documento, calificaciones.csv y documentos.csv con el resultado de cada uno."""
+    salida = _Salida()
+    resumen = []
+    # Los PDF ya vienen comprimidos: se guardan sin comprimir para no gastar CPU
+    with ThreadPoolExecutor(max_workers=HILOS_EXPORTACION, thread_name_prefix="exportacion") as hilos, \
+            zipfile.ZipFile(salida, "w", compression=zipfile.ZIP_STORED) as archivo_zip:
+        for documento, (contenido, error) in _descifrar_en_orden(hilos, documentos, llave, id_version):
+            if error:
+                resumen.append((documento.matricula, documento.id, documento.tipo, "", "", error))
+                continue
+            nombre = _nombre_en_zip(documento)
+            with archivo_zip.open(nombre, "w", force_zip64=True) as destino:
+                for inicio in range(0, len(contenido), TAMANO_ESCRITURA):
+                    destino.write(contenido[inicio:inicio + TAMANO_ESCRITURA])
+                    yield salida.vaciar()
+            resumen.append((documento.matricula, documento.id, documento.tipo, nombre,
+                            documento.hash_contenido or hashlib.sha256(contenido).hexdigest(), ""))
+            yield salida.vaciar()
+        archivo_zip.writestr("calificaciones.csv", _csv(calificaciones, ("matricula", "nombre", "semestre", "materia", "calificacion")))
+        archivo_zip.writestr("documentos.csv", _csv(resumen, ("matricula", "id_documento", "tipo", "archivo", "sha256", "error")))
+    yield salida.vaciar()
+
+def preparar_exportacion(db: Session, llave: bytes, semestre: str = None, matriculas: list = None):
+    """Consulta todo lo necesario antes de responder: el generador no usa la sesión de la petición."""
+    version = resolver_version_llave(db, llave, registrar=False)
+    if version is None:
+        raise ValueError("La llave no corresponde a ninguna versión registrada")
+    documentos = seleccionar_documentos(db, semestre, matriculas)
+    calificaciones = leer_calificaciones(db, semestre, matriculas)
+    return generar_zip(documentos, calificaciones, llave, version.id)
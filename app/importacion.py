@@ -0,0 +1,212 @@
+import codecs
+import csv
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from app import versiones
+from app.auth import servicio_hash, generar_contraseña_provisional
+from app.basedatos import SesionLocal
+from app.cifrado import TAMANO_SEGMENTO
+from app.llaves import cifrar_clave_para
+from app.almacen import obtener_almacen
+from app.crud import cifrar_y_guardar, version_para_subir, obtener_titulares, llave_de_datos
+from app.correo import encolar_correo, cuerpo_registro_estudiante, despachador
+from app.modelos import Usuario, Estudiante, Documento, Acceso_Documento, Importacion
+from app.schemas import CalificacionEntrada
+from pydantic import ValidationError
+
+COLUMNAS = ("nombre", "correo", "matricula", "telefono", "documento")
+COLUMNAS_CALIFICACIONES = ("matricula", "materia", "semestre", "calificacion")
+TAMANO_LOTE_IMPORTACION = 200
+# Las importaciones se ejecutan una a la vez para no competir entre ellas por SQLite
+_ejecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="importacion")
+
+def _ahora() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def iniciar_importacion(db: Session, usuario: Usuario, lista, documentos, llave: bytes) -> Importacion:
+    """Copia los archivos subidos a un directorio temporal y encola el trabajo."""
+    version = version_para_subir(db, llave)
+    directorio = tempfile.mkdtemp(prefix="importacion_")
+    ruta_lista = os.path.join(directorio, "lista.csv")
+    ruta_zip = os.path.join(directorio, "documentos.zip")
+    with open(ruta_lista, "wb") as destino:
+        shutil.copyfileobj(lista, destino)
+    with open(ruta_zip, "wb") as destino:
+        shutil.copyfileobj(documentos, destino)
+
+    importacion = Importacion(id_usuario=usuario.id, estado="en_cola", errores="[]", creado=_ahora())
+    db.add(importacion)
+    db.commit()
+    db.refresh(importacion)
+    _ejecutor.submit(ejecutar_importacion, importacion.id, directorio, llave, usuario.id, version.id)
+    return importacion
+
+def _leer_filas(ruta_lista: str):
+    with open(ruta_lista, newline="", encoding="utf-8-sig") as archivo:
+        lector = csv.DictReader(archivo)
+        faltantes = [c for c in COLUMNAS if c not in (lector.fieldnames or [])]
+        if faltantes:
+            raise ValueError(f"Faltan columnas en el CSV: {', '.join(faltantes)}")
+        # La línea 1 es el encabezado
+        return [(numero, {c: (fila.get(c) or "").strip() for c in COLUMNAS}) for numero, fila in enumerate(lector, start=2)]
+
+def _existentes(db: Session, columna, valores) -> set:
+    valores = list(valores)
+    encontrados = set()
+    for inicio in range(0, len(valores), 500):
+        encontrados.update(v for (v,) in db.query(columna).filter(columna.in_(valores[inicio:inicio + 500])))
+    return encontrados
+
+def _validar(db: Session, filas, miembros: dict):
+    matriculas = _existentes(db, Usuario.matricula, {f["matricula"] for _, f in filas})
+    correos = _existentes(db, Usuario.correo, {f["correo"] for _, f in filas})
+    validas, errores = [], []
+    for numero, fila in filas:
+        if not all(fila[c] for c in COLUMNAS):
+            error = "Campos vacíos"
+        elif not fila["telefono"].isdigit():
+            error = "Teléfono inválido"
+        elif fila["matricula"] in matriculas:
+            error = "Matrícula repetida o ya registrada"
+        elif fila["correo"] in correos:
+            error = "Correo repetido o ya registrado"
+        elif fila["documento"] not in miembros:
+            error = f"No se encontró {fila['documento']} en el ZIP"
+        else:
+            error = None
+        if error:
+            errores.append({"fila": numero, "matricula": fila["matricula"], "error": error})
+            continue
+        # También evita repetidos dentro del mismo CSV
+        matriculas.add(fila["matricula"])
+        correos.add(fila["correo"])
+        validas.append((numero, fila))
+    return validas, errores
+
+def _preparar_fila(archivo_zip: zipfile.ZipFile, miembro: str, llave: bytes, titulares: dict) -> dict:
+    """Cifra y guarda el PDF y envuelve su llave de datos para los titulares, fuera de la transacción de escritura."""
+    with archivo_zip.open(miembro) as pdf:
+        contenido = cifrar_y_guardar(iter(lambda: pdf.read(TAMANO_SEGMENTO), b""), llave)
+    try:
+        llave_datos = llave_de_datos(SimpleNamespace(**contenido), llave)
+        contenido["accesos"] = cifrar_clave_para(llave_datos, titulares) if titulares else {}
+    except BaseException:
+        obtener_almacen().eliminar(contenido["referencia_blob"])
+        raise
+    return contenido
+
+def _insertar_fila(db: Session, fila: dict, contraseña: str, contraseña_hash: str, contenido: dict,
+                   id_subido_por: int, version_llave: int):
+    usuario = Usuario(nombre=fila["nombre"], correo=fila["correo"], rol="estudiante",
+                      contraseña=contraseña_hash, matricula=fila["matricula"])
+    db.add(usuario)
+    db.flush()
+    db.add(Estudiante(id=usuario.id, telefono=int(fila["telefono"])))
+    accesos = contenido["accesos"]
+    documento = Documento(id_estudiante=usuario.id, nombre_archivo=fila["documento"], id_subido_por=id_subido_por,
+                          version_llave=version_llave, **{c: v for c, v in contenido.items() if c != "accesos"})
+    db.add(documento)
+    db.flush()
+    ahora = _ahora()
+    db.add_all(Acceso_Documento(id_documento=documento.id, id_usuario=id_usuario, llave_cifrada=cifrada, creado=ahora)
+               for id_usuario, cifrada in accesos.items())
+    versiones.incrementar(db, "estudiantes", estudiantes=[usuario.id])
+    encolar_correo(db, destinatario=fila["correo"], asunto="Registro de Estudiante",
+                   cuerpo=cuerpo_registro_estudiante(fila["nombre"], fila["matricula"], contraseña),
+                   confirmar=False)
+
+def _guardar_progreso(db: Session, id_importacion: int, **valores):
+    db.execute(update(Importacion).where(Importacion.id == id_importacion).values(**valores))
+    db.commit()
+
+def ejecutar_importacion(id_importacion: int, directorio: str, llave: bytes, id_subido_por: int, version_llave: int):
+    db = SesionLocal()
+    errores = []
+    # Blobs del lote en curso que aún no tienen su documento confirmado
+    pendientes = []
+    try:
+        filas = _leer_filas(os.path.join(directorio, "lista.csv"))
+        # Los titulares se consultan una vez por importación, no por fila
+        titulares = obtener_titulares(db)
+        with zipfile.ZipFile(os.path.join(directorio, "documentos.zip")) as archivo_zip:
+            miembros = {os.path.basename(n): n for n in archivo_zip.namelist() if not n.endswith("/")}
+            validas, errores = _validar(db, filas, miembros)
+            procesados, exitosos = len(errores), 0
+            _guardar_progreso(db, id_importacion, estado="procesando", total=len(filas),
+                              procesados=procesados, errores=json.dumps(errores))
+
+            for inicio in range(0, len(validas), TAMANO_LOTE_IMPORTACION):
+                lote = validas[inicio:inicio + TAMANO_LOTE_IMPORTACION]
+                contraseñas = [generar_contraseña_provisional() for _ in lote]
+                hashes = servicio_hash.hash_lote(contraseñas)
+                # El cifrado y el RSA van antes de abrir la transacción: el escritor (y en SQLite el candado
+                # RESERVED) se toma solo para los INSERT del lote
+                preparadas = []
+                for (numero, fila), contraseña, contraseña_hash in zip(lote, contraseñas, hashes):
+                    try:
+                        contenido = _preparar_fila(archivo_zip, miembros[fila["documento"]], llave, titulares)
+                    except Exception as error:
+                        errores.append({"fila": numero, "matricula": fila["matricula"], "error": str(error)[:200]})
+                        continue
+                    pendientes.append(contenido["referencia_blob"])
+                    preparadas.append((numero, fila, contraseña, contraseña_hash, contenido))
+                try:
+                    for _, fila, contraseña, contraseña_hash, contenido in preparadas:
+                        _insertar_fila(db, fila, contraseña, contraseña_hash, contenido, id_subido_por, version_llave)
+                    db.commit()
+                    exitosos += len(preparadas)
+                except Exception:
+                    # Se repite el lote fila por fila para aislar los errores
+                    db.rollback()
+                    for numero, fila, contraseña, contraseña_hash, contenido in preparadas:
+                        try:
+                            _insertar_fila(db, fila, contraseña, contraseña_hash, contenido, id_subido_por, version_llave)
+                            db.commit()
+                            exitosos += 1
+                        except Exception as error:
+                            db.rollback()
+                            # La fila no quedó registrada: su blob no lo referencia nadie
+                            obtener_almacen().eliminar(contenido["referencia_blob"])
+                            errores.append({"fila": numero, "matricula": fila["matricula"], "error": str(error)[:200]})
+                pendientes.clear()
+                procesados += len(lote)
+                _guardar_progreso(db, id_importacion, procesados=procesados, exitosos=exitosos, errores=json.dumps(errores))
+                despachador.avisar()
+
+        _guardar_progreso(db, id_importacion, estado="terminado", terminado=_ahora())
+    except Exception as error:
+        db.rollback()
+        for referencia in pendientes:
+            obtener_almacen().eliminar(referencia)
+        errores.append({"fila": None, "matricula": None, "error": str(error)[:200]})
+        _guardar_progreso(db, id_importacion, estado="fallido", errores=json.dumps(errores), terminado=_ahora())
+    finally:
+        db.close()
+        shutil.rmtree(directorio, ignore_errors=True)
+
+def obtener_importacion(db: Session, id_importacion: int):
+    return db.query(Importacion).filter(Importacion.id == id_importacion).first()
+
+def leer_calificaciones_csv(archivo):
+    """Lee un CSV (matricula, materia, semestre, calificacion) y devuelve registros válidos y errores por fila."""
+    lector = csv.DictReader(codecs.getreader("utf-8-sig")(archivo))
+    faltantes = [c for c in COLUMNAS_CALIFICACIONES if c != "semestre" and c not in (lector.fieldnames or [])]
+    if faltantes:
+        raise ValueError(f"Faltan columnas en el CSV: {', '.join(faltantes)}")
+    registros, errores = [], []
+    for numero, fila in enumerate(lector, start=2):
+        datos = {c: (fila.get(c) or "").strip() for c in COLUMNAS_CALIFICACIONES}
+        try:
+            # La fila del CSV acompaña al registro para que los errores de la base la reporten
+            registros.append({**CalificacionEntrada(**datos).model_dump(), "fila": numero})
+        except ValidationError as error:
+            errores.append({"fila": numero, "matricula": datos["matricula"], "error": error.errors()[0]["msg"]})
+    return registros, errores
@@ -0,0 +1,56 @@
+import functools
+import hashlib
+from app.cache import CacheTTL
+
+# Los módulos de cryptography se importan dentro de cada función: arrancar un worker no los carga
+
+@functools.cache
+def _oaep():
+    # OAEP con SHA-1 y MGF1(SHA-1), los valores por defecto con los que se envolvieron las claves
+    # existentes (PKCS1_OAEP de PyCryptodome); cambiarlo invalidaría los archivos ya entregados
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+    return padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA1()), algorithm=hashes.SHA1(), label=None)
+
+# Llaves públicas ya parseadas, por huella del PEM. Si Usuario.clave_publica cambia, cambia la
+# huella y la llave nueva se parsea sola; la anterior sale por LRU/TTL.
+cache_llaves = CacheTTL(maximo=256, ttl=3600)
+
+def huella(llave_publica_pem: str) -> str:
+    return hashlib.sha256(llave_publica_pem.strip().encode()).hexdigest()
+
+def huella_clave(clave: bytes) -> str:
+    """Identifica una llave simétrica en el registro de versiones sin guardarla."""
+    return hashlib.sha256(clave).hexdigest()
+
+def cargar_llave_publica(llave_publica_pem: str):
+    clave = huella(llave_publica_pem)
+    llave = cache_llaves.obtener(clave)
+    if llave is None:
+        from cryptography.hazmat.primitives import serialization
+        llave = serialization.load_pem_public_key(llave_publica_pem.encode())
+        cache_llaves.guardar(clave, llave)
+    return llave
+
+def cargar_llave_privada(llave_privada_pem: str):
+    # Las llaves privadas llegan en cada petición y no se guardan en memoria
+    from cryptography.hazmat.primitives import serialization
+    return serialization.load_pem_private_key(llave_privada_pem.encode(), password=None)
+
+def generar_par_rsa(tamano: int = 2048):
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    llave_privada = rsa.generate_private_key(public_exponent=65537, key_size=tamano)
+    privada_pem = llave_privada.private_bytes(encoding=serialization.Encoding.PEM, format=serialization.PrivateFormat.PKCS8, encryption_algorithm=serialization.NoEncryption())
+    publica_pem = llave_privada.public_key().public_bytes(encoding=serialization.Encoding.PEM, format=serialization.PublicFormat.SubjectPublicKeyInfo)
+    return privada_pem, publica_pem
+
+def cifrar_clave(clave: bytes, llave_publica_pem: str) -> bytes:
+    return cargar_llave_publica(llave_publica_pem).encrypt(clave, _oaep())
+
+def descifrar_clave(clave_cifrada: bytes, llave_privada_pem: str) -> bytes:
+    return cargar_llave_privada(llave_privada_pem).decrypt(clave_cifrada, _oaep())
+
+def cifrar_clave_para(clave: bytes, destinatarios: dict) -> dict:
+    """Envuelve la misma clave simétrica para varios destinatarios ({id: llave_publica_pem})."""
+    return {id_destinatario: cifrar_clave(clave, pem) for id_destinatario, pem in destinatarios.items()}
@@ -1,22 +1,72 @@
-from fastapi import FastAPI
+import os
+import secrets
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from .basedatos import iniciar_bd
+from .basedatos import verificar_esquema, estadisticas_bd, motor_async, motor_async_lectura
 from .routes import jefe, usuario, estudiante, staff
 from dotenv import load_dotenv
+from contextlib import asynccontextmanager
+from .correo import despachador
+from .eventos import difusor
+from .auth import servicio_hash
+from .cache import cache_usuarios
+from .metricas import MiddlewareMetricas, configurar_logs, monitor_bucle, registro
 
 load_dotenv()
-iniciar_bd()
+configurar_logs()
+
+@asynccontextmanager
+async def ciclo_vida(app: FastAPI):
+    # Cada worker solo lee la versión del esquema; migrar y crear el jefe es trabajo de
+    # `python -m app iniciar`, que se ejecuta una vez antes de levantar los workers
+    verificar_esquema()
+    despachador.iniciar()
+    monitor_bucle.iniciar()
+    difusor.iniciar()
+    yield
+    await difusor.detener()
+    await monitor_bucle.detener()
+    despachador.detener()
+    await motor_async.dispose()
+    if motor_async_lectura is not motor_async:
+        await motor_async_lectura.dispose()
 
 app = FastAPI(
     title="Plataforma de Gestión Académica",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=ciclo_vida
 )
 
+app.add_middleware(MiddlewareMetricas)
 app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
 
 app.include_router(usuario.ruta, prefix="/auth", tags=["Autenticación"])
 app.include_router(jefe.ruta, prefix="/jefe", tags=["Administración"])
 app.include_router(estudiante.ruta, prefix="/estudiante", tags=["Estudiantes"])
 app.include_router(staff.router, prefix="/staff", tags=["Staff"])
+
+def _pools():
+    return {(nombre, campo): valor for nombre, pool in estadisticas_bd().items()
+            for campo, valor in pool.items() if campo in ("en_uso", "tamano", "solicitudes")}
+
+def _bucle():
+    metricas = monitor_bucle.metricas()
+    return {(p,): metricas[f"{p}_ms"] / 1000 for p in ("p50", "p99", "max") if f"{p}_ms" in metricas}
+
+registro.medidor("bd_pool_conexiones", "Estado de los pools de conexiones", _pools, ("pool", "campo"))
+registro.medidor("bucle_retraso_segundos", "Retraso del event loop", _bucle, ("estadistico",))
+registro.medidor("argon2_pendientes", "Hashes Argon2 en cola o en ejecución", lambda: {(): servicio_hash.metricas()["pendientes"]})
+registro.medidor("cache_usuarios", "Aciertos y fallos del cache de usuarios",
+                 lambda: {(c,): v for c, v in cache_usuarios.metricas().items()}, ("campo",))
+registro.medidor("eventos_tableros", "Conexiones y mensajes del flujo de cambios de los tableros",
+                 lambda: {(c,): v for c, v in difusor.metricas().items()}, ("campo",))
+
+TOKEN_METRICAS = os.getenv("Token_Metricas")
+
+@app.get("/metrics", include_in_schema=False)
+def metricas(request: Request):
+    # Sin Token_Metricas el endpoint queda abierto, como es común detrás de la red interna del scraper
+    if TOKEN_METRICAS and not secrets.compare_digest(request.headers.get("Authorization", ""), f"Bearer {TOKEN_METRICAS}"):
+        raise HTTPException(status_code=401, detail="No autorizado")
+    return PlainTextResponse(registro.exponer(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,288 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from sqlalchemy import event
+
+LIMITES_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LIMITES_CONSULTAS = (0, 1, 2, 5, 10, 20, 50, 100)
+# Peticiones más lentas que esto siempre se registran; el resto, con probabilidad MUESTREO_LOGS
+UMBRAL_LENTO = float(os.getenv("Umbral_Lento_ms", "500")) / 1000
+MUESTREO_LOGS = float(os.getenv("Muestreo_Logs", "0.01"))
+
+registro_log = logging.getLogger("app.peticiones")
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+def _etiquetas(nombres: tuple, valores: tuple, limite: str = None) -> str:
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if limite is not None:
+        pares.append(f'le="{limite}"')
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+class Contador:
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = ()):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, etiquetas
+        self._valores = {}
+        self._candado = threading.Lock()
+
+    def incrementar(self, *valores, cantidad: float = 1):
+        with self._candado:
+            self._valores[valores] = self._valores.get(valores, 0) + cantidad
+
+    def exponer(self) -> list:
+        with self._candado:
+            valores = sorted(self._valores.items())
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        lineas += [f"{self.nombre}{_etiquetas(self.etiquetas, e)} {v}" for e, v in valores]
+        return lineas
+
+class Histograma:
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = (), limites: tuple = LIMITES_LATENCIA):
+        self.nombre, self.ayuda, self.etiquetas, self.limites = nombre, ayuda, etiquetas, limites
+        self._series = {}
+        self._candado = threading.Lock()
+
+    def observar(self, valor: float, *valores):
+        with self._candado:
+            serie = self._series.get(valores)
+            if serie is None:
+                serie = self._series[valores] = [[0] * len(self.limites), 0.0, 0]
+            for i, limite in enumerate(self.limites):
+                if valor <= limite:
+                    serie[0][i] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def exponer(self) -> list:
+        with self._candado:
+            series = sorted((e, (list(c), s, n)) for e, (c, s, n) in self._series.items())
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        for e, (cubetas, suma, cuenta) in series:
+            for limite, acumulado in zip(self.limites, cubetas):
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, e, limite)} {acumulado}")
+            lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, e, '+Inf')} {cuenta}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, e)} {round(suma, 6)}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, e)} {cuenta}")
+        return lineas
+
+class Medidor:
+    """Valor instantáneo que se calcula al exponer: `funcion` devuelve {(valores de etiquetas): valor}."""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple, funcion):
+        self.nombre, self.ayuda, self.etiquetas, self.funcion = nombre, ayuda, etiquetas, funcion
+
+    def exponer(self) -> list:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} gauge"]
+        lineas += [f"{self.nombre}{_etiquetas(self.etiquetas, e)} {v}" for e, v in sorted(self.funcion().items()) if v is not None]
+        return lineas
+
+class RegistroMetricas:
+    """Métricas del proceso en formato de texto de Prometheus, sin dependencias externas."""
+
+    def __init__(self):
+        self._metricas = []
+
+    def agregar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def contador(self, nombre: str, ayuda: str, etiquetas: tuple = ()) -> Contador:
+        return self.agregar(Contador(nombre, ayuda, etiquetas))
+
+    def histograma(self, nombre: str, ayuda: str, etiquetas: tuple = (), limites: tuple = LIMITES_LATENCIA) -> Histograma:
+        return self.agregar(Histograma(nombre, ayuda, etiquetas, limites))
+
+    def medidor(self, nombre: str, ayuda: str, funcion, etiquetas: tuple = ()) -> Medidor:
+        return self.agregar(Medidor(nombre, ayuda, etiquetas, funcion))
+
+    def exponer(self) -> str:
+        lineas = []
+        for metrica in self._metricas:
+            lineas += metrica.exponer()
+        return "\n".join(lineas) + "\n"
+
+registro = RegistroMetricas()
+HTTP_PETICIONES = registro.contador("http_peticiones_total", "Peticiones HTTP atendidas", ("metodo", "ruta", "estado"))
+HTTP_DURACION = registro.histograma("http_peticion_duracion_segundos", "Duración de las peticiones HTTP", ("metodo", "ruta"))
+HTTP_CONSULTAS = registro.histograma("http_peticion_consultas_sql", "Sentencias SQL por petición", ("ruta",), LIMITES_CONSULTAS)
+SQL_DURACION = registro.histograma("sql_sentencia_duracion_segundos", "Duración de cada sentencia SQL")
+CIFRADO_BYTES = registro.contador("cifrado_bytes_total", "Bytes procesados por ChaCha20-Poly1305", ("operacion",))
+CIFRADO_SEGUNDOS = registro.contador("cifrado_segundos_total", "Tiempo en ChaCha20-Poly1305", ("operacion",))
+ARGON2_DURACION = registro.histograma("argon2_duracion_segundos", "Duración de cada hash o verificación Argon2", ("operacion",))
+SMTP_DURACION = registro.histograma("smtp_envio_duracion_segundos", "Duración de cada envío SMTP")
+SMTP_ERRORES = registro.contador("smtp_errores_total", "Envíos SMTP fallidos")
+
+# Contadores de la petición en curso; run_in_threadpool copia el contexto, así que los hilos ven el mismo dict
+_peticion = ContextVar("metricas_peticion", default=None)
+
+def _sumar(clave: str, cantidad: float):
+    datos = _peticion.get()
+    if datos is not None:
+        datos[clave] += cantidad
+
+def registrar_sql(duracion: float):
+    SQL_DURACION.observar(duracion)
+    _sumar("sql_consultas", 1)
+    _sumar("sql_segundos", duracion)
+
+def registrar_cifrado(operacion: str, tamano: int, duracion: float):
+    CIFRADO_BYTES.incrementar(operacion, cantidad=tamano)
+    CIFRADO_SEGUNDOS.incrementar(operacion, cantidad=duracion)
+    _sumar(f"bytes_{operacion}", tamano)
+    _sumar("cifrado_segundos", duracion)
+
+def registrar_argon2(operacion: str, duracion: float):
+    ARGON2_DURACION.observar(duracion, operacion)
+    _sumar("argon2_segundos", duracion)
+
+def registrar_smtp(duracion: float, error: bool = False):
+    SMTP_DURACION.observar(duracion)
+    if error:
+        SMTP_ERRORES.incrementar()
+
+def instrumentar_motor(motor):
+    """Mide cada sentencia ejecutada por `motor` (para motores async, su sync_engine)."""
+    @event.listens_for(motor, "before_cursor_execute")
+    def antes(conexion, cursor, sentencia, parametros, contexto, multiples):
+        conexion.info.setdefault("inicio_sentencia", []).append(time.perf_counter())
+
+    @event.listens_for(motor, "after_cursor_execute")
+    def despues(conexion, cursor, sentencia, parametros, contexto, multiples):
+        registrar_sql(time.perf_counter() - conexion.info["inicio_sentencia"].pop())
+
+class MiddlewareMetricas:
+    """Middleware ASGI: mide cada petición hasta el último byte de la respuesta, incluidas las de streaming."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        datos = {"sql_consultas": 0, "sql_segundos": 0.0, "bytes_cifrar": 0, "bytes_descifrar": 0,
+                 "cifrado_segundos": 0.0, "argon2_segundos": 0.0}
+        estado = 500
+        token = _peticion.set(datos)
+        inicio = time.perf_counter()
+
+        async def enviar(mensaje):
+            nonlocal estado
+            if mensaje["type"] == "http.response.start":
+                estado = mensaje["status"]
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            _peticion.reset(token)
+            self._registrar(scope, estado, time.perf_counter() - inicio, datos)
+
+    def _registrar(self, scope, estado: int, duracion: float, datos: dict):
+        # La plantilla de la ruta (/jefe/importaciones/{id_importacion}) y no la URL, para acotar las series
+        ruta = getattr(scope.get("route"), "path", "sin_ruta")
+        metodo = scope["method"]
+        HTTP_PETICIONES.incrementar(metodo, ruta, estado)
+        HTTP_DURACION.observar(duracion, metodo, ruta)
+        HTTP_CONSULTAS.observar(datos["sql_consultas"], ruta)
+        lenta = duracion >= UMBRAL_LENTO
+        if lenta or random.random() < MUESTREO_LOGS:
+            registro_log.log(logging.WARNING if lenta else logging.INFO, "peticion_lenta" if lenta else "peticion", extra={"datos": {
+                "metodo": metodo,
+                "ruta": ruta,
+                "url": scope["path"],
+                "estado": estado,
+                "duracion_ms": round(duracion * 1000, 2),
+                "sql_consultas": datos["sql_consultas"],
+                "sql_ms": round(datos["sql_segundos"] * 1000, 2),
+                "bytes_cifrados": datos["bytes_cifrar"],
+                "bytes_descifrados": datos["bytes_descifrar"],
+                "cifrado_ms": round(datos["cifrado_segundos"] * 1000, 2),
+                "argon2_ms": round(datos["argon2_segundos"] * 1000, 2),
+            }})
+
+class FormatoJSON(logging.Formatter):
+    def format(self, registro: logging.LogRecord) -> str:
+        entrada = {
+            "hora": datetime.fromtimestamp(registro.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "nivel": registro.levelname,
+            "logger": registro.name,
+            "mensaje": registro.getMessage(),
+            **getattr(registro, "datos", {}),
+        }
+        if registro.exc_info:
+            entrada["error"] = self.formatException(registro.exc_info)
+        return json.dumps(entrada, ensure_ascii=False)
+
+def configurar_logs():
+    """Logs JSON de una línea para los loggers `app.*`, salvo que la aplicación ya los haya configurado."""
+    raiz = logging.getLogger("app")
+    if raiz.handlers:
+        return
+    manejador = logging.StreamHandler()
+    manejador.setFormatter(FormatoJSON())
+    raiz.addHandler(manejador)
+    raiz.setLevel(os.getenv("Nivel_Log", "INFO"))
+    raiz.propagate = False
+
+class MonitorBucle:
+    """Mide el retraso del event loop: cuánto tarde despierta una tarea que duerme `intervalo` segundos.
+
+    Un retraso alto significa que algún handler ejecutó trabajo bloqueante directamente en el loop.
+    """
+
+    def __init__(self, intervalo: float = 0.05, muestras: int = 1200):
+        self.intervalo = intervalo
+        self._muestras = deque(maxlen=muestras)
+        self._candado = threading.Lock()
+        self._tarea = None
+        self.maximo = 0.0
+
+    async def _ciclo(self):
+        while True:
+            inicio = time.perf_counter()
+            await asyncio.sleep(self.intervalo)
+            retraso = max(0.0, time.perf_counter() - inicio - self.intervalo)
+            with self._candado:
+                self._muestras.append(retraso)
+                self.maximo = max(self.maximo, retraso)
+
+    def iniciar(self):
+        if self._tarea is None:
+            self._tarea = asyncio.get_running_loop().create_task(self._ciclo())
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+
+    def metricas(self) -> dict:
+        with self._candado:
+            muestras = sorted(self._muestras)
+            maximo = self.maximo
+        if not muestras:
+            return {"muestras": 0}
+
+        def percentil(p):
+            return round(muestras[min(len(muestras) - 1, int(p * len(muestras)))] * 1000, 3)
+
+        return {
+            "muestras": len(muestras),
+            "p50_ms": percentil(0.50),
+            "p99_ms": percentil(0.99),
+            "max_ventana_ms": round(muestras[-1] * 1000, 3),
+            "max_ms": round(maximo * 1000, 3),
+        }
+
+monitor_bucle = MonitorBucle()
@@ -0,0 +1,327 @@
+import argparse
+from datetime import datetime, timezone
+from sqlalchemy import (Column, Integer, String, Boolean, ForeignKey, Text, LargeBinary, DateTime, Index, Float,
+                        MetaData, Table, inspect, select, text)
+
+# Cada migración recibe una conexión dentro de la transacción de migrar() y no debe confirmarla.
+# Las migraciones ya publicadas no se editan: los cambios al esquema se agregan como una versión nueva.
+MIGRACIONES = []
+
+version_esquema = Table(
+    "version_esquema", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("descripcion", String(200)),
+    Column("aplicada", DateTime),
+)
+
+def migracion(version: int, descripcion: str):
+    def registrar(funcion):
+        MIGRACIONES.append((version, descripcion, funcion))
+        MIGRACIONES.sort(key=lambda m: m[0])
+        return funcion
+    return registrar
+
+def _esquema_inicial() -> MetaData:
+    # Copia fija del esquema de app/modelos.py al introducir las migraciones
+    metadata = MetaData()
+    Table("usuarios", metadata,
+          Column("id", Integer, primary_key=True, index=True),
+          Column("nombre", String(50), index=True),
+          Column("correo", String(30), unique=True, index=True),
+          Column("contraseña", String(256)),
+          Column("matricula", String(10), unique=True),
+          Column("rol", String(15), index=True),
+          Column("primer_login", Boolean),
+          Column("clave_publica", Text, nullable=True))
+    Table("estudiantes", metadata,
+          Column("id", Integer, ForeignKey("usuarios.id"), primary_key=True),
+          Column("telefono", Integer))
+    Table("documentos", metadata,
+          Column("id", Integer, primary_key=True, index=True),
+          Column("id_estudiante", Integer, ForeignKey("estudiantes.id")),
+          Column("nombre_archivo", String(20)),
+          Column("tamano", Integer, nullable=True),
+          Column("referencia_blob", String(64), index=True, nullable=True),
+          Column("datos", Text, nullable=True))
+    Table("historiales", metadata,
+          Column("id", Integer, primary_key=True, index=True),
+          Column("id_estudiante", Integer, ForeignKey("estudiantes.id"), index=True),
+          Column("semestre", String(10), nullable=False, server_default="", index=True),
+          Column("materia", String(30), index=True),
+          Column("calificacion", String(5)),
+          Column("ultima_modificacion", String(100), nullable=True),
+          Index("ux_historiales_estudiante_materia_semestre", "id_estudiante", "materia", "semestre", unique=True))
+    Table("correos_pendientes", metadata,
+          Column("id", Integer, primary_key=True, index=True),
+          Column("destinatario", String(100)),
+          Column("asunto", String(200)),
+          Column("cuerpo", Text),
+          Column("adjunto", LargeBinary, nullable=True),
+          Column("nombre_adjunto", String(100), nullable=True),
+          Column("estado", String(10), index=True),
+          Column("intentos", Integer),
+          Column("siguiente_intento", DateTime, index=True),
+          Column("ultimo_error", String(300), nullable=True),
+          Column("creado", DateTime))
+    Table("importaciones", metadata,
+          Column("id", Integer, primary_key=True, index=True),
+          Column("id_usuario", Integer, ForeignKey("usuarios.id")),
+          Column("estado", String(12)),
+          Column("total", Integer),
+          Column("procesados", Integer),
+          Column("exitosos", Integer),
+          Column("errores", Text),
+          Column("creado", DateTime),
+          Column("terminado", DateTime, nullable=True))
+    return metadata
+
+def agregar_faltantes(conexion, metadata: MetaData):
+    """Agrega las columnas e índices de `metadata` que no existan en tablas ya creadas."""
+    inspector = inspect(conexion)
+    for tabla in metadata.sorted_tables:
+        if not inspector.has_table(tabla.name):
+            continue
+        columnas = {c["name"] for c in inspector.get_columns(tabla.name)}
+        for columna in tabla.columns:
+            if columna.name not in columnas:
+                tipo = columna.type.compile(dialect=conexion.dialect)
+                conexion.execute(text(f'ALTER TABLE {tabla.name} ADD COLUMN "{columna.name}" {tipo}'))
+        indices = {i["name"] for i in inspector.get_indexes(tabla.name)}
+        for indice in tabla.indexes:
+            if indice.name not in indices:
+                indice.create(conexion)
+
+@migracion(1, "Esquema inicial")
+def _0001_esquema_inicial(conexion):
+    metadata = _esquema_inicial()
+    # Las bases creadas antes de las migraciones ya tienen parte de las tablas
+    metadata.create_all(conexion, checkfirst=True)
+    # El índice único (id_estudiante, materia, semestre) requiere semestre sin NULL y sin duplicados
+    conexion.execute(text("UPDATE historiales SET semestre = '' WHERE semestre IS NULL"))
+    conexion.execute(text(
+        "DELETE FROM historiales WHERE id NOT IN "
+        "(SELECT MAX(id) FROM historiales GROUP BY id_estudiante, materia, semestre)"
+    ))
+    agregar_faltantes(conexion, metadata)
+
+@migracion(2, "Catálogo de documentos: tipo, fecha, hash, autor y versión de llave")
+def _0002_catalogo_documentos(conexion):
+    metadata = MetaData()
+    Table("documentos", metadata,
+          Column("id", Integer, primary_key=True),
+          Column("id_estudiante", Integer),
+          Column("tipo", String(30)),
+          Column("subido", DateTime, index=True),
+          Column("hash_contenido", String(64)),
+          Column("id_subido_por", Integer),
+          Column("version_llave", Integer),
+          Index("ix_documentos_estudiante_tipo", "id_estudiante", "tipo"))
+    agregar_faltantes(conexion, metadata)
+    if conexion.dialect.name != "sqlite":
+        # SQLite no aplica la longitud de VARCHAR ni permite agregar llaves foráneas con ALTER TABLE
+        conexion.execute(text("ALTER TABLE documentos ALTER COLUMN nombre_archivo TYPE VARCHAR(255)"))
+        conexion.execute(text(
+            "ALTER TABLE documentos ADD CONSTRAINT fk_documentos_id_subido_por "
+            "FOREIGN KEY (id_subido_por) REFERENCES usuarios (id)"
+        ))
+    conexion.execute(text("UPDATE documentos SET tipo = 'expediente' WHERE tipo IS NULL"))
+    conexion.execute(text("UPDATE documentos SET version_llave = 1 WHERE version_llave IS NULL"))
+
+@migracion(3, "Registro de versiones de llave y recifrados")
+def _0003_versiones_llave(conexion):
+    metadata = MetaData()
+    Table("versiones_llave", metadata,
+          Column("id", Integer, primary_key=True, index=True),
+          Column("huella", String(64), unique=True, nullable=True),
+          Column("estado", String(10)),
+          Column("creada", DateTime),
+          Column("retirada", DateTime, nullable=True))
+    Table("recifrados", metadata,
+          Column("id", Integer, primary_key=True, index=True),
+          Column("id_usuario", Integer, ForeignKey("usuarios.id")),
+          Column("version_origen", Integer, ForeignKey("versiones_llave.id")),
+          Column("version_destino", Integer, ForeignKey("versiones_llave.id")),
+          Column("estado", String(12)),
+          Column("total", Integer),
+          Column("procesados", Integer),
+          Column("fallidos", Integer),
+          Column("ultimo_id", Integer),
+          Column("errores", Text),
+          Column("creado", DateTime),
+          Column("actualizado", DateTime),
+          Column("terminado", DateTime, nullable=True))
+    Table("usuarios", metadata, Column("id", Integer, primary_key=True))
+    metadata.create_all(conexion, tables=[metadata.tables["versiones_llave"], metadata.tables["recifrados"]])
+    # Los documentos existentes quedan en la versión 1 (heredada, huella desconocida)
+    if conexion.execute(text("SELECT 1 FROM documentos LIMIT 1")).first():
+        conexion.execute(text(
+            "INSERT INTO versiones_llave (id, huella, estado, creada) VALUES (1, NULL, 'activa', :ahora)"
+        ), {"ahora": datetime.now(timezone.utc).replace(tzinfo=None)})
+        if conexion.dialect.name == "postgresql":
+            # El id explícito no avanza la secuencia del SERIAL
+            conexion.execute(text("SELECT setval(pg_get_serial_sequence('versiones_llave', 'id'), 1)"))
+    conexion.execute(text("CREATE INDEX ix_documentos_version_llave ON documentos (version_llave)"))
+    if conexion.dialect.name != "sqlite":
+        conexion.execute(text(
+            "ALTER TABLE documentos ADD CONSTRAINT fk_documentos_version_llave "
+            "FOREIGN KEY (version_llave) REFERENCES versiones_llave (id)"
+        ))
+
+@migracion(4, "Cifrado de sobre: llave de datos por documento y accesos por usuario")
+def _0004_cifrado_de_sobre(conexion):
+    metadata = MetaData()
+    Table("usuarios", metadata, Column("id", Integer, primary_key=True))
+    Table("documentos", metadata,
+          Column("id", Integer, primary_key=True),
+          Column("llave_envuelta", LargeBinary, nullable=True))
+    Table("accesos_documento", metadata,
+          Column("id_documento", Integer, ForeignKey("documentos.id"), primary_key=True),
+          Column("id_usuario", Integer, ForeignKey("usuarios.id"), primary_key=True, index=True),
+          Column("llave_cifrada", LargeBinary),
+          Column("creado", DateTime))
+    agregar_faltantes(conexion, metadata)
+    metadata.tables["accesos_documento"].create(conexion)
+
+@migracion(5, "Calificación numérica y agregados de calificaciones")
+def _0005_estadisticas_calificaciones(conexion):
+    metadata = MetaData()
+    historiales = Table("historiales", metadata,
+                        Column("id", Integer, primary_key=True),
+                        Column("calificacion", String(5)),
+                        Column("calificacion_numerica", Float, nullable=True))
+    Table("estadisticas_calificaciones", metadata,
+          Column("materia", String(30), primary_key=True),
+          Column("semestre", String(10), primary_key=True),
+          Column("cubeta", Integer, primary_key=True),
+          Column("conteo", Integer, nullable=False),
+          Column("suma", Float, nullable=False),
+          Column("suma_cuadrados", Float, nullable=False))
+    agregar_faltantes(conexion, metadata)
+    metadata.tables["estadisticas_calificaciones"].create(conexion)
+    # Misma conversión que analitica.a_numero al momento de esta migración
+    for id_fila, calificacion in conexion.execute(select(historiales.c.id, historiales.c.calificacion)
+                                                   .where(historiales.c.calificacion.isnot(None))).all():
+        try:
+            valor = float(calificacion.strip().replace(",", "."))
+        except ValueError:
+            continue
+        if valor == valor and abs(valor) != float("inf"):
+            conexion.execute(historiales.update().where(historiales.c.id == id_fila).values(calificacion_numerica=valor))
+    # PostgreSQL redondea al convertir a entero; SQLite trunca y no siempre tiene FLOOR.
+    # Con Calificacion_Maxima distinta de 10 hay que ejecutar `python -m app.analitica reconstruir`
+    entera = ("CAST(FLOOR(calificacion_numerica) AS INTEGER)" if conexion.dialect.name == "postgresql"
+              else "CAST(calificacion_numerica AS INTEGER)")
+    conexion.execute(text(
+        "INSERT INTO estadisticas_calificaciones (materia, semestre, cubeta, conteo, suma, suma_cuadrados) "
+        "SELECT materia, semestre, c, COUNT(*), SUM(calificacion_numerica), SUM(calificacion_numerica * calificacion_numerica) "
+        "FROM (SELECT materia, semestre, calificacion_numerica, "
+        "CASE WHEN calificacion_numerica < 0 THEN 0 WHEN calificacion_numerica >= 10 THEN 10 "
+        f"ELSE {entera} END AS c "
+        "FROM historiales WHERE calificacion_numerica IS NOT NULL AND id_estudiante IS NOT NULL) AS h "
+        "GROUP BY materia, semestre, c"
+    ))
+
+@migracion(6, "Versiones de datos para ETag y caché de fragmentos de los tableros")
+def _0006_versiones_datos(conexion):
+    metadata = MetaData()
+    Table("estudiantes", metadata,
+          Column("id", Integer, primary_key=True),
+          Column("version", Integer))
+    Table("contadores_version", metadata,
+          Column("nombre", String(30), primary_key=True),
+          Column("version", Integer, nullable=False))
+    agregar_faltantes(conexion, metadata)
+    conexion.execute(text("UPDATE estudiantes SET version = 1 WHERE version IS NULL"))
+    metadata.tables["contadores_version"].create(conexion)
+    # Las escrituras solo incrementan: las filas existen desde el principio
+    for nombre in ("staff", "estudiantes", "calificaciones"):
+        conexion.execute(text("INSERT INTO contadores_version (nombre, version) VALUES (:nombre, 1)"), {"nombre": nombre})
+
+@migracion(7, "Registro de cambios para las actualizaciones en vivo de los tableros")
+def _0007_eventos_cambios(conexion):
+    metadata = MetaData()
+    Table("eventos_cambios", metadata,
+          Column("id", Integer, primary_key=True, index=True),
+          Column("tipo", String(15)),
+          Column("id_usuario", Integer, nullable=True),
+          Column("creado", DateTime, index=True))
+    metadata.create_all(conexion)
+
+# Columnas que solo registran quién hizo algo: al eliminar al usuario el registro se conserva sin autor
+AUTORES = (("documentos", "id_subido_por"), ("importaciones", "id_usuario"), ("recifrados", "id_usuario"))
+
+@migracion(8, "Conservar documentos, importaciones y recifrados al eliminar a su autor")
+def _0008_autores_on_delete(conexion):
+    if conexion.dialect.name == "sqlite":
+        # SQLite no permite cambiar llaves foráneas con ALTER TABLE ni las aplica sin PRAGMA foreign_keys;
+        # crud.eliminar_usuario deja las columnas en NULL antes de borrar
+        return
+    inspector = inspect(conexion)
+    for tabla, columna in AUTORES:
+        for llave in inspector.get_foreign_keys(tabla):
+            if llave["constrained_columns"] == [columna] and llave["referred_table"] == "usuarios":
+                conexion.execute(text(f'ALTER TABLE {tabla} DROP CONSTRAINT "{llave["name"]}"'))
+        conexion.execute(text(
+            f"ALTER TABLE {tabla} ADD CONSTRAINT fk_{tabla}_{columna} "
+            f"FOREIGN KEY ({columna}) REFERENCES usuarios (id) ON DELETE SET NULL"
+        ))
+
+@migracion(9, "Versión de cada usuario para validar las copias en caché entre workers")
+def _0009_version_usuarios(conexion):
+    metadata = MetaData()
+    Table("usuarios", metadata,
+          Column("id", Integer, primary_key=True),
+          Column("version", Integer))
+    agregar_faltantes(conexion, metadata)
+    conexion.execute(text("UPDATE usuarios SET version = 1 WHERE version IS NULL"))
+
+def _bloquear(conexion):
+    # Evita que dos workers apliquen las mismas migraciones a la vez
+    if conexion.dialect.name == "postgresql":
+        conexion.execute(text("SELECT pg_advisory_xact_lock(723001)"))
+    elif conexion.dialect.name == "sqlite":
+        conexion.exec_driver_sql("BEGIN IMMEDIATE")
+
+def version_actual(conexion) -> int:
+    if not inspect(conexion).has_table(version_esquema.name):
+        return 0
+    return conexion.execute(select(version_esquema.c.version).order_by(version_esquema.c.version.desc())).scalar() or 0
+
+def version_esperada() -> int:
+    return MIGRACIONES[-1][0] if MIGRACIONES else 0
+
+def migrar(motor, hasta: int = None) -> list:
+    """Aplica en una sola transacción las migraciones pendientes y devuelve las versiones aplicadas."""
+    aplicadas = []
+    with motor.begin() as conexion:
+        _bloquear(conexion)
+        version_esquema.create(conexion, checkfirst=True)
+        actual = version_actual(conexion)
+        for version, descripcion, funcion in MIGRACIONES:
+            if version <= actual or (hasta is not None and version > hasta):
+                continue
+            funcion(conexion)
+            conexion.execute(version_esquema.insert().values(
+                version=version, descripcion=descripcion,
+                aplicada=datetime.now(timezone.utc).replace(tzinfo=None)))
+            aplicadas.append(version)
+    return aplicadas
+
+def main():
+    from app.basedatos import motor
+    parser = argparse.ArgumentParser(description="Migraciones del esquema de la base de datos")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    aplicar = sub.add_parser("aplicar", help="Aplica las migraciones pendientes")
+    aplicar.add_argument("--hasta", type=int, default=None)
+    sub.add_parser("estado", help="Muestra la versión actual y la esperada")
+    args = parser.parse_args()
+
+    if args.comando == "aplicar":
+        aplicadas = migrar(motor, args.hasta)
+        print(f"Migraciones aplicadas: {aplicadas or 'ninguna'}")
+    else:
+        with motor.connect() as conexion:
+            print(f"{motor.url.render_as_string(hide_password=True)}: versión {version_actual(conexion)} de {version_esperada()}")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Text, LargeBinary
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Text, LargeBinary, DateTime, Index, Float
+from sqlalchemy.orm import relationship, deferred
 from app.basedatos import Base
 
 class Usuario(Base):
@@ -9,37 +9,158 @@ class Usuario(Base):
     correo = Column(String(30), unique=True, index=True)
     contraseña = Column(String(256))
     matricula = Column(String(10), unique=True)
-    rol = Column(String(15))
+    rol = Column(String(15), index=True)
     primer_login = Column(Boolean, default=True)
     clave_publica = Column(Text, nullable=True)
+    # Aumenta con cada cambio que vuelve obsoletas las copias de cache_usuarios en cualquier worker
+    version = Column(Integer, default=1, nullable=False)
 
     estudiante = relationship("Estudiante", uselist=False, back_populates="usuario", cascade="all, delete-orphan")
+    accesos = relationship("Acceso_Documento", cascade="all, delete-orphan")
 
 class Estudiante(Base):
     __tablename__ = "estudiantes"
     id = Column(Integer, ForeignKey("usuarios.id"), primary_key=True)
     telefono = Column(Integer)
+    # Aumenta con cada cambio en sus calificaciones o documentos: clave de su fragmento en los tableros
+    version = Column(Integer, default=1, nullable=False)
 
     usuario = relationship("Usuario", back_populates="estudiante")
-    documentos = relationship("Documento", back_populates="estudiante", cascade="all, delete")
+    documentos = relationship("Documento", back_populates="estudiante", cascade="all, delete", order_by="Documento.id")
     historial= relationship("Historial_Academico", back_populates="estudiante")
 
 class Documento(Base):
     __tablename__ = "documentos"
+    # Catálogo: los listados filtran por estudiante y tipo sin tocar el cifrado
+    __table_args__ = (Index("ix_documentos_estudiante_tipo", "id_estudiante", "tipo"),)
     id = Column(Integer, primary_key=True, index=True)
     id_estudiante = Column(Integer, ForeignKey("estudiantes.id"))
-    nombre_archivo = Column(String(20))
-    datos = Column(Text)
+    tipo = Column(String(30), default="expediente")
+    nombre_archivo = Column(String(255))
+    tamano = Column(Integer, nullable=True)
+    subido = Column(DateTime, index=True, nullable=True)
+    # SHA-256 del PDF en claro: permite verificar el contenido tras descifrar o recifrar
+    hash_contenido = Column(String(64), nullable=True)
+    id_subido_por = Column(Integer, ForeignKey("usuarios.id", ondelete="SET NULL"), nullable=True)
+    version_llave = Column(Integer, ForeignKey("versiones_llave.id"), index=True)
+    # Llave de datos del documento envuelta con la llave de version_llave (nonce + cifrado).
+    # NULL en documentos anteriores, cifrados directamente con esa llave
+    llave_envuelta = Column(LargeBinary, nullable=True)
+    # SHA-256 del cifrado (nonce + tag + ciphertext) guardado en app.almacen
+    referencia_blob = Column(String(64), index=True, nullable=True)
+    # Formato anterior en base64; lo vacía `python -m app.almacen migrar`
+    datos = deferred(Column(Text, nullable=True))
 
     estudiante = relationship("Estudiante", back_populates="documentos")
+    accesos = relationship("Acceso_Documento", cascade="all, delete-orphan")
 
 class Historial_Academico(Base):
     __tablename__ = "historiales"
+    # Destino del INSERT ... ON CONFLICT de actualizar_calificaciones_lote
+    __table_args__ = (Index("ux_historiales_estudiante_materia_semestre", "id_estudiante", "materia", "semestre", unique=True),)
     id = Column(Integer, primary_key=True, index=True)
-    id_estudiante = Column(Integer, ForeignKey("estudiantes.id"))
-    semestre = Column(String(10))
-    materia = Column(String(30))
+    id_estudiante = Column(Integer, ForeignKey("estudiantes.id"), index=True)
+    # "" cuando no se indica semestre; NULL rompería la unicidad en SQLite
+    semestre = Column(String(10), default="", nullable=False, index=True)
+    materia = Column(String(30), index=True)
     calificacion = Column(String(5))
+    # Valor numérico de `calificacion`; NULL si no es un número (p. ej. "NP")
+    calificacion_numerica = Column(Float, nullable=True)
     ultima_modificacion = Column(String(100), nullable=True)
 
-    estudiante = relationship("Estudiante", back_populates="historial")
\ No newline at end of file
+    estudiante = relationship("Estudiante", back_populates="historial")
+
+class Estadistica_Calificacion(Base):
+    __tablename__ = "estadisticas_calificaciones"
+    # Agregados por materia, semestre y cubeta (parte entera de la calificación). Se actualizan con
+    # cada escritura de calificaciones; `python -m app.analitica reconstruir` los recalcula desde cero.
+    materia = Column(String(30), primary_key=True)
+    semestre = Column(String(10), primary_key=True)
+    cubeta = Column(Integer, primary_key=True)
+    conteo = Column(Integer, default=0, nullable=False)
+    suma = Column(Float, default=0, nullable=False)
+    suma_cuadrados = Column(Float, default=0, nullable=False)
+
+class Contador_Version(Base):
+    __tablename__ = "contadores_version"
+    # Un contador por conjunto de datos que muestran los tableros ("staff", "estudiantes", "calificaciones").
+    # Las escrituras lo incrementan en su misma transacción y los tableros lo usan como ETag.
+    nombre = Column(String(30), primary_key=True)
+    version = Column(Integer, default=1, nullable=False)
+
+class Evento_Cambio(Base):
+    __tablename__ = "eventos_cambios"
+    # Registro de cambios que se envía por server-sent events; el id es el Last-Event-ID del cliente.
+    # Sin llave foránea: el evento de un usuario eliminado debe sobrevivirle.
+    id = Column(Integer, primary_key=True, index=True)
+    # "estudiante" (alta, baja o cambio de su fila) o "staff"
+    tipo = Column(String(15))
+    id_usuario = Column(Integer, nullable=True)
+    creado = Column(DateTime, index=True)
+
+class Correo_Pendiente(Base):
+    __tablename__ = "correos_pendientes"
+    id = Column(Integer, primary_key=True, index=True)
+    destinatario = Column(String(100))
+    asunto = Column(String(200))
+    cuerpo = Column(Text)
+    adjunto = Column(LargeBinary, nullable=True)
+    nombre_adjunto = Column(String(100), nullable=True)
+    # pendiente -> enviando -> enviado | fallido
+    estado = Column(String(10), default="pendiente", index=True)
+    intentos = Column(Integer, default=0)
+    siguiente_intento = Column(DateTime, index=True)
+    ultimo_error = Column(String(300), nullable=True)
+    creado = Column(DateTime)
+
+class Importacion(Base):
+    __tablename__ = "importaciones"
+    id = Column(Integer, primary_key=True, index=True)
+    id_usuario = Column(Integer, ForeignKey("usuarios.id", ondelete="SET NULL"))
+    # en_cola -> procesando -> terminado | fallido
+    estado = Column(String(12), default="en_cola")
+    total = Column(Integer, default=0)
+    procesados = Column(Integer, default=0)
+    exitosos = Column(Integer, default=0)
+    # Lista JSON de {"fila", "matricula", "error"}
+    errores = Column(Text, default="[]")
+    creado = Column(DateTime)
+    terminado = Column(DateTime, nullable=True)
+
+class Acceso_Documento(Base):
+    __tablename__ = "accesos_documento"
+    id_documento = Column(Integer, ForeignKey("documentos.id"), primary_key=True)
+    id_usuario = Column(Integer, ForeignKey("usuarios.id"), primary_key=True, index=True)
+    # Llave de datos del documento cifrada con Usuario.clave_publica (RSA-OAEP)
+    llave_cifrada = Column(LargeBinary)
+    creado = Column(DateTime)
+
+class Version_Llave(Base):
+    __tablename__ = "versiones_llave"
+    id = Column(Integer, primary_key=True, index=True)
+    # SHA-256 de la llave simétrica; la llave nunca se guarda. NULL en la versión heredada hasta
+    # que alguien presenta la llave que abre sus documentos
+    huella = Column(String(64), unique=True, nullable=True)
+    # activa -> retirando (al iniciar un recifrado; ya no acepta documentos nuevos) -> retirada
+    estado = Column(String(10), default="activa")
+    creada = Column(DateTime)
+    retirada = Column(DateTime, nullable=True)
+
+class Recifrado(Base):
+    __tablename__ = "recifrados"
+    id = Column(Integer, primary_key=True, index=True)
+    id_usuario = Column(Integer, ForeignKey("usuarios.id", ondelete="SET NULL"))
+    version_origen = Column(Integer, ForeignKey("versiones_llave.id"))
+    version_destino = Column(Integer, ForeignKey("versiones_llave.id"))
+    # en_cola -> procesando -> terminado | pausado | fallido
+    estado = Column(String(12), default="en_cola")
+    total = Column(Integer, default=0)
+    procesados = Column(Integer, default=0)
+    fallidos = Column(Integer, default=0)
+    # Punto de control: último Documento.id procesado
+    ultimo_id = Column(Integer, default=0)
+    # Lista JSON de {"id_documento", "error"}
+    errores = Column(Text, default="[]")
+    creado = Column(DateTime)
+    actualizado = Column(DateTime)
+    terminado = Column(DateTime, nullable=True)
@@ -0,0 +1,90 @@
+import functools
+import hashlib
+import os
+import jinja2
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from fastapi.templating import Jinja2Templates
+from markupsafe import Markup
+from app.cache import CacheTTL
+
+# Un solo entorno Jinja para toda la app: cada plantilla se compila una vez por proceso y el
+# bytecode se guarda en disco para que los demás workers (y los reinicios) no la recompilen.
+DIRECTORIO_PLANTILLAS = "templates"
+# En producción las plantillas no cambian: sin auto_reload Jinja no revisa la fecha del archivo en cada render
+RECARGAR_PLANTILLAS = os.getenv("Recargar_Plantillas", "0") == "1"
+# Sin valor, Jinja usa un directorio por usuario dentro del temporal del sistema
+DIRECTORIO_CACHE_PLANTILLAS = os.getenv("Cache_Plantillas") or None
+# Caracteres acumulados antes de enviar una parte de una plantilla transmitida
+TAMANO_PARTE_HTML = 16 * 1024
+
+# HTML ya renderizado por (plantilla, id, versión). Una versión nueva es otra clave, así que las
+# entradas viejas no se invalidan: salen por LRU o por TTL.
+cache_fragmentos = CacheTTL(
+    maximo=int(os.getenv("Max_Cache_Fragmentos", "4096")),
+    ttl=float(os.getenv("TTL_Cache_Fragmentos", "3600")),
+)
+
+def _crear_entorno() -> jinja2.Environment:
+    if DIRECTORIO_CACHE_PLANTILLAS:
+        os.makedirs(DIRECTORIO_CACHE_PLANTILLAS, exist_ok=True)
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(DIRECTORIO_PLANTILLAS),
+        autoescape=True,
+        auto_reload=RECARGAR_PLANTILLAS,
+        bytecode_cache=jinja2.FileSystemBytecodeCache(DIRECTORIO_CACHE_PLANTILLAS),
+    )
+
+templates = Jinja2Templates(env=_crear_entorno())
+
+def precompilar() -> int:
+    """Compila todas las plantillas y deja su bytecode en la caché de disco."""
+    nombres = templates.env.list_templates(extensions=["html"])
+    for nombre in nombres:
+        templates.get_template(nombre)
+    return len(nombres)
+
+@functools.cache
+def huella_plantillas() -> str:
+    """Hash del código de las plantillas: parte de los ETag, para que un despliegue nuevo no reciba 304."""
+    resumen = hashlib.sha256()
+    for nombre in sorted(templates.env.list_templates(extensions=["html"])):
+        with open(os.path.join(DIRECTORIO_PLANTILLAS, nombre), "rb") as archivo:
+            resumen.update(nombre.encode("utf-8") + b"\0" + archivo.read())
+    return resumen.hexdigest()[:16]
+
+def fragmentos(nombre: str, versiones: list, cargar) -> dict:
+    """{id: HTML} de `nombre` para cada (id, versión), en orden. Solo se renderizan los que no están en
+    caché con esa versión; `cargar(ids)` devuelve {id: contexto} de los que faltan."""
+    html = {id_: cache_fragmentos.obtener((nombre, id_, version)) for id_, version in versiones}
+    faltantes = [id_ for id_, valor in html.items() if valor is None]
+    if faltantes:
+        plantilla = templates.get_template(nombre)
+        version_de = dict(versiones)
+        for id_, contexto in cargar(faltantes).items():
+            html[id_] = Markup(plantilla.render(contexto))
+            cache_fragmentos.guardar((nombre, id_, version_de[id_]), html[id_])
+    # Un id borrado entre las dos consultas simplemente no aparece
+    return {id_: html[id_] for id_, _ in versiones if html[id_] is not None}
+
+def _en_partes(eventos):
+    # generate() entrega fragmentos muy pequeños; se agrupan para no enviar miles de partes
+    buffer, tamano = [], 0
+    for fragmento in eventos:
+        buffer.append(fragmento)
+        tamano += len(fragmento)
+        if tamano >= TAMANO_PARTE_HTML:
+            yield "".join(buffer).encode("utf-8")
+            buffer, tamano = [], 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+
+def plantilla_transmitida(request: Request, nombre: str, contexto: dict, status_code: int = 200,
+                          headers: dict = None) -> StreamingResponse:
+    """Como TemplateResponse, pero envía el HTML mientras se genera: ni el primer byte ni la memoria
+    esperan a que se renderice la página completa. Todo lo que use la plantilla debe estar ya cargado,
+    porque la sesión de la base se cierra antes de transmitir."""
+    plantilla = templates.get_template(nombre)
+    eventos = plantilla.generate({**contexto, "request": request})
+    return StreamingResponse(_en_partes(eventos), status_code=status_code, headers=headers,
+                             media_type="text/html; charset=utf-8")
@@ -0,0 +1,248 @@
+import base64
+import hashlib
+import json
+import os
+import time
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+from app.almacen import obtener_almacen
+from app.basedatos import SesionLocal
+from app.cifrado import descifrar_documento, desenvolver_llave, envolver_llave
+from app.crud import cifrar_y_guardar, resolver_version_llave, llave_de_datos, obtener_titulares
+from app.llaves import cifrar_clave_para
+from app.modelos import Acceso_Documento, Documento, Recifrado, Usuario, Version_Llave
+
+# Rotación de la llave simétrica en segundo plano, por lotes. Con llaves por documento basta volver
+# a envolver la llave de datos (32 bytes) con la llave nueva; solo los documentos anteriores se
+# descifran y se vuelven a cifrar. Cada lote actualiza los documentos y el punto de control en la
+# misma transacción, así que un reinicio retoma donde se quedó sin repetir trabajo.
+LOTE_RECIFRADO = int(os.getenv("Lote_Recifrado", "50"))
+HILOS_RECIFRADO = int(os.getenv("Hilos_Recifrado", "4"))
+# MB/s de documentos recifrados (0 = sin límite): deja disco y CPU para las peticiones en línea
+LIMITE_RECIFRADO_MBS = float(os.getenv("Limite_Recifrado_MBs", "0"))
+# Un recifrado "procesando" que no avanza en este tiempo perdió su proceso y puede reanudarse
+SIN_AVANCE = timedelta(minutes=2)
+
+# Un recifrado a la vez por proceso; cada uno reparte sus lotes en HILOS_RECIFRADO hilos
+_ejecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recifrado")
+
+def _ahora() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+class _Limitador:
+    def __init__(self, mb_por_segundo: float):
+        self.bytes_por_segundo = mb_por_segundo * 2**20
+        self.inicio = time.monotonic()
+        self.total = 0
+
+    def consumir(self, cantidad: int):
+        if self.bytes_por_segundo <= 0:
+            return
+        self.total += cantidad
+        espera = self.total / self.bytes_por_segundo - (time.monotonic() - self.inicio)
+        if espera > 0:
+            time.sleep(espera)
+
+def _versiones(db: Session, llave_actual: bytes, llave_nueva: bytes):
+    origen = resolver_version_llave(db, llave_actual, registrar=False)
+    if origen is None:
+        raise ValueError("La llave actual no corresponde a ninguna versión registrada")
+    destino = resolver_version_llave(db, llave_nueva)
+    if destino is None:
+        raise ValueError("La llave nueva no corresponde a ninguna versión registrada; genérala con /jefe/generar-clave")
+    if destino.id == origen.id:
+        raise ValueError("La llave nueva debe ser distinta de la actual")
+    if destino.estado != "activa":
+        raise ValueError(f"La versión {destino.id} de la llave nueva está {destino.estado}")
+    return origen, destino
+
+def listar_versiones(db: Session) -> list:
+    conteos = dict(db.query(Documento.version_llave, func.count(Documento.id)).group_by(Documento.version_llave).all())
+    return [
+        {"id": v.id, "estado": v.estado, "creada": v.creada, "retirada": v.retirada,
+         "identificada": v.huella is not None, "documentos": conteos.get(v.id, 0)}
+        for v in db.query(Version_Llave).order_by(Version_Llave.id)
+    ]
+
+def obtener_recifrado(db: Session, id_recifrado: int):
+    return db.get(Recifrado, id_recifrado)
+
+def iniciar_recifrado(db: Session, usuario: Usuario, llave_actual: bytes, llave_nueva: bytes) -> Recifrado:
+    origen, destino = _versiones(db, llave_actual, llave_nueva)
+    pendiente = db.query(Recifrado.id).filter(Recifrado.version_origen == origen.id,
+                                              Recifrado.estado.in_(("en_cola", "procesando", "pausado"))).first()
+    if pendiente:
+        raise ValueError(f"El recifrado {pendiente.id} de esta versión sigue pendiente; reanúdalo")
+    # Desde aquí la llave vieja ya no se acepta para subir documentos nuevos
+    origen.estado = "retirando"
+    ahora = _ahora()
+    recifrado = Recifrado(id_usuario=usuario.id, version_origen=origen.id, version_destino=destino.id,
+                          estado="en_cola", procesados=0, fallidos=0, ultimo_id=0, errores="[]",
+                          total=db.query(func.count(Documento.id)).filter(Documento.version_llave == origen.id).scalar(),
+                          creado=ahora, actualizado=ahora)
+    db.add(recifrado)
+    db.commit()
+    db.refresh(recifrado)
+    _ejecutor.submit(ejecutar_recifrado, recifrado.id, llave_actual, llave_nueva)
+    return recifrado
+
+def reanudar_recifrado(db: Session, recifrado: Recifrado, llave_actual: bytes, llave_nueva: bytes) -> Recifrado:
+    # Las llaves solo viven en memoria: tras un reinicio el jefe debe volver a presentarlas
+    huerfano = recifrado.estado in ("en_cola", "procesando") and recifrado.actualizado < _ahora() - SIN_AVANCE
+    if recifrado.estado not in ("pausado", "fallido") and not huerfano:
+        raise ValueError(f"El recifrado está {recifrado.estado}")
+    origen, destino = _versiones(db, llave_actual, llave_nueva)
+    if (origen.id, destino.id) != (recifrado.version_origen, recifrado.version_destino):
+        raise ValueError("Las llaves no corresponden a las versiones de este recifrado")
+    recifrado.estado = "en_cola"
+    recifrado.actualizado = _ahora()
+    db.commit()
+    _ejecutor.submit(ejecutar_recifrado, recifrado.id, llave_actual, llave_nueva)
+    return recifrado
+
+def pausar_recifrado(db: Session, recifrado: Recifrado) -> Recifrado:
+    # El trabajador revisa el estado antes de cada lote, también si corre en otro proceso
+    if recifrado.estado not in ("en_cola", "procesando"):
+        raise ValueError(f"El recifrado está {recifrado.estado}")
+    recifrado.estado = "pausado"
+    recifrado.actualizado = _ahora()
+    db.commit()
+    return recifrado
+
+def _reenvolver_documento(documento, llave_actual: bytes, llave_nueva: bytes):
+    """Envuelve la llave de datos con la llave nueva; el blob no se lee ni cambia."""
+    try:
+        llave_datos = llave_de_datos(documento, llave_actual)
+    except ValueError:
+        return None, "Llave actual incorrecta o llave de datos dañada"
+    envuelta = envolver_llave(llave_datos, llave_nueva, documento.referencia_blob)
+    # Como con los blobs recifrados, no se guarda nada que no se haya leído de vuelta con la llave nueva
+    try:
+        verificada = desenvolver_llave(envuelta, llave_nueva, documento.referencia_blob)
+    except ValueError:
+        verificada = None
+    if verificada != llave_datos:
+        return None, "La llave de datos envuelta con la llave nueva no pasó la verificación"
+    # Las copias RSA de los titulares siguen sirviendo: la llave de datos es la misma
+    return {"llave_envuelta": envuelta}, None
+
+def _recifrar_documento(documento, llave_actual: bytes, llave_nueva: bytes, titulares: dict):
+    """Cifra el documento con la llave nueva y verifica el blob resultante; no toca la base."""
+    if documento.llave_envuelta is not None:
+        return _reenvolver_documento(documento, llave_actual, llave_nueva)
+    almacen = obtener_almacen()
+    try:
+        if documento.referencia_blob:
+            bloques = almacen.leer_bloques(documento.referencia_blob)
+        else:
+            bloques = iter([base64.b64decode(documento.datos)])
+        try:
+            contenido = cifrar_y_guardar(descifrar_documento(bloques, llave_actual), llave_nueva)
+        except ValueError:
+            return None, "Llave actual incorrecta o documento dañado"
+        try:
+            if documento.hash_contenido and contenido["hash_contenido"] != documento.hash_contenido:
+                raise ValueError("El contenido descifrado no coincide con hash_contenido")
+            # El documento queda en el formato con llave de datos: se verifica a través del sobre nuevo
+            llave_datos = llave_de_datos(SimpleNamespace(**contenido), llave_nueva)
+            sha = hashlib.sha256()
+            for bloque in descifrar_documento(almacen.leer_bloques(contenido["referencia_blob"]), llave_datos):
+                sha.update(bloque)
+            if sha.hexdigest() != contenido["hash_contenido"]:
+                raise ValueError("El cifrado nuevo no pasó la verificación")
+        except ValueError as error:
+            almacen.eliminar(contenido["referencia_blob"])
+            return None, str(error)
+        return {**contenido, "accesos": cifrar_clave_para(llave_datos, titulares) if titulares else {}}, None
+    except FileNotFoundError:
+        return None, "Blob no encontrado en el almacén"
+
+def _eliminar_sin_referencia(db: Session, referencias: list):
+    almacen = obtener_almacen()
+    usadas = {r for (r,) in db.query(Documento.referencia_blob).filter(Documento.referencia_blob.in_(referencias))}
+    for referencia in set(referencias) - usadas:
+        almacen.eliminar(referencia)
+
+def ejecutar_recifrado(id_recifrado: int, llave_actual: bytes, llave_nueva: bytes):
+    db = SesionLocal()
+    errores = []
+    try:
+        recifrado = db.get(Recifrado, id_recifrado)
+        origen, destino = recifrado.version_origen, recifrado.version_destino
+        procesados, fallidos, ultimo_id = recifrado.procesados or 0, recifrado.fallidos or 0, recifrado.ultimo_id or 0
+        errores = json.loads(recifrado.errores or "[]")
+        # Una pausa pedida mientras esperaba en la cola gana
+        if not db.execute(update(Recifrado).where(Recifrado.id == id_recifrado, Recifrado.estado == "en_cola")
+                          .values(estado="procesando", actualizado=_ahora())).rowcount:
+            db.rollback()
+            return
+        db.commit()
+        limitador = _Limitador(LIMITE_RECIFRADO_MBS)
+        titulares = obtener_titulares(db)
+        db.rollback()
+
+        with ThreadPoolExecutor(max_workers=HILOS_RECIFRADO, thread_name_prefix="recifrado-hilo") as hilos:
+            while True:
+                if db.query(Recifrado.estado).filter(Recifrado.id == id_recifrado).scalar() == "pausado":
+                    return
+                # Los documentos fallidos se quedan en la versión de origen: ultimo_id evita repetirlos
+                lote = (db.query(Documento.id, Documento.referencia_blob, Documento.datos, Documento.hash_contenido,
+                                 Documento.llave_envuelta)
+                        .filter(Documento.version_llave == origen, Documento.id > ultimo_id)
+                        .order_by(Documento.id).limit(LOTE_RECIFRADO).all())
+                db.rollback()
+                if not lote:
+                    break
+                resultados = list(hilos.map(lambda d: _recifrar_documento(d, llave_actual, llave_nueva, titulares), lote))
+
+                viejos, descartados, bytes_lote = [], [], 0
+                for documento, (contenido, error) in zip(lote, resultados):
+                    if error:
+                        fallidos += 1
+                        errores.append({"id_documento": documento.id, "error": error[:200]})
+                        continue
+                    accesos = contenido.pop("accesos", None)
+                    cambiados = db.execute(
+                        update(Documento)
+                        .where(Documento.id == documento.id, Documento.version_llave == origen)
+                        .values(version_llave=destino, datos=None, **contenido)
+                    ).rowcount
+                    if "referencia_blob" not in contenido:
+                        # Solo se volvió a envolver la llave de datos: no hay blobs que limpiar
+                        continue
+                    bytes_lote += contenido["tamano"]
+                    # Si la fila cambió o se eliminó mientras tanto, el blob nuevo sobra
+                    (viejos if cambiados else descartados).append(
+                        documento.referencia_blob if cambiados else contenido["referencia_blob"])
+                    if cambiados and accesos:
+                        db.add_all(Acceso_Documento(id_documento=documento.id, id_usuario=id_usuario,
+                                                    llave_cifrada=cifrada, creado=_ahora())
+                                   for id_usuario, cifrada in accesos.items())
+                ultimo_id = lote[-1].id
+                procesados += len(lote)
+                db.execute(update(Recifrado).where(Recifrado.id == id_recifrado).values(
+                    procesados=procesados, fallidos=fallidos, ultimo_id=ultimo_id,
+                    errores=json.dumps(errores), actualizado=_ahora()))
+                db.commit()
+                _eliminar_sin_referencia(db, [r for r in viejos + descartados if r])
+                db.rollback()
+                limitador.consumir(bytes_lote)
+
+        restantes = db.query(func.count(Documento.id)).filter(Documento.version_llave == origen).scalar()
+        ahora = _ahora()
+        db.execute(update(Recifrado).where(Recifrado.id == id_recifrado, Recifrado.estado == "procesando")
+                   .values(estado="terminado", terminado=ahora, actualizado=ahora))
+        if restantes == 0:
+            db.execute(update(Version_Llave).where(Version_Llave.id == origen).values(estado="retirada", retirada=ahora))
+        db.commit()
+    except Exception as error:
+        db.rollback()
+        errores.append({"id_documento": None, "error": str(error)[:200]})
+        db.execute(update(Recifrado).where(Recifrado.id == id_recifrado).values(
+            estado="fallido", errores=json.dumps(errores), actualizado=_ahora(), terminado=_ahora()))
+        db.commit()
+    finally:
+        db.close()
@@ -1,34 +1,54 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, JSONResponse
 from sqlalchemy.orm import Session
+from typing import Optional
 from app.auth import obtener_usuario_actual
-from app.basedatos import SesionLocal
+from app.basedatos import obtener_bd
 from app.modelos import Usuario
+from app.crud import obtener_historial, listar_documentos
+from app.schemas import DocumentoResumen, PaginaDocumentos
+from app.plantillas import templates, huella_plantillas
+from app import versiones
 
 ruta = APIRouter()
-templates = Jinja2Templates(directory="templates")
 
 
-def obtener_bd():
-    db = SesionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @ruta.get("/perfil")
-def ver_perfil(usuario_actual = Depends(obtener_usuario_actual), db: Session = Depends(obtener_bd)):
-    if usuario_actual.rol != "student":
+def ver_perfil(request: Request, usuario_actual = Depends(obtener_usuario_actual)):
+    if usuario_actual.rol != "estudiante":
         raise HTTPException(status_code=403, detail="No autorizado")
-    return {
+    perfil = {
         "nombre": usuario_actual.nombre,
         "correo": usuario_actual.correo,
         "matricula": usuario_actual.matricula
     }
+    # El perfil sale del usuario autenticado (en caché): la etiqueta no necesita consultar la base
+    etag = versiones.etiqueta("perfil", usuario_actual.id, perfil)
+    respuesta = versiones.no_modificado(request, etag)
+    if respuesta is not None:
+        return respuesta
+    return JSONResponse(perfil, headers=versiones.encabezados(etag))
 
 @ruta.get("/dashboard", response_class=HTMLResponse)
-def estudiante_dashboard(request: Request, usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+def estudiante_dashboard(request: Request, db: Session = Depends(obtener_bd), usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    if usuario_actual.rol != "estudiante":
+        raise HTTPException(status_code=403, detail="No autorizado")
+    etag = versiones.etiqueta(huella_plantillas(), "estudiante", usuario_actual.id, usuario_actual.nombre,
+                              versiones.version_estudiante(db, usuario_actual.id))
+    respuesta = versiones.no_modificado(request, etag)
+    if respuesta is not None:
+        return respuesta
+    historial = obtener_historial(db, usuario_actual.id)
+    return templates.TemplateResponse("estudiante_dashboard.html", {"request": request, "usuario": usuario_actual, "historial": historial},
+                                      headers=versiones.encabezados(etag))
+
+@ruta.get("/documentos", response_model=PaginaDocumentos)
+def listar_mis_documentos(tipo: Optional[str] = None,
+                          despues_de: Optional[int] = None,
+                          limite: int = Query(50, ge=1, le=200),
+                          db: Session = Depends(obtener_bd),
+                          usuario_actual: Usuario = Depends(obtener_usuario_actual)):
     if usuario_actual.rol != "estudiante":
         raise HTTPException(status_code=403, detail="No autorizado")
-    return templates.TemplateResponse("estudiante_dashboard.html", {"request": request, "usuario": usuario_actual})
\ No newline at end of file
+    documentos, siguiente = listar_documentos(db, id_estudiante=usuario_actual.id, tipo=tipo, despues_de=despues_de, limite=limite)
+    return PaginaDocumentos(documentos=[DocumentoResumen.desde_modelo(d) for d in documentos], siguiente=siguiente)
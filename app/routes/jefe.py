@@ -1,59 +1,96 @@
 import io
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Request, Form
+from fastapi import APIRouter, Depends, Query, HTTPException, UploadFile, File, Request, Form
 from fastapi.responses import FileResponse, HTMLResponse, RedirectResponse, StreamingResponse
-from fastapi.templating import Jinja2Templates
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.schemas import CrearUsuario
-from app.crud import crear_estudiante, crear_usuario, eliminar_usuario
-from app.auth import obtener_usuario_actual, enviar_correo
-from app.basedatos import SesionLocal
-from app.auth import ph
-import string, random
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
+from app.schemas import CrearUsuario, EstudianteResumen, PaginaEstudiantes, DocumentoResumen, PaginaDocumentos, VersionLlave, EstadoRecifrado, AccesosConcedidos, EstadoImportacion, LoteCalificaciones, ResultadoCalificaciones
+from app.crud import eliminar_usuario
+from app.auth import obtener_usuario_actual
+from app.correo import encolar_correo, cuerpo_registro_estudiante, despachador
+from app.basedatos import obtener_bd, obtener_bd_async, estadisticas_bd
+from app import crud_async
+from app.metricas import monitor_bucle
+from app.cache import cache_usuarios
+from app.auth import servicio_hash, generar_contraseña_provisional
 import base64
 import os
-from app.cifrado import cifrar_chacha20_poly1305, descifrar_chacha20_poly1305, generar_clave_chacha, cifrar_clave, descifrar_clave
-from app.modelos import Documento, Usuario, Historial_Academico
-from app.crud import actualizar_calificaciones
+from app.cifrado import decodificar_llave, generar_clave_chacha, TAMANO_SEGMENTO
+from app.documentos import obtener_documento_autorizado, respuesta_documento
+from app.llaves import cifrar_clave, descifrar_clave, cifrar_clave_para
+from app.modelos import Usuario
+from app.recifrado import listar_versiones, obtener_recifrado, iniciar_recifrado, reanudar_recifrado, pausar_recifrado
+from app.analitica import resumen_materias, reporte
+from app.exportacion import preparar_exportacion
+from app.importacion import iniciar_importacion, obtener_importacion, leer_calificaciones_csv
+from app.crud import actualizar_calificaciones_lote, obtener_staff, listar_estudiantes, listar_documentos, listar_versiones_estudiantes, contextos_estudiantes, resolver_version_llave, obtener_usuario, conceder_accesos, revocar_accesos
+from app.plantillas import plantilla_transmitida, fragmentos, huella_plantillas
+from app import versiones
+from app.eventos import ultimo_evento, respuesta_eventos
 
 
 ruta = APIRouter()
-templates = Jinja2Templates(directory="templates")
-
-def obtener_bd():
-    db = SesionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+TAMANO_PAGINA = 50
 
 @ruta.get("/dashboard", response_class=HTMLResponse)
 def jefe_dashboard(request: Request, db: Session = Depends(obtener_bd), usuario_actual: Usuario = Depends(obtener_usuario_actual)):
     if usuario_actual.rol != "jefe":
         raise HTTPException(status_code=403, detail="Acceso no autorizado")
-    staff_list = db.query(Usuario).filter(Usuario.rol == "staff").all()
-    estudiantes = db.query(Usuario).filter(Usuario.rol == "estudiante").all()
-    historiales = {}
-    for estudiante in estudiantes:
-        historial = db.query(Historial_Academico).filter_by(id_estudiante=estudiante.id).all()
-        historiales[estudiante.matricula] = historial
-    return templates.TemplateResponse("jefe_dashboard.html", {"request": request, "usuario": usuario_actual, "staff": staff_list, "estudiantes": estudiantes, "historiales": historiales})
-
+    # Si nada cambió desde la última vista basta con leer los contadores
+    etag = versiones.etiqueta(huella_plantillas(), "jefe", usuario_actual.id, usuario_actual.nombre, versiones.leer(db))
+    respuesta = versiones.no_modificado(request, etag)
+    if respuesta is not None:
+        return respuesta
+    # Punto de partida del flujo de cambios: lo que ocurra después de esta lectura llega por /jefe/eventos
+    desde = ultimo_evento(db)
+    staff_list = obtener_staff(db)
+    # Solo se cargan y renderizan los estudiantes cuya versión no está en la caché de fragmentos
+    versiones_estudiantes, siguiente = listar_versiones_estudiantes(db, limite=TAMANO_PAGINA)
+    filas = fragmentos("fila_estudiante.html", versiones_estudiantes, lambda ids: contextos_estudiantes(db, ids))
+    # Lee solo los agregados: el costo no crece con el número de estudiantes
+    estadisticas = resumen_materias(db)
+    return plantilla_transmitida(request, "jefe_dashboard.html", {"usuario": usuario_actual, "staff": staff_list, "fragmentos": filas.values(), "siguiente": siguiente, "estadisticas": estadisticas, "ultimo_evento": desde},
+                                 headers=versiones.encabezados(etag))
+
+@ruta.get("/eventos")
+async def eventos_tablero(request: Request, desde: Optional[int] = None,
+                          usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    if usuario_actual.rol != "jefe":
+        raise HTTPException(status_code=403, detail="Acceso no autorizado")
+    # Una conexión por tablero abierto: filas de estudiantes y avisos de cambios en el staff
+    return respuesta_eventos(request, {"estudiante", "staff"}, desde)
+
+@ruta.get("/estudiantes", response_model=PaginaEstudiantes)
+def listar_estudiantes_json(despues_de: Optional[int] = None,
+                            limite: int = Query(TAMANO_PAGINA, ge=1, le=200),
+                            nombre: Optional[str] = None,
+                            matricula: Optional[str] = None,
+                            semestre: Optional[str] = None,
+                            calificacion_min: Optional[str] = None,
+                            calificacion_max: Optional[str] = None,
+                            db: Session = Depends(obtener_bd),
+                            usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    if usuario_actual.rol != "jefe":
+        raise HTTPException(status_code=403, detail="Acceso no autorizado")
+    estudiantes, siguiente = listar_estudiantes(db, despues_de=despues_de, limite=limite, nombre=nombre,
+                                                matricula=matricula, semestre=semestre,
+                                                calificacion_min=calificacion_min, calificacion_max=calificacion_max)
+    return PaginaEstudiantes(estudiantes=[EstudianteResumen.desde_usuario(e) for e in estudiantes], siguiente=siguiente)
 
 @ruta.post("/dashboard/registrarStaff", response_class=HTMLResponse)
-def registrar_staff(nombre: str = Form(...),
+async def registrar_staff(nombre: str = Form(...),
     correo: str = Form(...),
     matricula: str = Form(...), 
-    db: Session = Depends(obtener_bd), 
+    db: AsyncSession = Depends(obtener_bd_async), 
     usuario_actual = Depends(obtener_usuario_actual)):
     if usuario_actual.rol != "jefe":
         raise HTTPException(status_code=403, detail="Solo los jefes pueden registrar miembros del staff")
     
-    longitud = 10
-    caracteres = string.ascii_letters + string.digits
-    contraseña_provisional = ''.join(random.choice(caracteres) for _ in range(longitud))
-    contraseña_hash = ph.hash(contraseña_provisional)
+    contraseña_provisional = generar_contraseña_provisional()
+    contraseña_hash = await servicio_hash.hash(contraseña_provisional)
     
-    nuevo_usuario = crear_usuario(
+    nuevo_usuario = await crud_async.crear_usuario(
         db,
         nombre=nombre,
         correo=correo,
@@ -72,7 +109,9 @@ def registrar_staff(nombre: str = Form(...),
         f"Para activar tu cuenta accede al siguiente link: \n{enlace_cambio}\n\n"
     )
     
-    enviar_correo(destinatario=correo, asunto="Cambia la contraseña para activar tu cuenta", cuerpo=cuerpo)
+    encolar_correo(db, destinatario=correo, asunto="Cambia la contraseña para activar tu cuenta", cuerpo=cuerpo, confirmar=False)
+    await db.commit()
+    despachador.avisar()
     return RedirectResponse(url="/jefe/dashboard", status_code=303)
 
 @ruta.post("/dashboard/eliminarStaff", response_class=HTMLResponse)
@@ -93,53 +132,58 @@ async def registrar_estudiante(nombre: str = Form(...),
                          telefono: str = Form(...),
                          documento: UploadFile = File(...),
                          llave_simetrica: UploadFile = File(...),
-                         db: Session = Depends(obtener_bd),
+                         db: AsyncSession = Depends(obtener_bd_async),
                          usuario_actual: Usuario = Depends(obtener_usuario_actual)):
     
     if usuario_actual.rol != "jefe":
         raise HTTPException(status_code=403, detail="Solo la administración puede registrar estudiantes")
     
-    longitud = 10
-    caracteres = string.ascii_letters + string.digits
-    contraseña_provisional = ''.join(random.choice(caracteres) for _ in range(longitud))
-    contraseña_hash = ph.hash(contraseña_provisional)
-    nuevo_estudiante = crear_usuario(db, nombre=nombre, correo=correo, rol="estudiante", contraseña=contraseña_hash, matricula=matricula)
+    # La versión de la llave se resuelve antes de crear al usuario: una llave retirada no deja registros a medias
+    llave = decodificar_llave(await llave_simetrica.read())
+    version = await crud_async.version_para_subir(db, llave)
 
-    crear_estudiante(db, matricula=nuevo_estudiante.id, telefono=telefono) 
-    enlace_cambio = f"http://localhost:8000/auth/establecer-contraseña?matricula={matricula}"
-    cuerpo = (
-        f"Hola {nombre},\n\n"
-        f"Has sido registrado como estudiante.\n"
-        f"Tu matrícula es: {matricula}\n"
-        f"Tu contraseña provisional es: {contraseña_provisional}\n"
-        f"Inicia sesión y cambia tu contraseña en: {enlace_cambio}\n\n"
-    )
-    enviar_correo(destinatario=correo, asunto="Registro de Estudiante", cuerpo=cuerpo)
+    contraseña_provisional = generar_contraseña_provisional()
+    contraseña_hash = await servicio_hash.hash(contraseña_provisional)
+    nuevo_estudiante = await crud_async.crear_usuario(db, nombre=nombre, correo=correo, rol="estudiante", contraseña=contraseña_hash, matricula=matricula)
 
-    # Leer archivos
-    pdf_bytes = await documento.read()
-    llave_bytes = await llave_simetrica.read()
-    try:
-        llave = base64.b64decode(llave_bytes)
-    except Exception:
-        llave = llave_bytes
-    nonce, pdf_cifrado, tag = cifrar_chacha20_poly1305(pdf_bytes, llave)
-    datos_guardar = base64.b64encode(nonce + tag + pdf_cifrado).decode("utf-8")
-
-    doc = Documento(
-        id_estudiante=nuevo_estudiante.id,
-        nombre_archivo=documento.filename,
-        datos=datos_guardar
-    )
-    db.add(doc)
-    db.commit()
-    db.refresh(doc)
+    await crud_async.crear_estudiante(db, matricula=nuevo_estudiante.id, telefono=telefono) 
+    cuerpo = cuerpo_registro_estudiante(nombre, matricula, contraseña_provisional)
+    encolar_correo(db, destinatario=correo, asunto="Registro de Estudiante", cuerpo=cuerpo, confirmar=False)
+    await db.commit()
+    despachador.avisar()
+
+    # El documento se cifra por segmentos mientras se lee del archivo temporal, en el pool de hilos
+    bloques = iter(lambda: documento.file.read(TAMANO_SEGMENTO), b"")
+    await crud_async.crear_documento(db, id_estudiante=nuevo_estudiante.id, nombre_archivo=documento.filename,
+                                     bloques=bloques, llave=llave, version_llave=version.id, id_subido_por=usuario_actual.id)
 
     return RedirectResponse(url="/jefe/dashboard", status_code=303)
 
+@ruta.post("/dashboard/importarEstudiantes", response_model=EstadoImportacion)
+async def importar_estudiantes(lista: UploadFile = File(...),
+                               documentos: UploadFile = File(...),
+                               llave_simetrica: UploadFile = File(...),
+                               db: Session = Depends(obtener_bd),
+                               usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    if usuario_actual.rol != "jefe":
+        raise HTTPException(status_code=403, detail="Solo la administración puede registrar estudiantes")
+    llave = decodificar_llave(await llave_simetrica.read())
+    # Copia los archivos subidos a disco: fuera del loop
+    importacion = await run_in_threadpool(iniciar_importacion, db, usuario_actual, lista.file, documentos.file, llave)
+    return EstadoImportacion.desde_modelo(importacion)
+
+@ruta.get("/importaciones/{id_importacion}", response_model=EstadoImportacion)
+def estado_importacion(id_importacion: int, db: Session = Depends(obtener_bd),
+                       usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    if usuario_actual.rol != "jefe":
+        raise HTTPException(status_code=403, detail="Acceso no autorizado")
+    importacion = obtener_importacion(db, id_importacion)
+    if not importacion:
+        raise HTTPException(status_code=404, detail="Importación no encontrada")
+    return EstadoImportacion.desde_modelo(importacion)
+
 @ruta.post("/generar-clave")
-def generar_clave(usuario=Depends(obtener_usuario_actual)):
-    print(f"Rol de usuario: {usuario.rol}")
+def generar_clave(db: Session = Depends(obtener_bd), usuario=Depends(obtener_usuario_actual)):
     if usuario.rol != "jefe":
         raise HTTPException(403, "Solo el jefe puede generar claves")
     
@@ -147,11 +191,10 @@ def generar_clave(usuario=Depends(obtener_usuario_actual)):
         raise HTTPException(400, "No hay clave pública registrada para el jefe")
 
     clave = generar_clave_chacha()
+    # Único lugar donde nace una versión. Se registra solo la huella: la llave sale cifrada para el jefe y no se guarda
+    version = resolver_version_llave(db, clave, registrar=True)
     clave_cifrada = cifrar_clave(clave, usuario.clave_publica)
-    print(f"Clave generada: {base64.b64encode(clave).decode('utf-8')}")
-    print(f"Clave cifrada: {base64.b64encode(clave_cifrada).decode('utf-8')}")
     clave_cifrada_b64 = base64.b64encode(clave_cifrada).decode()
-    print(f"Clave cifrada (base64): {clave_cifrada_b64}")
 
     buffer = io.BytesIO()
     buffer.write(clave_cifrada_b64.encode())
@@ -160,7 +203,28 @@ def generar_clave(usuario=Depends(obtener_usuario_actual)):
     return StreamingResponse(
         buffer,
         media_type="text/plain",
-        headers={"Content-Disposition": "attachment; filename=clave_chacha.txt"}
+        headers={"Content-Disposition": f"attachment; filename=clave_chacha_v{version.id}.txt",
+                 "X-Version-Llave": str(version.id)}
+    )
+
+async def _leer_clave_simetrica(clave_simetrica_cifrada: UploadFile, llave_privada: UploadFile) -> bytes:
+    clave_simetrica_cifrada_bytes = base64.b64decode(await clave_simetrica_cifrada.read())
+    llave_privada_pem = (await llave_privada.read()).decode()
+    try:
+        return await run_in_threadpool(descifrar_clave, clave_simetrica_cifrada_bytes, llave_privada_pem)
+    except Exception:
+        raise HTTPException(400, "Clave privada incorrecta o clave simétrica no válida")
+
+def _encolar_clave_staff(db, staff: Usuario, clave_para_staff: bytes):
+    clave_b64 = base64.b64encode(clave_para_staff).decode("utf-8")
+    encolar_correo(
+        db,
+        destinatario=staff.correo,
+        asunto="Clave de cifrado ChaCha20Poly1305",
+        cuerpo="[UniTrack] Adjunto encontrarás la clave cifrada para el cifrado de los expedientes.",
+        adjunto=clave_b64.encode("utf-8"),
+        nombre_adjunto=f"clave_chacha20poly1305_staff_{staff.matricula}.txt",
+        confirmar=False
     )
 
 @ruta.post("/enviar-clave/{staff_matricula}")
@@ -168,42 +232,47 @@ async def enviar_clave(
     staff_matricula: str,
     clave_simetrica_cifrada: UploadFile = File(...), 
     llave_privada: UploadFile = File(...),         
-    db: Session = Depends(obtener_bd),
+    db: AsyncSession = Depends(obtener_bd_async),
     usuario=Depends(obtener_usuario_actual)
 ):
     if usuario.rol != "jefe":
         raise HTTPException(403, "Solo el jefe puede enviar la clave chacha")
-    
-    clave_simetrica_cifrada_bytes = await clave_simetrica_cifrada.read()
-    clave_simetrica_cifrada_bytes = base64.b64decode(clave_simetrica_cifrada_bytes)
-    llave_privada_pem = (await llave_privada.read()).decode()
-
-    try:
-        clave_simetrica = descifrar_clave(clave_simetrica_cifrada_bytes, llave_privada_pem)
-        print(f"Clave secreta: {base64.b64encode(clave_simetrica).decode('utf-8')}")
 
-    except Exception:
-        raise HTTPException(400, "Clave privada incorrecta o clave simétrica no válida")
+    clave_simetrica = await _leer_clave_simetrica(clave_simetrica_cifrada, llave_privada)
 
-    staff = db.query(Usuario).filter_by(matricula=staff_matricula, rol="staff").first()
-    if not staff or not staff.clave_publica:
+    staff = next(iter(await crud_async.obtener_staff_con_clave(db, staff_matricula)), None)
+    if not staff:
         raise HTTPException(404, "Staff no encontrado o sin clave pública")
 
-    clave_para_staff = cifrar_clave(clave_simetrica, staff.clave_publica)
+    _encolar_clave_staff(db, staff, await run_in_threadpool(cifrar_clave, clave_simetrica, staff.clave_publica))
+    await db.commit()
+    despachador.avisar()
 
-    clave_b64 = base64.b64encode(clave_para_staff).decode("utf-8")
-    archivo_txt = io.BytesIO(clave_b64.encode("utf-8"))
-    nombre_archivo = f"clave_chacha20poly1305_staff_{staff_matricula}.txt"
+    return {"mensaje": "Clave enviada correctamente"}
 
-    enviar_correo(
-        destinatario=staff.correo,
-        asunto="Clave de cifrado ChaCha20Poly1305",
-        cuerpo="[UniTrack] Adjunto encontrarás la clave cifrada para el cifrado de los expedientes.",
-        adjunto=archivo_txt.read(),
-        nombre_adjunto=nombre_archivo
-    )
+@ruta.post("/enviar-clave")
+async def enviar_clave_todo_staff(
+    clave_simetrica_cifrada: UploadFile = File(...),
+    llave_privada: UploadFile = File(...),
+    db: AsyncSession = Depends(obtener_bd_async),
+    usuario=Depends(obtener_usuario_actual)
+):
+    if usuario.rol != "jefe":
+        raise HTTPException(403, "Solo el jefe puede enviar la clave chacha")
 
-    return {"mensaje": "Clave enviada correctamente"}
+    clave_simetrica = await _leer_clave_simetrica(clave_simetrica_cifrada, llave_privada)
+
+    staff_list = await crud_async.obtener_staff_con_clave(db)
+    if not staff_list:
+        raise HTTPException(404, "No hay staff con clave pública")
+
+    claves = await run_in_threadpool(cifrar_clave_para, clave_simetrica, {s.id: s.clave_publica for s in staff_list})
+    for staff in staff_list:
+        _encolar_clave_staff(db, staff, claves[staff.id])
+    await db.commit()
+    despachador.avisar()
+
+    return {"mensaje": f"Clave enviada a {len(staff_list)} miembros del staff"}
 
 @ruta.post("/dashboard/editarCalificaciones", response_class=HTMLResponse)
 async def editar_calificaciones(
@@ -214,14 +283,11 @@ async def editar_calificaciones(
     sistemas_en_chip: str = Form(...),
     sistemas_distribuidos: str = Form(...),
     llave_privada: UploadFile = File(...),
-    db: Session = Depends(obtener_bd),
+    db: AsyncSession = Depends(obtener_bd_async),
     usuario_actual: Usuario = Depends(obtener_usuario_actual)
 ):
     if usuario_actual.rol != "jefe":
         raise HTTPException(status_code=403, detail="Solo la administración puede editar calificaciones")
-    
-    # Convertimos el archivo de llave privada en texto
-    llave_privada_texto = (await llave_privada.read()).decode()
 
     # Crear el diccionario con las calificaciones
     calificaciones = {
@@ -233,36 +299,209 @@ async def editar_calificaciones(
     }
 
     # Llamamos a la función para actualizar las calificaciones
-    actualizar_calificaciones(db, matricula_estudiante, calificaciones, usuario_actual.matricula, llave_privada_texto)
+    await crud_async.actualizar_calificaciones(db, matricula_estudiante, calificaciones, usuario_actual.matricula)
 
     return RedirectResponse(url="/jefe/dashboard", status_code=303)
 
 @ruta.post("/dashboard/descargarDocumento/{id_doc}")
 async def descargar_documento(
     id_doc: int,
-    llave_simetrica: UploadFile = File(...),
-    db: Session = Depends(obtener_bd),
+    request: Request,
+    llave_simetrica: UploadFile = File(None),
+    llave_privada: UploadFile = File(None),
+    db: AsyncSession = Depends(obtener_bd_async),
     usuario_actual: Usuario = Depends(obtener_usuario_actual)
 ):
-    documentos = db.query(Documento).all()
-    print(">>> Documentos existentes en la base de datos:")
-    for d in documentos:
-        print(f"ID: {d.id}, nombre: {d.nombre_archivo}, estudiante: {d.id_estudiante}")
-    
-    doc = db.query(Documento).filter_by(id=id_doc).first()
-    if not doc:
-        raise HTTPException(404, "Documento no encontrado")    
-    datos = base64.b64decode(doc.datos)
-    nonce = datos[:12]
-    tag = datos[12:28]
-    ciphertext = datos[28:]
-    llave_bytes = await llave_simetrica.read()
+    doc = await obtener_documento_autorizado(db, id_doc, usuario_actual)
+    # Con la llave privada el titular descarga sin conocer la llave simétrica de la versión
+    llave = decodificar_llave(await llave_simetrica.read()) if llave_simetrica else None
+    llave_privada_pem = (await llave_privada.read()).decode("utf-8", "replace") if llave_privada else None
+    return await respuesta_documento(request, db, doc, usuario_actual, llave, llave_privada_pem)
+
+@ruta.post("/dashboard/subirDocumento", response_class=HTMLResponse)
+async def subir_documento(matricula: str = Form(...),
+                          tipo: str = Form("expediente", min_length=1, max_length=30),
+                          documento: UploadFile = File(...),
+                          llave_simetrica: UploadFile = File(...),
+                          db: AsyncSession = Depends(obtener_bd_async),
+                          usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    if usuario_actual.rol != "jefe":
+        raise HTTPException(status_code=403, detail="Solo la administración puede subir documentos")
+    estudiante = await crud_async.obtener_usuario(db, matricula)
+    if estudiante is None or estudiante.rol != "estudiante":
+        raise HTTPException(status_code=404, detail="Estudiante no encontrado")
+
+    llave = decodificar_llave(await llave_simetrica.read())
+    version = await crud_async.version_para_subir(db, llave)
+    bloques = iter(lambda: documento.file.read(TAMANO_SEGMENTO), b"")
+    await crud_async.crear_documento(db, id_estudiante=estudiante.id, nombre_archivo=documento.filename,
+                                     bloques=bloques, llave=llave, version_llave=version.id, tipo=tipo,
+                                     id_subido_por=usuario_actual.id)
+    return RedirectResponse(url="/jefe/dashboard", status_code=303)
+
+@ruta.get("/documentos", response_model=PaginaDocumentos)
+def listar_documentos_json(matricula: Optional[str] = None,
+                           tipo: Optional[str] = None,
+                           despues_de: Optional[int] = None,
+                           limite: int = Query(TAMANO_PAGINA, ge=1, le=200),
+                           db: Session = Depends(obtener_bd),
+                           usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    if usuario_actual.rol != "jefe":
+        raise HTTPException(status_code=403, detail="Acceso no autorizado")
+    documentos, siguiente = listar_documentos(db, matricula=matricula, tipo=tipo, despues_de=despues_de, limite=limite)
+    return PaginaDocumentos(documentos=[DocumentoResumen.desde_modelo(d) for d in documentos], siguiente=siguiente)
+
+@ruta.post("/documentos/exportar")
+async def exportar_documentos(llave_simetrica: UploadFile = File(...),
+                              semestre: Optional[str] = Form(None),
+                              matriculas: Optional[str] = Form(None),
+                              db: Session = Depends(obtener_bd),
+                              usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    """ZIP con los documentos descifrados y las calificaciones; `matriculas` separadas por comas, sin filtros exporta todo."""
+    if usuario_actual.rol != "jefe":
+        raise HTTPException(status_code=403, detail="Solo la administración puede exportar expedientes")
+    llave = decodificar_llave(await llave_simetrica.read())
+    lista = [m.strip() for m in (matriculas or "").split(",") if m.strip()]
     try:
-        llave = base64.b64decode(llave_bytes)
-    except Exception:
-        llave = llave_bytes
-    pdf = descifrar_chacha20_poly1305(nonce, ciphertext, tag, llave)
-    print("→ Datos descifrados:", pdf[:10])
+        partes = await run_in_threadpool(preparar_exportacion, db, llave, semestre or None, lista)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    # StreamingResponse recorre el generador en el pool de hilos: el bucle de eventos no descifra
+    return StreamingResponse(partes, media_type="application/zip",
+                             headers={"Content-Disposition": "attachment; filename=expedientes.zip"})
+
+@ruta.get("/estadisticas")
+def estadisticas_calificaciones(semestre: Optional[str] = None, db: Session = Depends(obtener_bd),
+                                usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    if usuario_actual.rol != "jefe":
+        raise HTTPException(status_code=403, detail="Acceso no autorizado")
+    return {"semestre": semestre, "materias": resumen_materias(db, semestre)}
 
-    return StreamingResponse(io.BytesIO(pdf), media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename={doc.nombre_archivo}"})
+@ruta.get("/estadisticas/reporte")
+def reporte_calificaciones(semestre: Optional[str] = None, materia: List[str] = Query([]),
+                           db: Session = Depends(obtener_bd),
+                           usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    if usuario_actual.rol != "jefe":
+        raise HTTPException(status_code=403, detail="Acceso no autorizado")
+    return {"semestre": semestre, "materias": reporte(db, semestre, materia)}
 
+@ruta.post("/calificaciones", response_model=ResultadoCalificaciones)
+def cargar_calificaciones(lote: LoteCalificaciones, db: Session = Depends(obtener_bd),
+                          usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    if usuario_actual.rol != "jefe":
+        raise HTTPException(status_code=403, detail="Solo la administración puede editar calificaciones")
+    registros = [c.model_dump() for c in lote.calificaciones]
+    return actualizar_calificaciones_lote(db, registros, usuario_actual)
+
+@ruta.post("/calificaciones/csv", response_model=ResultadoCalificaciones)
+def cargar_calificaciones_csv(archivo: UploadFile = File(...), db: Session = Depends(obtener_bd),
+                              usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    if usuario_actual.rol != "jefe":
+        raise HTTPException(status_code=403, detail="Solo la administración puede editar calificaciones")
+    try:
+        registros, errores = leer_calificaciones_csv(archivo.file)
+    except (ValueError, UnicodeDecodeError) as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    resultado = actualizar_calificaciones_lote(db, registros, usuario_actual)
+    resultado["errores"] = errores + resultado["errores"]
+    return resultado
+
+@ruta.get("/llaves", response_model=List[VersionLlave])
+def listar_versiones_llave(db: Session = Depends(obtener_bd), usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    if usuario_actual.rol != "jefe":
+        raise HTTPException(status_code=403, detail="Acceso no autorizado")
+    return listar_versiones(db)
+
+async def _leer_llaves(llave_actual: UploadFile, llave_nueva: UploadFile):
+    llaves = decodificar_llave(await llave_actual.read()), decodificar_llave(await llave_nueva.read())
+    if any(len(llave) != 32 for llave in llaves):
+        raise HTTPException(status_code=400, detail="Las llaves simétricas deben ser de 32 bytes")
+    return llaves
+
+@ruta.post("/llaves/recifrar", response_model=EstadoRecifrado)
+async def recifrar_documentos(llave_actual: UploadFile = File(...),
+                              llave_nueva: UploadFile = File(...),
+                              db: Session = Depends(obtener_bd),
+                              usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    if usuario_actual.rol != "jefe":
+        raise HTTPException(status_code=403, detail="Solo la administración puede rotar la llave")
+    llaves = await _leer_llaves(llave_actual, llave_nueva)
+    try:
+        recifrado = await run_in_threadpool(iniciar_recifrado, db, usuario_actual, *llaves)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    return EstadoRecifrado.desde_modelo(recifrado)
+
+def _recifrado_o_404(db: Session, id_recifrado: int, usuario_actual: Usuario):
+    if usuario_actual.rol != "jefe":
+        raise HTTPException(status_code=403, detail="Acceso no autorizado")
+    recifrado = obtener_recifrado(db, id_recifrado)
+    if not recifrado:
+        raise HTTPException(status_code=404, detail="Recifrado no encontrado")
+    return recifrado
+
+@ruta.get("/llaves/recifrados/{id_recifrado}", response_model=EstadoRecifrado)
+def estado_recifrado(id_recifrado: int, db: Session = Depends(obtener_bd),
+                     usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    return EstadoRecifrado.desde_modelo(_recifrado_o_404(db, id_recifrado, usuario_actual))
+
+@ruta.post("/llaves/recifrados/{id_recifrado}/pausar", response_model=EstadoRecifrado)
+def pausar_recifrado_documentos(id_recifrado: int, db: Session = Depends(obtener_bd),
+                                usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    try:
+        recifrado = pausar_recifrado(db, _recifrado_o_404(db, id_recifrado, usuario_actual))
+    except ValueError as error:
+        raise HTTPException(status_code=409, detail=str(error))
+    return EstadoRecifrado.desde_modelo(recifrado)
+
+@ruta.post("/llaves/recifrados/{id_recifrado}/reanudar", response_model=EstadoRecifrado)
+async def reanudar_recifrado_documentos(id_recifrado: int,
+                                        llave_actual: UploadFile = File(...),
+                                        llave_nueva: UploadFile = File(...),
+                                        db: Session = Depends(obtener_bd),
+                                        usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    recifrado = await run_in_threadpool(_recifrado_o_404, db, id_recifrado, usuario_actual)
+    llaves = await _leer_llaves(llave_actual, llave_nueva)
+    try:
+        recifrado = await run_in_threadpool(reanudar_recifrado, db, recifrado, *llaves)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    return EstadoRecifrado.desde_modelo(recifrado)
+
+def _titular_o_404(db: Session, matricula: str, usuario_actual: Usuario) -> Usuario:
+    if usuario_actual.rol != "jefe":
+        raise HTTPException(status_code=403, detail="Solo la administración puede administrar accesos")
+    titular = obtener_usuario(db, matricula)
+    if titular is None or titular.rol not in ("jefe", "staff"):
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    return titular
+
+@ruta.post("/accesos/{matricula}", response_model=AccesosConcedidos)
+async def conceder_accesos_documentos(matricula: str,
+                                      llave_simetrica: UploadFile = File(...),
+                                      db: Session = Depends(obtener_bd),
+                                      usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    # Solo se envuelven llaves de 32 bytes con RSA: ningún documento se vuelve a cifrar
+    titular = await run_in_threadpool(_titular_o_404, db, matricula, usuario_actual)
+    llave = decodificar_llave(await llave_simetrica.read())
+    try:
+        return await run_in_threadpool(conceder_accesos, db, titular, llave)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+@ruta.delete("/accesos/{matricula}")
+def revocar_accesos_documentos(matricula: str, db: Session = Depends(obtener_bd),
+                               usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    return {"revocados": revocar_accesos(db, _titular_o_404(db, matricula, usuario_actual))}
+
+@ruta.get("/estado")
+def estado_servidor(usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    if usuario_actual.rol != "jefe":
+        raise HTTPException(status_code=403, detail="Acceso no autorizado")
+    return {
+        "bucle": monitor_bucle.metricas(),
+        "bd": estadisticas_bd(),
+        "hash": servicio_hash.metricas(),
+        "cache_usuarios": cache_usuarios.metricas(),
+        "correos_pendientes": despachador.pendientes(),
+    }
@@ -1,35 +1,66 @@
 import base64
-from fastapi import APIRouter, Depends, File, HTTPException, Request, Form, UploadFile
+from fastapi import APIRouter, Depends, Query, File, HTTPException, Request, Form, UploadFile
 from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
-from fastapi.templating import Jinja2Templates
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-import string, random
-from app.cifrado import cifrar_chacha20_poly1305, descifrar_clave
-from app.crud import crear_usuario, eliminar_usuario, crear_estudiante, actualizar_calificaciones
-from app.auth import obtener_usuario_actual, enviar_correo, ph
-from app.basedatos import SesionLocal
-from app.modelos import Documento, Usuario, Historial_Academico
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
+from app.cifrado import decodificar_llave, TAMANO_SEGMENTO
+from app.llaves import descifrar_clave
+from app.documentos import obtener_documento_autorizado, respuesta_documento
+from app.crud import eliminar_usuario, actualizar_calificaciones_lote, listar_estudiantes, listar_documentos, listar_versiones_estudiantes, contextos_estudiantes
+from app import crud_async
+from app.auth import obtener_usuario_actual, servicio_hash, generar_contraseña_provisional
+from app.correo import encolar_correo, cuerpo_registro_estudiante, despachador
+from app.basedatos import obtener_bd, obtener_bd_async
+from app.modelos import Usuario
+from app.schemas import EstudianteResumen, PaginaEstudiantes, DocumentoResumen, PaginaDocumentos, EstadoImportacion, LoteCalificaciones, ResultadoCalificaciones
+from app.importacion import iniciar_importacion, obtener_importacion, leer_calificaciones_csv
+from app.plantillas import plantilla_transmitida, fragmentos, huella_plantillas
+from app import versiones
+from app.eventos import ultimo_evento, respuesta_eventos
 
 router = APIRouter()
-templates = Jinja2Templates(directory="templates")
-
-def obtener_bd():
-    db = SesionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+TAMANO_PAGINA = 50
 
 @router.get("/dashboard", response_class=HTMLResponse)
 def staff_dashboard(request: Request, db: Session = Depends(obtener_bd), usuario_actual: Usuario = Depends(obtener_usuario_actual)):
     if usuario_actual.rol != "staff":
         raise HTTPException(status_code=403, detail="Acceso no autorizado")
-    estudiantes = db.query(Usuario).filter(Usuario.rol == "estudiante").all()
-    historiales = {}
-    for estudiante in estudiantes:
-        historial = db.query(Historial_Academico).filter_by(id_estudiante=estudiante.id).all()
-        historiales[estudiante.matricula] = historial
-    return templates.TemplateResponse("staff_dashboard.html", {"request": request, "usuario": usuario_actual, "estudiantes": estudiantes, "historiales":historiales})
+    etag = versiones.etiqueta(huella_plantillas(), "staff", usuario_actual.id, usuario_actual.nombre,
+                              versiones.leer(db)["estudiantes"])
+    respuesta = versiones.no_modificado(request, etag)
+    if respuesta is not None:
+        return respuesta
+    desde = ultimo_evento(db)
+    versiones_estudiantes, siguiente = listar_versiones_estudiantes(db, limite=TAMANO_PAGINA)
+    filas = fragmentos("fila_estudiante.html", versiones_estudiantes, lambda ids: contextos_estudiantes(db, ids))
+    return plantilla_transmitida(request, "staff_dashboard.html", {"usuario": usuario_actual, "fragmentos": filas.values(), "siguiente": siguiente, "ultimo_evento": desde},
+                                 headers=versiones.encabezados(etag))
+
+@router.get("/eventos")
+async def eventos_tablero(request: Request, desde: Optional[int] = None,
+                          usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    if usuario_actual.rol != "staff":
+        raise HTTPException(status_code=403, detail="Acceso no autorizado")
+    return respuesta_eventos(request, {"estudiante"}, desde)
+
+@router.get("/estudiantes", response_model=PaginaEstudiantes)
+def listar_estudiantes_json(despues_de: Optional[int] = None,
+                            limite: int = Query(TAMANO_PAGINA, ge=1, le=200),
+                            nombre: Optional[str] = None,
+                            matricula: Optional[str] = None,
+                            semestre: Optional[str] = None,
+                            calificacion_min: Optional[str] = None,
+                            calificacion_max: Optional[str] = None,
+                            db: Session = Depends(obtener_bd),
+                            usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    if usuario_actual.rol != "staff":
+        raise HTTPException(status_code=403, detail="Acceso no autorizado")
+    estudiantes, siguiente = listar_estudiantes(db, despues_de=despues_de, limite=limite, nombre=nombre,
+                                                matricula=matricula, semestre=semestre,
+                                                calificacion_min=calificacion_min, calificacion_max=calificacion_max)
+    return PaginaEstudiantes(estudiantes=[EstudianteResumen.desde_usuario(e) for e in estudiantes], siguiente=siguiente)
 
 @router.post("/dashboard/registrarEstudiante", response_class=HTMLResponse)
 async def registrar_estudiante(nombre: str = Form(...),
@@ -38,50 +69,56 @@ async def registrar_estudiante(nombre: str = Form(...),
                          telefono: str = Form(...),
                          documento: UploadFile = File(...),
                          llave_simetrica: UploadFile = File(...),
-                         db: Session = Depends(obtener_bd),
+                         db: AsyncSession = Depends(obtener_bd_async),
                          usuario_actual: Usuario = Depends(obtener_usuario_actual)):
     
     if usuario_actual.rol != "staff":
         raise HTTPException(status_code=403, detail="Solo la administración puede registrar estudiantes")
     
-    longitud = 10
-    caracteres = string.ascii_letters + string.digits
-    contraseña_provisional = ''.join(random.choice(caracteres) for _ in range(longitud))
-    contraseña_hash = ph.hash(contraseña_provisional)
-    nuevo_estudiante = crear_usuario(db, nombre=nombre, correo=correo, rol="estudiante", contraseña=contraseña_hash, matricula=matricula)
-
-    crear_estudiante(db, matricula=nuevo_estudiante.id, telefono=telefono) 
-    enlace_cambio = f"http://localhost:8000/auth/establecer-contraseña?matricula={matricula}"
-    cuerpo = (
-        f"Hola {nombre},\n\n"
-        f"Has sido registrado como estudiante.\n"
-        f"Tu matrícula es: {matricula}\n"
-        f"Tu contraseña provisional es: {contraseña_provisional}\n"
-        f"Inicia sesión y cambia tu contraseña en: {enlace_cambio}\n\n"
-    )
-    enviar_correo(destinatario=correo, asunto="Registro de Estudiante", cuerpo=cuerpo)
-
-    # Leer archivos
-    pdf_bytes = await documento.read()
-    llave_bytes = await llave_simetrica.read()
-    try:
-        llave = base64.b64decode(llave_bytes)
-    except Exception:
-        llave = llave_bytes
-    nonce, pdf_cifrado, tag = cifrar_chacha20_poly1305(pdf_bytes, llave)
-    datos_guardar = base64.b64encode(nonce + tag + pdf_cifrado).decode("utf-8")
-
-    doc = Documento(
-        id_estudiante=nuevo_estudiante.id,
-        nombre_archivo=documento.filename,
-        datos=datos_guardar
-    )
-    db.add(doc)
-    db.commit()
-    db.refresh(doc)
+    # La versión de la llave se resuelve antes de crear al usuario: una llave retirada no deja registros a medias
+    llave = decodificar_llave(await llave_simetrica.read())
+    version = await crud_async.version_para_subir(db, llave)
+
+    contraseña_provisional = generar_contraseña_provisional()
+    contraseña_hash = await servicio_hash.hash(contraseña_provisional)
+    nuevo_estudiante = await crud_async.crear_usuario(db, nombre=nombre, correo=correo, rol="estudiante", contraseña=contraseña_hash, matricula=matricula)
+
+    await crud_async.crear_estudiante(db, matricula=nuevo_estudiante.id, telefono=telefono) 
+    cuerpo = cuerpo_registro_estudiante(nombre, matricula, contraseña_provisional)
+    encolar_correo(db, destinatario=correo, asunto="Registro de Estudiante", cuerpo=cuerpo, confirmar=False)
+    await db.commit()
+    despachador.avisar()
+
+    # El documento se cifra por segmentos mientras se lee del archivo temporal, en el pool de hilos
+    bloques = iter(lambda: documento.file.read(TAMANO_SEGMENTO), b"")
+    await crud_async.crear_documento(db, id_estudiante=nuevo_estudiante.id, nombre_archivo=documento.filename,
+                                     bloques=bloques, llave=llave, version_llave=version.id, id_subido_por=usuario_actual.id)
     
     return RedirectResponse(url="/staff/dashboard", status_code=303)
 
+@router.post("/dashboard/importarEstudiantes", response_model=EstadoImportacion)
+async def importar_estudiantes(lista: UploadFile = File(...),
+                               documentos: UploadFile = File(...),
+                               llave_simetrica: UploadFile = File(...),
+                               db: Session = Depends(obtener_bd),
+                               usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    if usuario_actual.rol not in ["staff", "jefe"]:
+        raise HTTPException(status_code=403, detail="Solo la administración puede registrar estudiantes")
+    llave = decodificar_llave(await llave_simetrica.read())
+    # Copia los archivos subidos a disco: fuera del loop
+    importacion = await run_in_threadpool(iniciar_importacion, db, usuario_actual, lista.file, documentos.file, llave)
+    return EstadoImportacion.desde_modelo(importacion)
+
+@router.get("/importaciones/{id_importacion}", response_model=EstadoImportacion)
+def estado_importacion(id_importacion: int, db: Session = Depends(obtener_bd),
+                       usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    if usuario_actual.rol not in ["staff", "jefe"]:
+        raise HTTPException(status_code=403, detail="Acceso no autorizado")
+    importacion = obtener_importacion(db, id_importacion)
+    if not importacion:
+        raise HTTPException(status_code=404, detail="Importación no encontrada")
+    return EstadoImportacion.desde_modelo(importacion)
+
 @router.post("/dashboard/eliminarEstudiante", response_class=HTMLResponse)
 def eliminar_estudiante(matricula: str = Form(...), db: Session = Depends(obtener_bd),
                         usuario_actual: Usuario = Depends(obtener_usuario_actual)):
@@ -111,7 +148,7 @@ async def descifrar_clave_staff(
         llave_privada_pem = (await llave_privada.read()).decode()
 
         # Intentar descifrado
-        clave_simetrica = descifrar_clave(clave_cifrada_bytes, llave_privada_pem)
+        clave_simetrica = await run_in_threadpool(descifrar_clave, clave_cifrada_bytes, llave_privada_pem)
 
     except Exception as e:
         raise HTTPException(400, detail="No se pudo descifrar la clave: clave privada incorrecta o archivo dañado")
@@ -126,6 +163,54 @@ async def descifrar_clave_staff(
     headers = {"Content-Disposition": "attachment; filename=clave_simetrica.txt"}
     return StreamingResponse(file_content, media_type="text/plain", headers=headers)
 
+@router.post("/dashboard/descargarDocumento/{id_doc}")
+async def descargar_documento_staff(
+    id_doc: int,
+    request: Request,
+    llave_simetrica: UploadFile = File(None),
+    llave_privada: UploadFile = File(None),
+    db: AsyncSession = Depends(obtener_bd_async),
+    usuario_actual: Usuario = Depends(obtener_usuario_actual)
+):
+    doc = await obtener_documento_autorizado(db, id_doc, usuario_actual)
+    # Con la llave privada el titular descarga sin conocer la llave simétrica de la versión
+    llave = decodificar_llave(await llave_simetrica.read()) if llave_simetrica else None
+    llave_privada_pem = (await llave_privada.read()).decode("utf-8", "replace") if llave_privada else None
+    return await respuesta_documento(request, db, doc, usuario_actual, llave, llave_privada_pem)
+
+@router.post("/dashboard/subirDocumento", response_class=HTMLResponse)
+async def subir_documento_staff(matricula: str = Form(...),
+                          tipo: str = Form("expediente", min_length=1, max_length=30),
+                          documento: UploadFile = File(...),
+                          llave_simetrica: UploadFile = File(...),
+                          db: AsyncSession = Depends(obtener_bd_async),
+                          usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    if usuario_actual.rol != "staff":
+        raise HTTPException(status_code=403, detail="Solo el staff puede subir documentos")
+    estudiante = await crud_async.obtener_usuario(db, matricula)
+    if estudiante is None or estudiante.rol != "estudiante":
+        raise HTTPException(status_code=404, detail="Estudiante no encontrado")
+
+    llave = decodificar_llave(await llave_simetrica.read())
+    version = await crud_async.version_para_subir(db, llave)
+    bloques = iter(lambda: documento.file.read(TAMANO_SEGMENTO), b"")
+    await crud_async.crear_documento(db, id_estudiante=estudiante.id, nombre_archivo=documento.filename,
+                                     bloques=bloques, llave=llave, version_llave=version.id, tipo=tipo,
+                                     id_subido_por=usuario_actual.id)
+    return RedirectResponse(url="/staff/dashboard", status_code=303)
+
+@router.get("/documentos", response_model=PaginaDocumentos)
+def listar_documentos_json_staff(matricula: Optional[str] = None,
+                           tipo: Optional[str] = None,
+                           despues_de: Optional[int] = None,
+                           limite: int = Query(TAMANO_PAGINA, ge=1, le=200),
+                           db: Session = Depends(obtener_bd),
+                           usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    if usuario_actual.rol != "staff":
+        raise HTTPException(status_code=403, detail="Acceso no autorizado")
+    documentos, siguiente = listar_documentos(db, matricula=matricula, tipo=tipo, despues_de=despues_de, limite=limite)
+    return PaginaDocumentos(documentos=[DocumentoResumen.desde_modelo(d) for d in documentos], siguiente=siguiente)
+
 @router.post("/dashboard/editarCalificaciones", response_class=HTMLResponse)
 async def editar_calificaciones_staff(
     matricula_estudiante: str = Form(...),
@@ -135,13 +220,12 @@ async def editar_calificaciones_staff(
     sistemas_en_chip: str = Form(...),
     sistemas_distribuidos: str = Form(...),
     llave_privada: UploadFile = File(...),
-    db: Session = Depends(obtener_bd),
+    db: AsyncSession = Depends(obtener_bd_async),
     usuario_actual = Depends(obtener_usuario_actual)
 ):
     # Permitir tanto staff como jefe
     if usuario_actual.rol not in ["staff", "jefe"]:
         return HTMLResponse("No autorizado", status_code=403)
-    llave_privada_texto = (await llave_privada.read()).decode()
     calificaciones = {
         "Ingeniería de Software": ingenieria_de_software,
         "Compiladores": compiladores,
@@ -149,5 +233,26 @@ async def editar_calificaciones_staff(
         "Sistemas en Chip": sistemas_en_chip,
         "Sistemas Distribuidos": sistemas_distribuidos
     }
-    actualizar_calificaciones(db, matricula_estudiante, calificaciones, usuario_actual.matricula, llave_privada_texto)
+    await crud_async.actualizar_calificaciones(db, matricula_estudiante, calificaciones, usuario_actual.matricula)
     return RedirectResponse(url="/staff/dashboard", status_code=303)
+
+@router.post("/calificaciones", response_model=ResultadoCalificaciones)
+def cargar_calificaciones(lote: LoteCalificaciones, db: Session = Depends(obtener_bd),
+                          usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    if usuario_actual.rol not in ["staff", "jefe"]:
+        raise HTTPException(status_code=403, detail="Solo la administración puede editar calificaciones")
+    registros = [c.model_dump() for c in lote.calificaciones]
+    return actualizar_calificaciones_lote(db, registros, usuario_actual)
+
+@router.post("/calificaciones/csv", response_model=ResultadoCalificaciones)
+def cargar_calificaciones_csv(archivo: UploadFile = File(...), db: Session = Depends(obtener_bd),
+                              usuario_actual: Usuario = Depends(obtener_usuario_actual)):
+    if usuario_actual.rol not in ["staff", "jefe"]:
+        raise HTTPException(status_code=403, detail="Solo la administración puede editar calificaciones")
+    try:
+        registros, errores = leer_calificaciones_csv(archivo.file)
+    except (ValueError, UnicodeDecodeError) as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    resultado = actualizar_calificaciones_lote(db, registros, usuario_actual)
+    resultado["errores"] = errores + resultado["errores"]
+    return resultado
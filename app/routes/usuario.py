@@ -1,40 +1,33 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request, Form, Header
 from fastapi.responses import HTMLResponse, Response, RedirectResponse
-from fastapi.templating import Jinja2Templates
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from jose import jwt, JWTError
 from datetime import datetime, timedelta, timezone
 import os
 from dotenv import load_dotenv
-from app.basedatos import SesionLocal
+from app.basedatos import obtener_bd, obtener_bd_async
 from app.schemas import GenerarToken, CambioContraseña, ValidarContraseña
-from app.crud import obtener_usuario, actualizar_contraseña
-from app.auth import ph, llave, obtener_usuario_actual
+from app.crud import actualizar_clave_publica
+from app import crud_async
+from app.auth import servicio_hash, llave, obtener_usuario_actual, verificar_usuario
 from app.modelos import Usuario
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.primitives import serialization
+from app.llaves import generar_par_rsa
+from app.plantillas import templates
 
 load_dotenv()
 llave = os.getenv("Clave_Secreta")
 ruta = APIRouter()
-templates = Jinja2Templates(directory="templates")
-
-def obtener_bd():
-    db = SesionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
 
 @ruta.get("/login", response_class=HTMLResponse)
 def mostrar_login(request: Request):
     return templates.TemplateResponse("login.html", {"request": request})
 
 @ruta.post("/login", response_class=HTMLResponse)
-def procesar_login_web(request: Request, username: str = Form(...), password: str = Form(...), db: Session = Depends(obtener_bd)):
-    usuario = obtener_usuario(db, username)
-    if not usuario or not ph.verify(usuario.contraseña, password):
+async def procesar_login_web(request: Request, username: str = Form(...), password: str = Form(...), db: AsyncSession = Depends(obtener_bd_async)):
+    usuario = await verificar_usuario(db, username, password)
+    if not usuario:
         return templates.TemplateResponse("login.html", {"request": request, "error": "Credenciales inválidas"})
     
     datos_token = {"sub": usuario.matricula, "rol": usuario.rol}
@@ -57,11 +50,11 @@ def procesar_login_web(request: Request, username: str = Form(...), password: st
     return templates.TemplateResponse("bienvenida.html", {"request": request, "usuario": usuario})
 
 @ruta.post("/establecer-contraseña")
-def establecer_contraseña(
+async def establecer_contraseña(
     nueva_contrasena: str = Form(...),
     provisional: str = Form(...),
     token: str = Form(...),
-    db: Session = Depends(obtener_bd)
+    db: AsyncSession = Depends(obtener_bd_async)
 ):
     try:
         payload = jwt.decode(token, llave, algorithms=["HS256"])
@@ -72,21 +65,18 @@ def establecer_contraseña(
     except JWTError:
         raise HTTPException(status_code=401, detail="Token inválido o expirado")
 
-    usuario = db.query(Usuario).filter(Usuario.matricula == matricula).first()
+    usuario = await crud_async.obtener_usuario(db, matricula)
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
     if not usuario.primer_login:
         raise HTTPException(status_code=403, detail="No autorizado para cambiar contraseña")
 
-    try:
-        if not ph.verify(usuario.contraseña, provisional):
-            raise HTTPException(status_code=401, detail="Contraseña provisional incorrecta")
-    except:
+    if not await servicio_hash.verificar(usuario.contraseña, provisional):
         raise HTTPException(status_code=401, detail="Contraseña provisional incorrecta")
 
-    contraseña_hash = ph.hash(nueva_contrasena)
-    actualizar_contraseña(db, usuario.matricula, contraseña_hash)
+    contraseña_hash = await servicio_hash.hash(nueva_contrasena)
+    await crud_async.actualizar_contraseña(db, usuario.matricula, contraseña_hash)
 
     return RedirectResponse(url="/auth/login", status_code=303)
 
@@ -95,14 +85,9 @@ def generar_claves(db: Session = Depends(obtener_bd), usuario_actual: Usuario =
     if usuario_actual.rol not in ["jefe", "staff"]:
         raise HTTPException(status_code=403, detail="Solo jefes y staff pueden generar claves")
 
-    llave_privada = rsa.generate_private_key(public_exponent=65537, key_size=2048)
-    privada_pem = llave_privada.private_bytes(encoding=serialization.Encoding.PEM, format=serialization.PrivateFormat.PKCS8, encryption_algorithm=serialization.NoEncryption())
-    publica_pem = llave_privada.public_key().public_bytes(encoding=serialization.Encoding.PEM, format=serialization.PublicFormat.SubjectPublicKeyInfo)
+    privada_pem, publica_pem = generar_par_rsa()
 
-    usuario_actual = db.merge(usuario_actual)
-    usuario_actual.clave_publica = publica_pem.decode("utf-8")
-    db.commit()
-    db.refresh(usuario_actual)
+    actualizar_clave_publica(db, usuario_actual.id, publica_pem.decode("utf-8"))
 
     return Response(
         content=privada_pem,
@@ -1,5 +1,7 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import Annotated
+from typing import Annotated, List, Optional
+from datetime import datetime
+import json
 
 class CrearUsuario(BaseModel):
     nombre: Annotated[str, Field(min_length=3)]
@@ -30,4 +32,154 @@ class DatosAlumno(BaseModel):
 
 class Documento(BaseModel):
     nombre_archivo: str
-    datos: str
\ No newline at end of file
+    datos: str
+
+class DocumentoResumen(BaseModel):
+    id: int
+    id_estudiante: Optional[int] = None
+    tipo: Optional[str] = None
+    nombre_archivo: Optional[str] = None
+    tamano: Optional[int] = None
+    subido: Optional[datetime] = None
+    hash_contenido: Optional[str] = None
+    id_subido_por: Optional[int] = None
+    version_llave: Optional[int] = None
+
+    @classmethod
+    def desde_modelo(cls, documento):
+        return cls(
+            id=documento.id,
+            id_estudiante=documento.id_estudiante,
+            tipo=documento.tipo,
+            nombre_archivo=documento.nombre_archivo,
+            tamano=documento.tamano,
+            subido=documento.subido,
+            hash_contenido=documento.hash_contenido,
+            id_subido_por=documento.id_subido_por,
+            version_llave=documento.version_llave,
+        )
+
+class CalificacionResumen(BaseModel):
+    materia: Optional[str] = None
+    semestre: Optional[str] = None
+    calificacion: Optional[str] = None
+
+class EstudianteResumen(BaseModel):
+    id: int
+    nombre: str
+    correo: str
+    matricula: str
+    telefono: Optional[int] = None
+    documentos: List[DocumentoResumen] = []
+    calificaciones: List[CalificacionResumen] = []
+
+    @classmethod
+    def desde_usuario(cls, usuario):
+        estudiante = usuario.estudiante
+        return cls(
+            id=usuario.id,
+            nombre=usuario.nombre,
+            correo=usuario.correo,
+            matricula=usuario.matricula,
+            telefono=estudiante.telefono if estudiante else None,
+            documentos=[DocumentoResumen.desde_modelo(d) for d in (estudiante.documentos if estudiante else [])],
+            calificaciones=[CalificacionResumen(materia=h.materia, semestre=h.semestre, calificacion=h.calificacion) for h in (estudiante.historial if estudiante else [])],
+        )
+
+class PaginaEstudiantes(BaseModel):
+    estudiantes: List[EstudianteResumen]
+    siguiente: Optional[int] = None
+
+class PaginaDocumentos(BaseModel):
+    documentos: List[DocumentoResumen]
+    siguiente: Optional[int] = None
+
+class ErrorFila(BaseModel):
+    fila: Optional[int] = None
+    matricula: Optional[str] = None
+    error: str
+
+class EstadoImportacion(BaseModel):
+    id: int
+    estado: str
+    total: int = 0
+    procesados: int = 0
+    exitosos: int = 0
+    errores: List[ErrorFila] = []
+    creado: Optional[datetime] = None
+    terminado: Optional[datetime] = None
+
+    @classmethod
+    def desde_modelo(cls, importacion):
+        return cls(
+            id=importacion.id,
+            estado=importacion.estado,
+            total=importacion.total or 0,
+            procesados=importacion.procesados or 0,
+            exitosos=importacion.exitosos or 0,
+            errores=json.loads(importacion.errores or "[]"),
+            creado=importacion.creado,
+            terminado=importacion.terminado,
+        )
+
+class VersionLlave(BaseModel):
+    id: int
+    estado: str
+    creada: Optional[datetime] = None
+    retirada: Optional[datetime] = None
+    # False en la versión heredada mientras nadie presente su llave
+    identificada: bool
+    documentos: int = 0
+
+class ErrorDocumento(BaseModel):
+    id_documento: Optional[int] = None
+    error: str
+
+class EstadoRecifrado(BaseModel):
+    id: int
+    estado: str
+    version_origen: int
+    version_destino: int
+    total: int = 0
+    procesados: int = 0
+    fallidos: int = 0
+    ultimo_id: int = 0
+    errores: List[ErrorDocumento] = []
+    creado: Optional[datetime] = None
+    actualizado: Optional[datetime] = None
+    terminado: Optional[datetime] = None
+
+    @classmethod
+    def desde_modelo(cls, recifrado):
+        return cls(
+            id=recifrado.id,
+            estado=recifrado.estado,
+            version_origen=recifrado.version_origen,
+            version_destino=recifrado.version_destino,
+            total=recifrado.total or 0,
+            procesados=recifrado.procesados or 0,
+            fallidos=recifrado.fallidos or 0,
+            ultimo_id=recifrado.ultimo_id or 0,
+            errores=json.loads(recifrado.errores or "[]"),
+            creado=recifrado.creado,
+            actualizado=recifrado.actualizado,
+            terminado=recifrado.terminado,
+        )
+
+class AccesosConcedidos(BaseModel):
+    version: int
+    concedidos: int
+    sin_sobre: int
+
+class CalificacionEntrada(BaseModel):
+    matricula: Annotated[str, Field(min_length=1, max_length=10)]
+    materia: Annotated[str, Field(min_length=1, max_length=30)]
+    semestre: Annotated[str, Field(max_length=10)] = ""
+    calificacion: Annotated[str, Field(min_length=1, max_length=5)]
+
+class LoteCalificaciones(BaseModel):
+    calificaciones: List[CalificacionEntrada]
+
+class ResultadoCalificaciones(BaseModel):
+    actualizadas: int
+    errores: List[ErrorFila] = []
@@ -0,0 +1,74 @@
+import hashlib
+from datetime import datetime, timezone
+from fastapi import Request, Response
+from sqlalchemy import insert, text, update
+from sqlalchemy.orm import Session
+from app.modelos import Contador_Version, Estudiante, Evento_Cambio
+
+# Versiones de los datos que muestran los tableros. Cada escritura incrementa, en su misma transacción,
+# el contador del conjunto que cambió y la versión de los estudiantes afectados. Con eso una vista
+# repetida se responde con 304 tras leer una tabla de tres filas. Como viven en la base, valen para todos los workers.
+# Los mismos cambios quedan en eventos_cambios, de donde app.eventos los envía a los tableros abiertos.
+CONTADORES = ("staff", "estudiantes", "calificaciones")
+# Candado de transacción de PostgreSQL que ordena las inserciones en eventos_cambios (ver incrementar)
+CANDADO_EVENTOS = 7215001
+
+def incrementar(db: Session, *contadores: str, estudiantes=()):
+    """Marca como cambiados los contadores y los estudiantes dados y registra sus eventos; no confirma la transacción."""
+    estudiantes = list(estudiantes)
+    ahora = datetime.now(timezone.utc).replace(tzinfo=None)
+    eventos = [{"tipo": "estudiante", "id_usuario": id_estudiante, "creado": ahora} for id_estudiante in estudiantes]
+    if "staff" in contadores:
+        eventos.append({"tipo": "staff", "id_usuario": None, "creado": ahora})
+    if eventos:
+        if db.get_bind().dialect.name == "postgresql":
+            # Una secuencia de PostgreSQL reparte ids antes del commit: sin este candado, el id 11 podría confirmarse
+            # antes que el 10 y un lector que ya pasó del 11 nunca vería el 10. Con él, las transacciones que
+            # registran eventos toman su id y confirman de una en una, así que los ids se vuelven visibles en orden.
+            # En SQLite el único escritor ya lo garantiza.
+            db.execute(text("SELECT pg_advisory_xact_lock(:candado)"), {"candado": CANDADO_EVENTOS})
+        db.execute(insert(Evento_Cambio), eventos)
+    if contadores:
+        db.execute(update(Contador_Version).where(Contador_Version.nombre.in_(contadores))
+                   .values(version=Contador_Version.version + 1))
+    for inicio in range(0, len(estudiantes), 500):
+        db.execute(update(Estudiante).where(Estudiante.id.in_(estudiantes[inicio:inicio + 500]))
+                   .values(version=Estudiante.version + 1)
+                   .execution_options(synchronize_session=False))
+
+def contadores_de_rol(rol: str) -> tuple:
+    """Contadores que cambian al crear o eliminar un usuario con ese rol."""
+    return {"staff": ("staff",), "estudiante": ("estudiantes", "calificaciones")}.get(rol, ())
+
+def usuario_cambiado(db: Session, usuario):
+    """Alta o baja de un usuario; necesita su id, así que va después de un flush."""
+    incrementar(db, *contadores_de_rol(usuario.rol), estudiantes=[usuario.id] if usuario.rol == "estudiante" else ())
+
+def leer(db: Session) -> dict:
+    return dict(db.query(Contador_Version.nombre, Contador_Version.version).order_by(Contador_Version.nombre).all())
+
+def version_estudiante(db: Session, id_estudiante: int) -> int:
+    return db.query(Estudiante.version).filter(Estudiante.id == id_estudiante).scalar() or 0
+
+def etiqueta(*partes) -> str:
+    # Débil: dos respuestas con la misma etiqueta son equivalentes, no idénticas byte a byte
+    return 'W/"' + hashlib.sha256(repr(partes).encode("utf-8")).hexdigest()[:32] + '"'
+
+def coincide(encabezado: str, etag: str) -> bool:
+    if not encabezado:
+        return False
+    if encabezado.strip() == "*":
+        return True
+    # If-None-Match usa comparación débil: W/"x" equivale a "x"
+    etag = etag.removeprefix("W/")
+    return any(valor.strip().removeprefix("W/") == etag for valor in encabezado.split(","))
+
+def encabezados(etag: str) -> dict:
+    # Las páginas dependen del usuario: solo el navegador las guarda y siempre las revalida
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+def no_modificado(request: Request, etag: str):
+    """Respuesta 304 si el cliente ya tiene esta versión; None si hay que generarla."""
+    if coincide(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=encabezados(etag))
+    return None
@@ -0,0 +1,139 @@
+"""Benchmarks reproducibles de la plataforma.
+
+    python -m benchmarks micro [--tamano 1048576] [--repeticiones 20]
+    python -m benchmarks datos --directorio bench --staff 20 --estudiantes 500 --tamano 262144
+    python -m benchmarks carga [--estudiantes 500] [--concurrencia 16] [--peticiones 200] [--escenarios login,dashboard]
+    python -m benchmarks arranque [--repeticiones 5] [--workers 1,4]
+    python -m benchmarks comparar base.json nueva.json
+
+Los resultados se guardan en benchmarks/resultados/<tipo>-<commit>.json (JSON con claves ordenadas).
+"""
+import argparse
+import base64
+import os
+import shutil
+import tempfile
+
+ESCENARIOS = ["login", "dashboard", "registro", "descarga"]
+DIRECTORIO_RESULTADOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resultados")
+
+def _agregar_datos(parser: argparse.ArgumentParser):
+    parser.add_argument("--staff", type=int, default=20)
+    parser.add_argument("--estudiantes", type=int, default=500)
+    parser.add_argument("--tamano", type=int, default=256 * 1024, help="Bytes por documento")
+    parser.add_argument("--semilla", type=int, default=1)
+
+def _salida(args, tipo: str) -> str:
+    if args.salida:
+        return args.salida
+    from benchmarks.resultados import commit_actual
+    return os.path.join(DIRECTORIO_RESULTADOS, f"{tipo}-{commit_actual()}.json")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de la plataforma")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    micro = sub.add_parser("micro", help="Cifrado, Argon2 y RSA sin servidor")
+    micro.add_argument("--tamano", type=int, default=1024 * 1024)
+    micro.add_argument("--repeticiones", type=int, default=20)
+    micro.add_argument("--salida")
+
+    datos = sub.add_parser("datos", help="Genera una base sintética")
+    datos.add_argument("--directorio", required=True)
+    _agregar_datos(datos)
+
+    carga = sub.add_parser("carga", help="Escenarios HTTP contra uvicorn con datos sintéticos y SMTP falso")
+    _agregar_datos(carga)
+    carga.add_argument("--directorio", help="Reutiliza una base generada con `datos`")
+    carga.add_argument("--concurrencia", type=int, default=16)
+    carga.add_argument("--peticiones", type=int, default=200, help="Peticiones por escenario")
+    carga.add_argument("--escenarios", default=",".join(ESCENARIOS))
+    carga.add_argument("--puerto", type=int, default=8765)
+    carga.add_argument("--salida")
+
+    arranque = sub.add_parser("arranque", help="Inicialización, importación de la app y arranque de uvicorn con N workers")
+    arranque.add_argument("--repeticiones", type=int, default=5)
+    arranque.add_argument("--workers", default="1,4", help="Número de workers separados por comas")
+    arranque.add_argument("--puerto", type=int, default=8766)
+    arranque.add_argument("--salida")
+
+    comparar = sub.add_parser("comparar", help="Diferencia porcentual entre dos resultados")
+    comparar.add_argument("base")
+    comparar.add_argument("nueva")
+    args = parser.parse_args()
+
+    if args.comando == "comparar":
+        from benchmarks.resultados import comparar as comparar_resultados
+        comparar_resultados(args.base, args.nueva)
+        return
+
+    if args.comando == "arranque":
+        # Base vacía en un directorio temporal: el primer `iniciar` mide la creación del esquema
+        directorio = tempfile.mkdtemp(prefix="bench_")
+        from benchmarks.datos import configurar_entorno
+        from benchmarks import arranque as arranque_bench
+        from benchmarks.resultados import escribir
+        entorno = configurar_entorno(directorio)
+        entorno.setdefault("Clave_Secreta", os.getenv("Clave_Secreta") or base64.b64encode(os.urandom(32)).decode())
+        workers = [int(n) for n in args.workers.split(",") if n]
+        try:
+            casos = arranque_bench.ejecutar(entorno, args.repeticiones, workers, args.puerto)
+        finally:
+            shutil.rmtree(directorio, ignore_errors=True)
+        ruta = _salida(args, "arranque")
+        escribir(ruta, "arranque", {"repeticiones": args.repeticiones, "workers": workers}, casos)
+        print(f"Resultados en {ruta}")
+        return
+
+    if args.comando == "micro":
+        # La app no debe tocar la base real al importarse
+        directorio = tempfile.mkdtemp(prefix="bench_")
+        from benchmarks.datos import configurar_entorno
+        os.environ.update(configurar_entorno(directorio))
+        from benchmarks import micro as micro_bench
+        from benchmarks.resultados import escribir
+        try:
+            casos = micro_bench.ejecutar(args.tamano, args.repeticiones)
+        finally:
+            shutil.rmtree(directorio, ignore_errors=True)
+        ruta = _salida(args, "micro")
+        escribir(ruta, "micro", {"tamano": args.tamano, "repeticiones": args.repeticiones}, casos)
+        print(f"Resultados en {ruta}")
+        return
+
+    from benchmarks.datos import configurar_entorno, generar
+    parametros = {"staff": args.staff, "estudiantes": args.estudiantes, "tamano_documento": args.tamano, "semilla": args.semilla}
+    temporal = args.directorio is None
+    directorio = tempfile.mkdtemp(prefix="bench_") if temporal else args.directorio
+    entorno = configurar_entorno(directorio)
+    os.environ.update(entorno)
+
+    if args.comando == "datos":
+        print(generar(directorio, args.staff, args.estudiantes, args.tamano, args.semilla))
+        return
+
+    try:
+        if temporal or not os.path.exists(os.path.join(directorio, "llave.txt")):
+            generar(directorio, args.staff, args.estudiantes, args.tamano, args.semilla)
+        from app.basedatos import motor, motor_lectura
+        motor.dispose()
+        motor_lectura.dispose()
+        with open(os.path.join(directorio, "llave.txt"), "rb") as archivo:
+            llave_b64 = archivo.read()
+        from benchmarks import carga as carga_bench
+        from benchmarks.resultados import escribir
+        escenarios = [e for e in args.escenarios.split(",") if e]
+        desconocidos = set(escenarios) - set(ESCENARIOS)
+        if desconocidos:
+            parser.error(f"Escenarios desconocidos: {', '.join(sorted(desconocidos))}")
+        parametros.update(concurrencia=args.concurrencia, peticiones=args.peticiones)
+        casos = carga_bench.ejecutar(entorno, parametros, escenarios, args.puerto, llave_b64)
+        ruta = _salida(args, "carga")
+        escribir(ruta, "carga", {**parametros, "escenarios": escenarios}, casos)
+        print(f"Resultados en {ruta}")
+    finally:
+        if temporal:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
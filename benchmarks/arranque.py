@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+import time
+from benchmarks.carga import RAIZ, Servidor
+from benchmarks.resultados import percentiles
+
+# Importar app.main en un intérprete nuevo: lo que paga cada worker antes de atender
+_IMPORTAR = "import time; inicio = time.perf_counter(); import app.main; print(time.perf_counter() - inicio)"
+
+def _python(argumentos: list, entorno: dict) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *argumentos], cwd=RAIZ, env={**os.environ, **entorno},
+                          capture_output=True, text=True, check=True)
+
+def _cronometrar(argumentos: list, entorno: dict) -> float:
+    inicio = time.perf_counter()
+    _python(argumentos, entorno)
+    return time.perf_counter() - inicio
+
+def ejecutar(entorno: dict, repeticiones: int, workers: list, puerto: int) -> dict:
+    """Tiempos de `python -m app iniciar`, de importar la app y de uvicorn hasta la primera respuesta."""
+    casos = {}
+    # La primera vez crea el esquema y hace el hash Argon2 del jefe; las siguientes no tienen nada que hacer
+    casos["arranque.iniciar_base_nueva"] = percentiles([_cronometrar(["-m", "app", "iniciar"], entorno)])
+    casos["arranque.iniciar_base_al_dia"] = percentiles(
+        [_cronometrar(["-m", "app", "iniciar"], entorno) for _ in range(repeticiones)])
+    casos["arranque.importar_app"] = percentiles(
+        [float(_python(["-c", _IMPORTAR], entorno).stdout.strip()) for _ in range(repeticiones)])
+    for n in workers:
+        muestras = []
+        for _ in range(repeticiones):
+            servidor = Servidor(entorno, puerto, workers=n)
+            inicio = time.perf_counter()
+            servidor.iniciar()
+            muestras.append(time.perf_counter() - inicio)
+            servidor.detener()
+        casos[f"arranque.uvicorn_{n}_workers"] = percentiles(muestras)
+    for caso, valores in casos.items():
+        print(f"{caso}: {valores}")
+    return casos
@@ -0,0 +1,176 @@
+import asyncio
+import base64
+import itertools
+import os
+import random
+import subprocess
+import sys
+import time
+import httpx
+from benchmarks.datos import CONTRASEÑA
+from benchmarks.resultados import percentiles
+
+JEFE = ("12345", "Contraseña123!")
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _memoria_kb(pid: int, campo: str):
+    # VmHWM es el pico de RSS del proceso; solo existe en Linux
+    try:
+        with open(f"/proc/{pid}/status") as archivo:
+            for linea in archivo:
+                if linea.startswith(campo + ":"):
+                    return int(linea.split()[1])
+    except OSError:
+        return None
+    return None
+
+class Servidor:
+    """uvicorn en un subproceso apuntando a la base del benchmark y al SMTP falso."""
+
+    def __init__(self, entorno: dict, puerto: int, workers: int = 1):
+        self.entorno = {**os.environ, **entorno}
+        self.puerto = puerto
+        self.workers = workers
+        self.url = f"http://127.0.0.1:{puerto}"
+        self.proceso = None
+
+    def iniciar(self, espera: float = 30):
+        self.proceso = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(self.puerto), "--log-level", "warning",
+             "--workers", str(self.workers)],
+            cwd=RAIZ, env=self.entorno,
+        )
+        limite = time.monotonic() + espera
+        while time.monotonic() < limite:
+            try:
+                if httpx.get(self.url + "/auth/login", timeout=1).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            if self.proceso.poll() is not None:
+                raise RuntimeError("El servidor terminó al iniciar")
+            time.sleep(0.2)
+        raise RuntimeError("El servidor no respondió a tiempo")
+
+    def rss_pico_kb(self):
+        return _memoria_kb(self.proceso.pid, "VmHWM")
+
+    def detener(self):
+        self.proceso.terminate()
+        try:
+            self.proceso.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            self.proceso.kill()
+            self.proceso.wait()
+
+async def _iniciar_sesion(cliente: httpx.AsyncClient, matricula: str, contraseña: str):
+    respuesta = await cliente.post("/auth/login", data={"username": matricula, "password": contraseña})
+    if respuesta.status_code != 303:
+        raise RuntimeError(f"No se pudo iniciar sesión como {matricula}: {respuesta.status_code}")
+
+class Escenarios:
+    def __init__(self, parametros: dict, llave_b64: bytes):
+        self.parametros = parametros
+        self.llave_b64 = llave_b64
+        self.aleatorio = random.Random(parametros["semilla"])
+        self.documento = self.aleatorio.randbytes(parametros["tamano_documento"])
+        self._contador = itertools.count()
+        # Prefijo por corrida para no repetir matrículas al reutilizar una base con --directorio
+        self._corrida = f"{int(time.time()) % 46656:03x}"[-3:]
+
+    async def login(self, cliente):
+        matricula = f"S{self.aleatorio.randrange(self.parametros['staff']):06d}"
+        # Cliente sin sesión: cada petición verifica la contraseña con Argon2
+        return await cliente.post("/auth/login", data={"username": matricula, "password": CONTRASEÑA})
+
+    async def dashboard(self, cliente):
+        return await cliente.get("/jefe/dashboard")
+
+    async def registro(self, cliente):
+        n = next(self._contador)
+        return await cliente.post(
+            "/jefe/dashboard/registrarEstudiante",
+            data={"nombre": f"Carga {n}", "correo": f"carga{self._corrida}{n}@bench.mx",
+                  "matricula": f"R{self._corrida}{n:06d}", "telefono": "5512345678"},
+            files={"documento": ("carga.pdf", self.documento), "llave_simetrica": ("llave.txt", self.llave_b64)},
+        )
+
+    async def descarga(self, cliente):
+        id_documento = self.aleatorio.randrange(1, self.parametros["estudiantes"] + 1)
+        return await cliente.post(f"/jefe/dashboard/descargarDocumento/{id_documento}",
+                                  files={"llave_simetrica": ("llave.txt", self.llave_b64)})
+
+async def _correr(cliente, escenario, concurrencia: int, peticiones: int) -> dict:
+    duraciones, errores = [], 0
+    restantes = itertools.count()
+
+    async def trabajador():
+        nonlocal errores
+        while next(restantes) < peticiones:
+            inicio = time.perf_counter()
+            try:
+                respuesta = await escenario(cliente)
+                correcta = respuesta.status_code < 400
+            except httpx.HTTPError:
+                correcta = False
+            duraciones.append(time.perf_counter() - inicio)
+            errores += not correcta
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabajador() for _ in range(concurrencia)))
+    total = time.perf_counter() - inicio
+    caso = percentiles(duraciones)
+    caso["errores"] = errores
+    caso["peticiones_s"] = round(len(duraciones) / total, 2) if total else None
+    return caso
+
+async def _ejecutar(servidor: Servidor, escenarios: list, parametros: dict, llave_b64: bytes) -> dict:
+    casos = {}
+    acciones = Escenarios(parametros, llave_b64)
+    async with httpx.AsyncClient(base_url=servidor.url, timeout=120) as cliente, \
+            httpx.AsyncClient(base_url=servidor.url, timeout=120) as anonimo:
+        await _iniciar_sesion(cliente, *JEFE)
+        for nombre in escenarios:
+            # El login guarda la cookie del staff: usa su propio cliente para no reemplazar la del jefe
+            caso = await _correr(anonimo if nombre == "login" else cliente, getattr(acciones, nombre),
+                                 parametros["concurrencia"], parametros["peticiones"])
+            estado = (await cliente.get("/jefe/estado")).json()
+            caso["bucle_p99_ms"] = estado["bucle"].get("p99_ms")
+            caso["rss_pico_kb"] = servidor.rss_pico_kb()
+            casos[f"http.{nombre}"] = caso
+            print(f"{nombre}: {caso}")
+    return casos
+
+def ejecutar(entorno: dict, parametros: dict, escenarios: list, puerto: int, llave_b64: bytes) -> dict:
+    from benchmarks.smtp_falso import ServidorSMTPFalso
+    smtp = ServidorSMTPFalso()
+    entorno = {
+        **entorno,
+        "Servidor_SMTP": "127.0.0.1",
+        "Puerto_SMTP": str(smtp.iniciar()),
+        "TLS_SMTP": "0",
+        "Usuario_SMTP": "",
+        "Contrasena_SMTP": "",
+        "Remitente_SMTP": "benchmark@bench.mx",
+    }
+    entorno.setdefault("Clave_Secreta", os.getenv("Clave_Secreta") or base64.b64encode(os.urandom(32)).decode())
+    servidor = Servidor(entorno, puerto)
+    servidor.iniciar()
+    try:
+        casos = asyncio.run(_ejecutar(servidor, escenarios, parametros, llave_b64))
+    finally:
+        servidor.detener()
+        smtp.detener()
+    if casos and all(c["rss_pico_kb"] is None for c in casos.values()):
+        try:
+            import resource
+        except ImportError:
+            # Windows: no hay forma portable de leer el pico
+            resource = None
+        if resource is not None:
+            # Sin /proc: el pico del hijo ya terminado (bytes en macOS)
+            pico = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            for caso in casos.values():
+                caso["rss_pico_kb"] = pico // 1024 if sys.platform == "darwin" else pico
+    casos["smtp.recibidos"] = {"n": smtp.recibidos}
+    return casos
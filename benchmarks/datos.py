@@ -0,0 +1,80 @@
+import base64
+import hashlib
+import os
+import random
+
+CONTRASEÑA = "Benchmark123!"
+MATERIAS = ["Ingeniería de Software", "Compiladores", "Criptografía", "Sistemas en Chip", "Sistemas Distribuidos"]
+SEMESTRES = ["2023-2", "2024-1", "2024-2"]
+
+def configurar_entorno(directorio: str) -> dict:
+    """Variables que apuntan la app a la base y al almacén del benchmark; deben fijarse antes de importar app."""
+    directorio = os.path.abspath(directorio)
+    return {
+        "URL_BD": f"sqlite:///{os.path.join(directorio, 'bench.db')}",
+        "Directorio_Blobs": os.path.join(directorio, "blobs"),
+    }
+
+def llave_semilla(semilla: int) -> bytes:
+    return hashlib.sha256(f"benchmark-{semilla}".encode()).digest()
+
+def generar(directorio: str, staff: int, estudiantes: int, tamano_documento: int, semilla: int = 1, lote: int = 500) -> dict:
+    """Crea una base sintética reproducible: `staff` miembros, `estudiantes` con calificaciones y un documento cada uno.
+
+    Todos los usuarios comparten la contraseña CONTRASEÑA; la llave de los documentos se deriva de la semilla
+    y se guarda en llave.txt (base64) para los escenarios de descarga.
+    """
+    from app.basedatos import SesionLocal, iniciar_bd
+    from app.auth import servicio_hash
+    from app.cifrado import TAMANO_SEGMENTO
+    from app.analitica import reconstruir
+    from app.crud import cifrar_y_guardar, resolver_version_llave
+    from app.modelos import Usuario, Estudiante, Documento, Historial_Academico
+
+    os.makedirs(directorio, exist_ok=True)
+    iniciar_bd()
+    aleatorio = random.Random(semilla)
+    llave = llave_semilla(semilla)
+    with open(os.path.join(directorio, "llave.txt"), "wb") as archivo:
+        archivo.write(base64.b64encode(llave))
+    # Un solo hash para todos: generar miles de hashes Argon2 dominaría el tiempo de preparación
+    contraseña_hash = servicio_hash.hasher.hash(CONTRASEÑA)
+
+    db = SesionLocal()
+    try:
+        # La llave semilla hace las veces de /jefe/generar-clave
+        version = resolver_version_llave(db, llave, registrar=True)
+        for inicio in range(0, staff, lote):
+            db.add_all(
+                Usuario(nombre=f"Staff {i}", correo=f"staff{i}@bench.mx", rol="staff", contraseña=contraseña_hash,
+                        matricula=f"S{i:06d}", primer_login=False)
+                for i in range(inicio, min(staff, inicio + lote))
+            )
+            db.commit()
+
+        for inicio in range(0, estudiantes, lote):
+            usuarios = [
+                Usuario(nombre=f"Estudiante {i}", correo=f"est{i}@bench.mx", rol="estudiante", contraseña=contraseña_hash,
+                        matricula=f"E{i:06d}", primer_login=False)
+                for i in range(inicio, min(estudiantes, inicio + lote))
+            ]
+            db.add_all(usuarios)
+            db.flush()
+            for usuario in usuarios:
+                db.add(Estudiante(id=usuario.id, telefono=aleatorio.randrange(10**7, 10**8)))
+                for materia in MATERIAS:
+                    calificacion = aleatorio.randint(5, 10)
+                    db.add(Historial_Academico(id_estudiante=usuario.id, materia=materia,
+                                               semestre=aleatorio.choice(SEMESTRES),
+                                               calificacion=str(calificacion), calificacion_numerica=calificacion))
+                contenido = aleatorio.randbytes(tamano_documento)
+                bloques = (contenido[i:i + TAMANO_SEGMENTO] for i in range(0, len(contenido), TAMANO_SEGMENTO))
+                db.add(Documento(id_estudiante=usuario.id, nombre_archivo=f"doc{usuario.id}.pdf",
+                                 version_llave=version.id, **cifrar_y_guardar(bloques, llave)))
+            db.commit()
+            db.expunge_all()
+        # Las filas se insertaron sin pasar por actualizar_calificaciones_lote
+        reconstruir(db)
+    finally:
+        db.close()
+    return {"staff": staff, "estudiantes": estudiantes, "tamano_documento": tamano_documento, "semilla": semilla}
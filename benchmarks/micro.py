@@ -0,0 +1,59 @@
+import os
+import time
+from benchmarks.resultados import percentiles
+
+def _medir(funcion, repeticiones: int, calentamiento: int = 1) -> list:
+    for _ in range(calentamiento):
+        funcion()
+    duraciones = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        duraciones.append(time.perf_counter() - inicio)
+    return duraciones
+
+def _caso(duraciones: list, bytes_por_operacion: int = None) -> dict:
+    caso = percentiles(duraciones)
+    total = sum(duraciones)
+    caso["ops_s"] = round(len(duraciones) / total, 2) if total else None
+    if bytes_por_operacion:
+        caso["mb_s"] = round(bytes_por_operacion * len(duraciones) / total / 2**20, 2) if total else None
+    return caso
+
+def ejecutar(tamano_documento: int, repeticiones: int) -> dict:
+    from app.auth import PERFILES_ARGON2
+    from app.cifrado import (cifrar_chacha20_poly1305, descifrar_chacha20_poly1305, cifrar_segmentado,
+                             descifrar_segmentado, generar_clave_chacha, TAMANO_SEGMENTO)
+    from app.llaves import generar_par_rsa, cifrar_clave, descifrar_clave, cifrar_clave_para, cache_llaves
+
+    casos = {}
+    clave = generar_clave_chacha()
+    datos = os.urandom(tamano_documento)
+
+    def bloques():
+        return (datos[i:i + TAMANO_SEGMENTO] for i in range(0, len(datos), TAMANO_SEGMENTO))
+
+    cifrado = b"".join(cifrar_segmentado(bloques(), clave))
+    casos["cifrado.cifrar_segmentado"] = _caso(
+        _medir(lambda: b"".join(cifrar_segmentado(bloques(), clave)), repeticiones), tamano_documento)
+    casos["cifrado.descifrar_segmentado"] = _caso(
+        _medir(lambda: b"".join(descifrar_segmentado(iter([cifrado]), clave)), repeticiones), tamano_documento)
+    nonce, texto_cifrado, tag = cifrar_chacha20_poly1305(datos, clave)
+    casos["cifrado.cifrar_chacha20_poly1305"] = _caso(
+        _medir(lambda: cifrar_chacha20_poly1305(datos, clave), repeticiones), tamano_documento)
+    casos["cifrado.descifrar_chacha20_poly1305"] = _caso(
+        _medir(lambda: descifrar_chacha20_poly1305(nonce, texto_cifrado, tag, clave), repeticiones), tamano_documento)
+
+    for nombre, hasher in PERFILES_ARGON2.items():
+        hash_contraseña = hasher.hash("Benchmark123!")
+        casos[f"argon2.{nombre}.hash"] = _caso(_medir(lambda: hasher.hash("Benchmark123!"), repeticiones))
+        casos[f"argon2.{nombre}.verificar"] = _caso(_medir(lambda: hasher.verify(hash_contraseña, "Benchmark123!"), repeticiones))
+
+    privada, publica = (pem.decode() for pem in generar_par_rsa())
+    envuelta = cifrar_clave(clave, publica)
+    casos["llaves.cifrar_clave"] = _caso(_medir(lambda: cifrar_clave(clave, publica), repeticiones))
+    casos["llaves.descifrar_clave"] = _caso(_medir(lambda: descifrar_clave(envuelta, privada), repeticiones))
+    destinatarios = {i: generar_par_rsa()[1].decode() for i in range(20)}
+    cache_llaves.limpiar()
+    casos["llaves.cifrar_clave_para_20"] = _caso(_medir(lambda: cifrar_clave_para(clave, destinatarios), repeticiones))
+    return casos
@@ -0,0 +1,60 @@
+import json
+import os
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+def percentiles(muestras: list) -> dict:
+    """p50/p95/p99/máximo en milisegundos de una lista de duraciones en segundos."""
+    if not muestras:
+        return {"n": 0}
+    ordenadas = sorted(muestras)
+
+    def p(fraccion):
+        return round(ordenadas[min(len(ordenadas) - 1, int(fraccion * len(ordenadas)))] * 1000, 3)
+
+    return {"n": len(ordenadas), "p50_ms": p(0.50), "p95_ms": p(0.95), "p99_ms": p(0.99),
+            "max_ms": round(ordenadas[-1] * 1000, 3)}
+
+def commit_actual() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconocido"
+
+def escribir(ruta: str, tipo: str, parametros: dict, casos: dict):
+    """Guarda los resultados como JSON con claves ordenadas: dos corridas se comparan con diff o `comparar`."""
+    resultado = {
+        "tipo": tipo,
+        "commit": commit_actual(),
+        "fecha": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "parametros": parametros,
+        "casos": casos,
+    }
+    directorio = os.path.dirname(ruta)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+    with open(ruta, "w", encoding="utf-8") as archivo:
+        json.dump(resultado, archivo, indent=2, sort_keys=True, ensure_ascii=False)
+        archivo.write("\n")
+    return resultado
+
+def comparar(ruta_base: str, ruta_nueva: str):
+    """Imprime la diferencia porcentual de cada métrica numérica común a dos resultados."""
+    with open(ruta_base, encoding="utf-8") as archivo:
+        base = json.load(archivo)
+    with open(ruta_nueva, encoding="utf-8") as archivo:
+        nueva = json.load(archivo)
+    print(f"{base['commit']} -> {nueva['commit']}")
+    for caso in sorted(set(base["casos"]) & set(nueva["casos"])):
+        print(f"\n{caso}")
+        for metrica, anterior in sorted(base["casos"][caso].items()):
+            actual = nueva["casos"][caso].get(metrica)
+            if not isinstance(anterior, (int, float)) or not isinstance(actual, (int, float)):
+                continue
+            cambio = f"{(actual - anterior) / anterior * 100:+.1f}%" if anterior else "n/a"
+            print(f"  {metrica:<22} {anterior:>12} {actual:>12} {cambio:>9}")
+    for caso in sorted(set(base["casos"]) ^ set(nueva["casos"])):
+        print(f"\n{caso}: solo en {'la base' if caso in base['casos'] else 'la nueva corrida'}")
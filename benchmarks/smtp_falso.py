@@ -0,0 +1,69 @@
+import asyncio
+import threading
+
+class ServidorSMTPFalso:
+    """Servidor SMTP mínimo que acepta y descarta los mensajes, para medir sin enviar correo real.
+
+    Implementa lo que usa app.correo.ConexionSMTP sin TLS: EHLO/HELO, MAIL, RCPT, DATA, NOOP, RSET y QUIT.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", puerto: int = 0):
+        self.host = host
+        self.puerto = puerto
+        self.recibidos = 0
+        self._bucle = None
+        self._servidor = None
+        self._hilo = None
+        self._listo = threading.Event()
+
+    async def _atender(self, lector: asyncio.StreamReader, escritor: asyncio.StreamWriter):
+        def responder(linea: str):
+            escritor.write((linea + "\r\n").encode())
+
+        responder("220 smtp-falso listo")
+        try:
+            while True:
+                linea = await lector.readline()
+                if not linea:
+                    break
+                comando = linea.decode(errors="replace").strip().upper()
+                if comando.startswith("EHLO"):
+                    responder("250-smtp-falso")
+                    responder("250 8BITMIME")
+                elif comando.startswith("DATA"):
+                    responder("354 termina con <CRLF>.<CRLF>")
+                    while (await lector.readline()) not in (b".\r\n", b".\n", b""):
+                        pass
+                    self.recibidos += 1
+                    responder("250 aceptado")
+                elif comando.startswith("QUIT"):
+                    responder("221 adiós")
+                    await escritor.drain()
+                    break
+                else:
+                    # HELO, MAIL, RCPT, NOOP, RSET
+                    responder("250 OK")
+                await escritor.drain()
+        finally:
+            escritor.close()
+
+    def _ejecutar(self):
+        self._bucle = asyncio.new_event_loop()
+        self._servidor = self._bucle.run_until_complete(asyncio.start_server(self._atender, self.host, self.puerto))
+        self.puerto = self._servidor.sockets[0].getsockname()[1]
+        self._listo.set()
+        self._bucle.run_forever()
+        self._servidor.close()
+        self._bucle.run_until_complete(self._servidor.wait_closed())
+        self._bucle.close()
+
+    def iniciar(self) -> int:
+        self._hilo = threading.Thread(target=self._ejecutar, name="smtp-falso", daemon=True)
+        self._hilo.start()
+        self._listo.wait(timeout=5)
+        return self.puerto
+
+    def detener(self):
+        if self._bucle is not None:
+            self._bucle.call_soon_threadsafe(self._bucle.stop)
+            self._hilo.join(timeout=5)
@@ -0,0 +1,36 @@
+// Cambios en vivo de la lista de estudiantes (jefe y staff) por server-sent events.
+// Usa listaEstudiantes, btnCargarMas y formFiltros de listaEstudiantes.js.
+// Al reconectar, EventSource manda el Last-Event-ID y el servidor reenvía lo que faltó.
+const fuenteCambios = new EventSource(`${listaEstudiantes.dataset.eventos}?desde=${listaEstudiantes.dataset.desde}`);
+
+function filtrosActivos() {
+    return Array.from(new FormData(formFiltros).values()).some(valor => valor);
+}
+
+function aplicarCambioEstudiante(cambio) {
+    const actual = listaEstudiantes.querySelector(`li[data-id="${cambio.id}"]`);
+    if (cambio.html === null) {
+        if (actual) actual.remove();
+        return;
+    }
+    const plantilla = document.createElement("template");
+    plantilla.innerHTML = cambio.html.trim();
+    const nueva = plantilla.content.firstElementChild;
+    if (actual) {
+        // Conserva abiertas las calificaciones que el usuario estaba viendo
+        const abiertas = actual.querySelector(".calificaciones");
+        const nuevas = nueva.querySelector(".calificaciones");
+        if (abiertas && nuevas) nuevas.style.display = abiertas.style.display;
+        actual.replaceWith(nueva);
+    } else if (!btnCargarMas.dataset.siguiente && !filtrosActivos()) {
+        // Los estudiantes nuevos van al final; si faltan páginas por cargar llegarán con "Cargar más"
+        listaEstudiantes.querySelectorAll("li:not([data-id])").forEach(li => li.remove());
+        listaEstudiantes.appendChild(nueva);
+    }
+}
+
+fuenteCambios.addEventListener("estudiante", (evento) => aplicarCambioEstudiante(JSON.parse(evento.data)));
+// La lista de staff cambia poco: se recarga la página (el ETag evita rehacer lo que no cambió)
+fuenteCambios.addEventListener("staff", () => location.reload());
+// El servidor ya no tiene los eventos que faltan
+fuenteCambios.addEventListener("recargar", () => location.reload());
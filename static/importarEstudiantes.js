@@ -0,0 +1,50 @@
+// Importación masiva de estudiantes (CSV + ZIP) con seguimiento del progreso
+const formImportar = document.getElementById("form-importar");
+const progresoImportacion = document.getElementById("progreso-importacion");
+
+function mostrarImportacion(estado) {
+    progresoImportacion.innerHTML = "";
+    const resumen = document.createElement("p");
+    resumen.textContent = `Estado: ${estado.estado} — ${estado.procesados}/${estado.total} filas, ${estado.exitosos} registradas`;
+    progresoImportacion.appendChild(resumen);
+    if (estado.errores.length > 0) {
+        const lista = document.createElement("ul");
+        estado.errores.forEach(e => {
+            const li = document.createElement("li");
+            li.textContent = e.fila ? `Fila ${e.fila} (${e.matricula}): ${e.error}` : e.error;
+            lista.appendChild(li);
+        });
+        progresoImportacion.appendChild(lista);
+    }
+}
+
+async function seguirImportacion(id) {
+    const response = await fetch(`${formImportar.dataset.estado}/${id}`);
+    if (!response.ok) return;
+    const estado = await response.json();
+    mostrarImportacion(estado);
+    if (estado.estado === "en_cola" || estado.estado === "procesando") {
+        setTimeout(() => seguirImportacion(id), 1000);
+    }
+}
+
+formImportar.addEventListener("submit", async function (event) {
+    event.preventDefault();
+    try {
+        const response = await fetch(formImportar.action, {
+            method: "POST",
+            body: new FormData(formImportar)
+        });
+        if (!response.ok) {
+            const error = await response.json();
+            alert("Error: " + error.detail);
+            return;
+        }
+        const estado = await response.json();
+        mostrarImportacion(estado);
+        seguirImportacion(estado.id);
+    } catch (err) {
+        console.error("Error al importar estudiantes:", err);
+        alert("Error inesperado");
+    }
+});
@@ -0,0 +1,118 @@
+// Paginación por cursor de la lista de estudiantes (jefe y staff)
+const listaEstudiantes = document.getElementById("lista-estudiantes");
+const btnCargarMas = document.getElementById("btn-cargar-mas");
+const formFiltros = document.getElementById("form-filtros");
+
+function crearElemento(etiqueta, clase, texto) {
+    const el = document.createElement(etiqueta);
+    if (clase) el.className = clase;
+    if (texto !== undefined && texto !== null) el.textContent = texto;
+    return el;
+}
+
+function crearFilaEstudiante(e) {
+    const li = crearElemento("li", "staff-item");
+    li.dataset.id = e.id;
+
+    const info = crearElemento("div", "staff-info");
+    info.appendChild(crearElemento("span", "staff-name", e.nombre));
+    info.appendChild(crearElemento("span", "staff-email", e.correo));
+    info.appendChild(crearElemento("span", "staff-matricula", e.matricula));
+    info.appendChild(crearElemento("span", "staff-telefono", e.telefono));
+    li.appendChild(info);
+
+    const acciones = crearElemento("div", "staff-actions");
+    // Mismos botones que templates/fila_estudiante.html
+    e.documentos.forEach(doc => {
+        const etiqueta = doc.tipo === "expediente" ? "VER EXPEDIENTE DE PREPARATORIA" : "VER " + (doc.tipo || "").toUpperCase();
+        const btn = crearElemento("button", "action-btn", etiqueta);
+        if (doc.nombre_archivo) btn.title = doc.nombre_archivo;
+        btn.addEventListener("click", () => abrirModalVerPDF(doc.id));
+        acciones.appendChild(btn);
+        if (doc.tamano) {
+            acciones.appendChild(crearElemento("span", "staff-telefono", (doc.tamano / 1024).toFixed(1) + " KB"));
+        }
+    });
+    if (e.documentos.length === 0) {
+        const sinDoc = crearElemento("span", null, "Sin documento cargado");
+        sinDoc.style.color = "gray";
+        acciones.appendChild(sinDoc);
+    }
+    li.appendChild(acciones);
+
+    const btnCal = crearElemento("button", "btn-calificaciones", "Ver calificaciones");
+    btnCal.type = "button";
+    btnCal.addEventListener("click", () => toggleCalificaciones(e.matricula));
+    li.appendChild(btnCal);
+
+    const cal = crearElemento("div", "calificaciones");
+    cal.id = "calificaciones-" + e.matricula;
+    cal.style.display = "none";
+    cal.style.marginLeft = "1rem";
+    const ul = document.createElement("ul");
+    if (e.calificaciones.length === 0) {
+        ul.appendChild(crearElemento("li", null, "No hay calificaciones registradas."));
+    }
+    e.calificaciones.forEach(c => {
+        const item = document.createElement("li");
+        item.appendChild(crearElemento("strong", null, c.materia + ":"));
+        item.appendChild(document.createTextNode(" " + c.calificacion));
+        ul.appendChild(item);
+    });
+    cal.appendChild(ul);
+    li.appendChild(cal);
+
+    const eliminar = crearElemento("div", "staff-actions");
+    const form = document.createElement("form");
+    form.action = "/staff/dashboard/eliminarEstudiante";
+    form.method = "post";
+    const oculto = document.createElement("input");
+    oculto.type = "hidden";
+    oculto.name = "matricula";
+    oculto.value = e.matricula;
+    form.appendChild(oculto);
+    const btnEliminar = crearElemento("button", "btn-eliminar", "Eliminar");
+    btnEliminar.type = "submit";
+    form.appendChild(btnEliminar);
+    eliminar.appendChild(form);
+    li.appendChild(eliminar);
+
+    return li;
+}
+
+async function cargarEstudiantes(reiniciar) {
+    const params = new URLSearchParams();
+    new FormData(formFiltros).forEach((valor, campo) => {
+        if (valor) params.append(campo, valor);
+    });
+    if (!reiniciar && btnCargarMas.dataset.siguiente) {
+        params.append("despues_de", btnCargarMas.dataset.siguiente);
+    }
+    try {
+        const response = await fetch(`${listaEstudiantes.dataset.url}?${params}`);
+        if (!response.ok) {
+            const error = await response.json();
+            alert("Error: " + error.detail);
+            return;
+        }
+        const pagina = await response.json();
+        if (reiniciar) {
+            listaEstudiantes.innerHTML = "";
+            if (pagina.estudiantes.length === 0) {
+                listaEstudiantes.appendChild(crearElemento("li", "staff-item", "No hay estudiantes registrados."));
+            }
+        }
+        pagina.estudiantes.forEach(e => listaEstudiantes.appendChild(crearFilaEstudiante(e)));
+        btnCargarMas.dataset.siguiente = pagina.siguiente ?? "";
+        btnCargarMas.style.display = pagina.siguiente == null ? "none" : "";
+    } catch (err) {
+        console.error("Error al cargar estudiantes:", err);
+        alert("Error inesperado");
+    }
+}
+
+btnCargarMas.addEventListener("click", () => cargarEstudiantes(false));
+formFiltros.addEventListener("submit", function (event) {
+    event.preventDefault();
+    cargarEstudiantes(true);
+});
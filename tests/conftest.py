@@ -0,0 +1,183 @@
+import asyncio
+import base64
+import os
+import secrets
+from contextlib import contextmanager
+import pytest
+
+# Antes de importar app: hashes baratos y sin servidor de correo real (.env trae uno)
+os.environ.setdefault("Perfil_Argon2", "bajo")
+os.environ.setdefault("Hilos_Argon2", "2")
+os.environ["Servidor_SMTP"] = ""
+
+from fastapi.testclient import TestClient
+from sqlalchemy import MetaData, event
+from sqlalchemy.engine import Engine
+from app import almacen, basedatos
+from app.basedatos import crear_motor, crear_motor_async, url_async, SesionEnrutada, SesionEnrutadaAsync
+from app.cache import cache_usuarios
+from app.plantillas import cache_fragmentos
+
+# La suite corre siempre sobre SQLite y, si URL_BD apunta a PostgreSQL, también sobre esa base.
+# OJO: la base de URL_BD se vacía antes de cada prueba.
+BACKENDS = ["sqlite"] + (["postgresql"] if os.getenv("URL_BD", "").startswith("postgresql") else [])
+CONTRASEÑA_JEFE = "Contraseña123!"
+
+class Backend:
+    """Motores de una base vacía, armados como en app.basedatos para su dialecto."""
+
+    def __init__(self, url: str):
+        self.url = url
+        if url.startswith("sqlite"):
+            self.motor = crear_motor(url, tamano_pool=1, desborde=0)
+            self.motor_lectura = crear_motor(url, solo_lectura=True)
+            self.motor_async = crear_motor_async(url_async(url), tamano_pool=1, desborde=0)
+            self.motor_async_lectura = crear_motor_async(url_async(url), solo_lectura=True)
+        else:
+            self.motor = self.motor_lectura = crear_motor(url)
+            self.motor_async = self.motor_async_lectura = crear_motor_async(url_async(url))
+
+    def vaciar(self):
+        metadata = MetaData()
+        with self.motor.begin() as conexion:
+            metadata.reflect(conexion)
+            metadata.drop_all(conexion)
+
+    def cerrar(self):
+        self.motor.dispose()
+        self.motor_lectura.dispose()
+        for motor in {self.motor_async, self.motor_async_lectura}:
+            try:
+                asyncio.run(motor.dispose())
+            except Exception:
+                # Conexiones abiertas por el loop del TestClient, que ya terminó
+                pass
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, tmp_path):
+    url = f"sqlite:///{tmp_path / 'prueba.db'}" if request.param == "sqlite" else os.environ["URL_BD"]
+    backend = Backend(url)
+    backend.vaciar()
+    yield backend
+    backend.cerrar()
+
+@pytest.fixture
+def bd(backend, tmp_path, monkeypatch):
+    """Base migrada con el jefe inicial; la aplicación entera usa sus motores y un almacén de blobs temporal."""
+    from app.migraciones import migrar
+    for nombre in ("motor", "motor_lectura", "motor_async", "motor_async_lectura"):
+        monkeypatch.setattr(basedatos, nombre, getattr(backend, nombre))
+    monkeypatch.setattr(SesionEnrutada, "escritor", backend.motor)
+    monkeypatch.setattr(SesionEnrutada, "lector", backend.motor_lectura)
+    monkeypatch.setattr(SesionEnrutadaAsync, "escritor", backend.motor_async.sync_engine)
+    monkeypatch.setattr(SesionEnrutadaAsync, "lector", backend.motor_async_lectura.sync_engine)
+    monkeypatch.setattr(almacen, "_almacen", almacen.AlmacenDisco(str(tmp_path / "blobs")))
+    # Los ids se repiten entre pruebas: nada cacheado de otra base debe sobrevivir
+    cache_usuarios.limpiar()
+    cache_fragmentos.limpiar()
+    migrar(backend.motor)
+    basedatos.crear_jefe()
+    yield backend
+    cache_usuarios.limpiar()
+    cache_fragmentos.limpiar()
+
+@pytest.fixture
+def sesion(bd):
+    db = basedatos.SesionLocal()
+    yield db
+    db.close()
+
+@pytest.fixture
+def iniciar_sesion(bd):
+    """Devuelve una función que abre un TestClient con la sesión del usuario dado."""
+    from app.main import app
+
+    def iniciar(matricula: str, contraseña: str) -> TestClient:
+        # Sin `with`: el ciclo de vida arrancaría el despachador de correo y el difusor de eventos
+        cliente = TestClient(app)
+        respuesta = cliente.post("/auth/login", data={"username": matricula, "password": contraseña}, follow_redirects=False)
+        assert respuesta.status_code == 303, respuesta.text
+        return cliente
+    return iniciar
+
+@pytest.fixture
+def cliente(iniciar_sesion):
+    """Cliente con la sesión del jefe iniciada."""
+    return iniciar_sesion("12345", CONTRASEÑA_JEFE)
+
+@pytest.fixture
+def llave(bd) -> bytes:
+    """Llave simétrica registrada como versión activa, como la entrega /jefe/generar-clave."""
+    from app.crud import resolver_version_llave
+    llave = secrets.token_bytes(32)
+    db = basedatos.SesionLocal()
+    try:
+        resolver_version_llave(db, llave, registrar=True)
+    finally:
+        db.close()
+    return llave
+
+@pytest.fixture
+def subir(cliente, llave):
+    """Devuelve una función que sube `contenido` como documento del estudiante dado y regresa su id."""
+    from app.modelos import Documento
+
+    def subir(matricula: str, contenido: bytes, nombre: str = "acta.pdf") -> int:
+        respuesta = cliente.post("/jefe/dashboard/subirDocumento", data={"matricula": matricula, "tipo": "acta"},
+                                 files={"documento": (nombre, contenido), "llave_simetrica": ("llave.txt", base64.b64encode(llave))},
+                                 follow_redirects=False)
+        assert respuesta.status_code == 303, respuesta.text
+        with basedatos.SesionLocal() as db:
+            return db.query(Documento.id).filter(Documento.nombre_archivo == nombre).order_by(Documento.id.desc()).first()[0]
+    return subir
+
+@pytest.fixture
+def sembrar(bd):
+    """Devuelve una función que inserta estudiantes (con documentos sin blob y calificaciones con sus agregados) y staff."""
+    from app import analitica, versiones
+    from app.crud import _aplicar_estadisticas
+    from app.modelos import Usuario, Estudiante, Documento, Historial_Academico
+
+    def sembrar(desde: int, hasta: int, documentos: int = 2, calificaciones: int = 2, staff: bool = True):
+        db = basedatos.SesionLocal()
+        deltas = analitica.nuevos_deltas()
+        try:
+            for i in range(desde, hasta):
+                estudiante = Usuario(nombre=f"Estudiante {i}", correo=f"e{i}@prueba.mx", rol="estudiante",
+                                     contraseña="-", matricula=f"E{i:05d}", primer_login=False)
+                db.add(estudiante)
+                if staff:
+                    db.add(Usuario(nombre=f"Staff {i}", correo=f"s{i}@prueba.mx", rol="staff",
+                                   contraseña="-", matricula=f"S{i:05d}", primer_login=False))
+                db.flush()
+                db.add(Estudiante(id=estudiante.id, telefono=55))
+                db.add_all(Documento(id_estudiante=estudiante.id, tipo="expediente" if d == 0 else f"acta{d}",
+                                     nombre_archivo=f"{i}_{d}.pdf", tamano=1024) for d in range(documentos))
+                db.add_all(Historial_Academico(id_estudiante=estudiante.id, materia=f"Materia {m}", semestre="",
+                                               calificacion="8", calificacion_numerica=8.0) for m in range(calificaciones))
+                for m in range(calificaciones):
+                    analitica.acumular(deltas, f"Materia {m}", "", 8.0, 1)
+            # Los agregados quedan como los dejaría actualizar_calificaciones_lote
+            _aplicar_estadisticas(db, deltas)
+            versiones.incrementar(db, "staff", "estudiantes", "calificaciones")
+            db.commit()
+        finally:
+            db.close()
+    return sembrar
+
+@contextmanager
+def _contar_consultas():
+    consultas = []
+
+    def registrar(conexion, cursor, sentencia, parametros, contexto, varias):
+        consultas.append(sentencia)
+    event.listen(Engine, "before_cursor_execute", registrar)
+    try:
+        yield consultas
+    finally:
+        event.remove(Engine, "before_cursor_execute", registrar)
+
+@pytest.fixture
+def contar_consultas():
+    """`with contar_consultas() as consultas:` junta las sentencias SQL ejecutadas en cualquier motor."""
+    return _contar_consultas
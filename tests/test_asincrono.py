@@ -0,0 +1,77 @@
+import asyncio
+import base64
+import os
+from sqlalchemy import update
+from app import cifrado, crud
+from app.auth import servicio_hash
+from app.basedatos import SesionLocal
+from app.modelos import Historial_Academico, Usuario
+
+PDF = os.urandom(200 * 1024)
+MATERIAS = ("ingenieria_de_software", "compiladores", "criptografia", "sistemas_en_chip", "sistemas_distribuidos")
+
+def _editar(cliente, ruta: str, matricula: str, calificacion: str = "9"):
+    return cliente.post(f"/{ruta}/dashboard/editarCalificaciones", follow_redirects=False,
+                        data={"matricula_estudiante": matricula, **{materia: calificacion for materia in MATERIAS}},
+                        files={"llave_privada": ("llave.pem", b"-")})
+
+def _calificaciones(matricula: str) -> dict:
+    with SesionLocal() as db:
+        return dict(db.query(Historial_Academico.materia, Historial_Academico.calificacion)
+                    .join(Usuario, Usuario.id == Historial_Academico.id_estudiante)
+                    .filter(Usuario.matricula == matricula).all())
+
+def test_editar_calificaciones_jefe_y_staff(cliente, iniciar_sesion, sembrar):
+    sembrar(0, 1, calificaciones=0)
+    assert _editar(cliente, "jefe", "E00000", "9").status_code == 303
+    assert set(_calificaciones("E00000").values()) == {"9"}
+    with SesionLocal() as db:
+        db.execute(update(Usuario).where(Usuario.matricula == "S00000").values(contraseña=servicio_hash.hasher.hash("Clave123!")))
+        db.commit()
+    assert _editar(iniciar_sesion("S00000", "Clave123!"), "staff", "E00000", "7").status_code == 303
+    assert set(_calificaciones("E00000").values()) == {"7"}
+
+def test_matricula_desconocida_responde_404(cliente, sembrar):
+    sembrar(0, 1, calificaciones=0)
+    respuesta = _editar(cliente, "jefe", "E99999")
+    assert respuesta.status_code == 404 and respuesta.json()["detail"] == "Estudiante no encontrado"
+    # Un staff tampoco es un estudiante al que se le puedan poner calificaciones
+    assert _editar(cliente, "jefe", "S00000").status_code == 404
+
+def test_errores_por_fila_se_devuelven_tal_cual(cliente, sembrar, monkeypatch):
+    sembrar(0, 1, calificaciones=0)
+    error = {"fila": 2, "matricula": "E00000", "error": "Calificación inválida"}
+    monkeypatch.setattr(crud, "actualizar_calificaciones_lote", lambda db, registros, modificador: {"actualizadas": 4, "errores": [error]})
+    respuesta = _editar(cliente, "jefe", "E00000")
+    assert respuesta.status_code == 400 and respuesta.json()["detail"] == [error]
+
+def test_cifrado_y_calificaciones_no_ocupan_el_event_loop(cliente, llave, sembrar, subir, monkeypatch):
+    """El trabajo de CPU de los handlers async corre en el pool de hilos, nunca en el hilo del event loop."""
+    llamadas = []
+
+    def registrar(modulo, nombre):
+        original = getattr(modulo, nombre)
+
+        def envoltura(*args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+                llamadas.append((nombre, "event loop"))
+            except RuntimeError:
+                llamadas.append((nombre, "hilo"))
+            return original(*args, **kwargs)
+        monkeypatch.setattr(modulo, nombre, envoltura)
+    for modulo, nombre in ((cifrado, "_cifrar_segmento"), (cifrado, "_descifrar_segmento"),
+                           (crud, "cifrar_y_guardar"), (crud, "accesos_documento"),
+                           (crud, "actualizar_calificaciones_lote")):
+        registrar(modulo, nombre)
+
+    sembrar(0, 1, calificaciones=0)
+    id_documento = subir("E00000", PDF)
+    descarga = cliente.post(f"/jefe/dashboard/descargarDocumento/{id_documento}",
+                            files={"llave_simetrica": ("llave.txt", base64.b64encode(llave))})
+    assert descarga.content == PDF
+    assert _editar(cliente, "jefe", "E00000").status_code == 303
+
+    assert {nombre for nombre, _ in llamadas} == {"_cifrar_segmento", "_descifrar_segmento", "cifrar_y_guardar",
+                                                  "accesos_documento", "actualizar_calificaciones_lote"}
+    assert [llamada for llamada in llamadas if llamada[1] == "event loop"] == []
@@ -0,0 +1,110 @@
+import threading
+import pytest
+from sqlalchemy import func
+from app.basedatos import SesionLocal
+from app.crud import actualizar_calificaciones_lote
+from app.modelos import Estadistica_Calificacion, Historial_Academico, Usuario
+
+MATERIAS = ("Física", "Química", "Cálculo")
+
+def _totales(db, tabla, conteo, suma) -> dict:
+    return {materia: (n, round(s or 0, 6)) for materia, n, s in
+            db.query(tabla.materia, conteo, suma).group_by(tabla.materia).all()}
+
+def test_lotes_concurrentes_no_desvian_los_agregados(bd, sembrar):
+    sembrar(0, 3, documentos=0, calificaciones=0, staff=False)
+    with SesionLocal() as db:
+        jefe = db.query(Usuario).filter(Usuario.rol == "jefe").one()
+    errores = []
+
+    def editar(hilo: int):
+        db = SesionLocal()
+        try:
+            for i in range(25):
+                # Todos los hilos pisan las mismas filas; las primeras veces, además, las crean a la vez
+                registros = [{"matricula": f"E{e:05d}", "materia": materia, "calificacion": str((hilo + i + e) % 11)}
+                             for e in range(3) for materia in MATERIAS]
+                actualizar_calificaciones_lote(db, registros, jefe)
+        except Exception as error:
+            errores.append(error)
+        finally:
+            db.close()
+
+    hilos = [threading.Thread(target=editar, args=(h,)) for h in range(4)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    assert errores == []
+
+    H, E = Historial_Academico, Estadistica_Calificacion
+    with SesionLocal() as db:
+        esperados = _totales(db, H, func.count(H.calificacion_numerica), func.sum(H.calificacion_numerica))
+        agregados = _totales(db, E, func.sum(E.conteo), func.sum(E.suma))
+    assert esperados == {materia: (3, esperados[materia][1]) for materia in MATERIAS}
+    assert agregados == esperados
+
+def _cargar(cliente, *registros) -> dict:
+    calificaciones = [{"matricula": m, "materia": materia, "calificacion": c} for m, materia, c in registros]
+    respuesta = cliente.post("/jefe/calificaciones", json={"calificaciones": calificaciones})
+    assert respuesta.status_code == 200, respuesta.text
+    return respuesta.json()
+
+def _historial(db) -> dict:
+    H = Historial_Academico
+    return {(m, materia): c for m, materia, c in
+            db.query(Usuario.matricula, H.materia, H.calificacion).join(Usuario, Usuario.id == H.id_estudiante)}
+
+def _agregados_coinciden(db) -> bool:
+    H, E = Historial_Academico, Estadistica_Calificacion
+    return (_totales(db, H, func.count(H.calificacion_numerica), func.sum(H.calificacion_numerica))
+            == _totales(db, E, func.sum(E.conteo), func.sum(E.suma)))
+
+def test_fila_existente_se_actualiza_sin_duplicarse(cliente, sembrar):
+    sembrar(0, 1, documentos=0, calificaciones=2, staff=False)
+    assert _cargar(cliente, ("E00000", "Materia 0", "9")) == {"actualizadas": 1, "errores": []}
+    with SesionLocal() as db:
+        assert _historial(db) == {("E00000", "Materia 0"): "9", ("E00000", "Materia 1"): "8"}
+        assert _agregados_coinciden(db)
+
+def test_materia_repetida_en_un_lote_gana_la_ultima(cliente, sembrar):
+    sembrar(0, 1, documentos=0, calificaciones=0, staff=False)
+    resultado = _cargar(cliente, ("E00000", "Física", "5"), ("E00000", "Química", "6"), ("E00000", "Física", "7"))
+    assert resultado == {"actualizadas": 2, "errores": []}
+    with SesionLocal() as db:
+        assert _historial(db) == {("E00000", "Física"): "7", ("E00000", "Química"): "6"}
+        assert _agregados_coinciden(db)
+
+def test_matricula_desconocida_reporta_su_fila(cliente, sembrar):
+    sembrar(0, 1, documentos=0, calificaciones=0, staff=False)
+    resultado = _cargar(cliente, ("E00000", "Física", "5"), ("E99999", "Física", "6"), ("E00000", "Química", "7"))
+    assert resultado["actualizadas"] == 2
+    assert resultado["errores"] == [{"fila": 2, "matricula": "E99999", "error": "Estudiante no encontrado"}]
+
+def test_errores_del_csv_reportan_su_linea(cliente, sembrar):
+    sembrar(0, 1, documentos=0, calificaciones=0, staff=False)
+    csv = ("matricula,materia,semestre,calificacion\n"
+           "E00000,Física,,5\n"
+           "E00000,Química,,\n"
+           "E99999,Física,,6\n"
+           "E00000,Cálculo,,7\n")
+    respuesta = cliente.post("/jefe/calificaciones/csv", files={"archivo": ("calificaciones.csv", csv.encode())})
+    assert respuesta.status_code == 200, respuesta.text
+    resultado = respuesta.json()
+    assert resultado["actualizadas"] == 2
+    # La línea 1 es el encabezado: el error de validación y el de la base señalan la línea del archivo
+    assert sorted((e["fila"], e["matricula"]) for e in resultado["errores"]) == [(3, "E00000"), (4, "E99999")]
+
+@pytest.mark.parametrize("estudiantes", [120, 260])
+def test_lotes_de_mas_de_500_filas(cliente, sembrar, estudiantes):
+    sembrar(0, estudiantes, documentos=0, calificaciones=1, staff=False)
+    registros = [(f"E{e:05d}", f"Materia {m}", str((e + m) % 11)) for e in range(estudiantes) for m in range(5)]
+    registros.insert(550, ("E99999", "Materia 0", "9"))
+    resultado = _cargar(cliente, *registros)
+    assert resultado["actualizadas"] == len(registros) - 1
+    assert resultado["errores"] == [{"fila": 551, "matricula": "E99999", "error": "Estudiante no encontrado"}]
+    with SesionLocal() as db:
+        # "Materia 0" ya existía para cada estudiante: se actualizó en lugar de duplicarse
+        assert db.query(Historial_Academico).count() == estudiantes * 5
+        assert _historial(db) == {(m, materia): c for m, materia, c in registros if m != "E99999"}
+        assert _agregados_coinciden(db)
@@ -0,0 +1,97 @@
+import base64
+import os
+import pytest
+from app.cifrado import (TAMANO_CABECERA, TAMANO_NONCE, TAMANO_TAG, cifrar_segmentado, cifrar_chacha20_poly1305,
+                         decodificar_llave, desplazamiento_rango, descifrar_documento, descifrar_rango,
+                         generar_clave_chacha, tamano_claro)
+
+# Segmentos pequeños para cubrir varios con pocos bytes
+SEGMENTO = 64
+
+def _cifrar(datos: bytes, llave: bytes) -> bytes:
+    # Bloques de tamaño distinto al segmento: el cifrado no debe depender de cómo llegan los datos
+    return b"".join(cifrar_segmentado((datos[i:i + 10] for i in range(0, len(datos), 10)), llave, SEGMENTO))
+
+def _partir(cifrado: bytes):
+    """Cabecera y lista de segmentos cifrados."""
+    cuerpo = cifrado[TAMANO_CABECERA:]
+    paso = SEGMENTO + TAMANO_TAG
+    return cifrado[:TAMANO_CABECERA], [cuerpo[i:i + paso] for i in range(0, len(cuerpo), paso)]
+
+def _descifrar(cifrado: bytes, llave: bytes) -> bytes:
+    return b"".join(descifrar_documento((cifrado[i:i + 7] for i in range(0, len(cifrado), 7)), llave))
+
+@pytest.mark.parametrize("tamano", [0, 1, SEGMENTO, SEGMENTO + 1, 5 * SEGMENTO, 5 * SEGMENTO + 13])
+def test_ida_y_vuelta(tamano):
+    llave, datos = generar_clave_chacha(), os.urandom(tamano)
+    cifrado = _cifrar(datos, llave)
+    assert _descifrar(cifrado, llave) == datos
+    assert tamano_claro(cifrado[:TAMANO_CABECERA], len(cifrado)) == tamano
+
+def test_llave_incorrecta_se_rechaza():
+    cifrado = _cifrar(os.urandom(3 * SEGMENTO), generar_clave_chacha())
+    with pytest.raises(ValueError):
+        _descifrar(cifrado, generar_clave_chacha())
+
+@pytest.mark.parametrize("tamano", [3 * SEGMENTO, 3 * SEGMENTO + 5])
+def test_archivo_truncado_se_rechaza(tamano):
+    llave = generar_clave_chacha()
+    cabecera, segmentos = _partir(_cifrar(os.urandom(tamano), llave))
+    # Sin el último segmento el penúltimo no está marcado como final
+    with pytest.raises(ValueError):
+        _descifrar(cabecera + b"".join(segmentos[:-1]), llave)
+
+def test_segmentos_reordenados_se_rechazan():
+    llave = generar_clave_chacha()
+    cabecera, segmentos = _partir(_cifrar(os.urandom(4 * SEGMENTO + 1), llave))
+    segmentos[0], segmentos[1] = segmentos[1], segmentos[0]
+    with pytest.raises(ValueError):
+        _descifrar(cabecera + b"".join(segmentos), llave)
+
+@pytest.mark.parametrize("indice", [0, -1])
+def test_tag_alterado_se_rechaza(indice):
+    llave = generar_clave_chacha()
+    cabecera, segmentos = _partir(_cifrar(os.urandom(3 * SEGMENTO + 7), llave))
+    segmento = bytearray(segmentos[indice])
+    segmento[-1] ^= 1
+    segmentos[indice] = bytes(segmento)
+    with pytest.raises(ValueError):
+        _descifrar(cabecera + b"".join(segmentos), llave)
+
+def test_cabecera_alterada_se_rechaza():
+    llave = generar_clave_chacha()
+    cifrado = bytearray(_cifrar(os.urandom(2 * SEGMENTO), llave))
+    # El tamaño de segmento y el prefijo son datos asociados de cada segmento
+    cifrado[TAMANO_CABECERA - 1] ^= 1
+    with pytest.raises(ValueError):
+        _descifrar(bytes(cifrado), llave)
+
+@pytest.mark.parametrize("inicio, fin", [
+    (0, 0), (0, SEGMENTO - 1), (SEGMENTO - 1, SEGMENTO), (SEGMENTO, 2 * SEGMENTO - 1),
+    (SEGMENTO, SEGMENTO), (2 * SEGMENTO - 1, 4 * SEGMENTO), (4 * SEGMENTO, 4 * SEGMENTO + 9),
+])
+def test_rangos_en_los_bordes_de_segmento(inicio, fin):
+    llave, datos = generar_clave_chacha(), os.urandom(4 * SEGMENTO + 10)
+    cifrado = _cifrar(datos, llave)
+    cabecera = cifrado[:TAMANO_CABECERA]
+    segmento, desplazamiento = desplazamiento_rango(cabecera, inicio)
+    assert segmento == inicio // SEGMENTO
+    resto = cifrado[desplazamiento:]
+    partes = descifrar_rango((resto[i:i + 11] for i in range(0, len(resto), 11)), llave, cabecera, inicio, fin)
+    assert b"".join(partes) == datos[inicio:fin + 1]
+
+def test_formato_anterior_de_un_solo_bloque():
+    llave, datos = generar_clave_chacha(), os.urandom(1000)
+    nonce, cifrado, tag = cifrar_chacha20_poly1305(datos, llave)
+    assert len(nonce) == TAMANO_NONCE
+    assert _descifrar(nonce + tag + cifrado, llave) == datos
+    with pytest.raises(ValueError):
+        _descifrar(nonce + bytes([tag[0] ^ 1]) + tag[1:] + cifrado, llave)
+
+def test_decodificar_llave_en_base64_o_en_crudo():
+    llave = generar_clave_chacha()
+    assert decodificar_llave(base64.b64encode(llave)) == llave
+    # Archivo descargado y guardado con salto de línea final
+    assert decodificar_llave(base64.b64encode(llave) + b"\n") == llave
+    crudo = b"\xff" + llave[1:]
+    assert decodificar_llave(crudo) == crudo
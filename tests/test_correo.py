@@ -0,0 +1,114 @@
+import socket
+from datetime import timedelta
+import pytest
+from aiosmtpd.controller import Controller
+from sqlalchemy import update
+from app import correo
+from app.basedatos import SesionLocal
+from app.correo import ConexionSMTP, DespachadorCorreo, encolar_correo, _ahora
+from app.modelos import Correo_Pendiente
+
+class Buzon:
+    """Servidor SMTP en proceso que guarda los mensajes o rechaza los próximos `rechazar`."""
+
+    def __init__(self):
+        self.mensajes = []
+        self.rechazar = 0
+
+    async def handle_DATA(self, servidor, sesion, sobre):
+        if self.rechazar:
+            self.rechazar -= 1
+            return "451 Intente más tarde"
+        self.mensajes.append(sobre)
+        return "250 OK"
+
+@pytest.fixture
+def buzon(bd, monkeypatch):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        puerto = s.getsockname()[1]
+    buzon = Buzon()
+    controlador = Controller(buzon, hostname="127.0.0.1", port=puerto)
+    controlador.start()
+    for variable, valor in {"Servidor_SMTP": "127.0.0.1", "Puerto_SMTP": str(puerto), "TLS_SMTP": "0",
+                            "Usuario_SMTP": "", "Contrasena_SMTP": "", "Remitente_SMTP": "plataforma@prueba.mx"}.items():
+        monkeypatch.setenv(variable, valor)
+    yield buzon
+    controlador.stop()
+
+@pytest.fixture
+def conexion(buzon):
+    conexion = ConexionSMTP()
+    yield conexion
+    conexion.cerrar()
+
+def _encolar(destinatario: str, **extra) -> int:
+    with SesionLocal() as db:
+        return encolar_correo(db, destinatario=destinatario, asunto="Registro de Estudiante", cuerpo="Hola", **extra).id
+
+def _correo(id_correo: int) -> Correo_Pendiente:
+    with SesionLocal() as db:
+        return db.get(Correo_Pendiente, id_correo)
+
+def _vencer(id_correo: int):
+    # Adelanta el reloj del reintento en lugar de esperar la espera exponencial
+    with SesionLocal() as db:
+        db.execute(update(Correo_Pendiente).where(Correo_Pendiente.id == id_correo)
+                   .values(siguiente_intento=_ahora() - timedelta(seconds=1)))
+        db.commit()
+
+def test_entrega_y_marca_enviado(buzon, conexion):
+    id_correo = _encolar("ana@prueba.mx", adjunto=b"%PDF", nombre_adjunto="acta.pdf")
+    despachador = DespachadorCorreo(hilos=1)
+    assert despachador.procesar_lote(conexion) == 1
+
+    assert len(buzon.mensajes) == 1
+    assert buzon.mensajes[0].mail_from == "plataforma@prueba.mx"
+    assert buzon.mensajes[0].rcpt_tos == ["ana@prueba.mx"]
+    assert b'filename="acta.pdf"' in buzon.mensajes[0].content
+    enviado = _correo(id_correo)
+    assert enviado.estado == "enviado" and enviado.adjunto is None and despachador.enviados == 1
+    # Nada más que enviar
+    assert despachador.procesar_lote(conexion) == 0
+
+def test_reintenta_con_espera_exponencial_y_luego_falla(buzon, conexion, monkeypatch):
+    monkeypatch.setattr(correo, "MAX_INTENTOS", 3)
+    buzon.rechazar = 3
+    id_correo = _encolar("beto@prueba.mx")
+    despachador = DespachadorCorreo(hilos=1)
+
+    antes = _ahora()
+    assert despachador.procesar_lote(conexion) == 1
+    pendiente = _correo(id_correo)
+    assert (pendiente.estado, pendiente.intentos) == ("pendiente", 1)
+    assert "451" in pendiente.ultimo_error
+    assert pendiente.siguiente_intento >= antes + timedelta(seconds=correo.ESPERA_BASE)
+    # Antes de que venza la espera no se reintenta
+    assert despachador.procesar_lote(conexion) == 0
+
+    _vencer(id_correo)
+    antes = _ahora()
+    assert despachador.procesar_lote(conexion) == 1
+    pendiente = _correo(id_correo)
+    assert pendiente.intentos == 2
+    assert pendiente.siguiente_intento >= antes + timedelta(seconds=2 * correo.ESPERA_BASE)
+
+    _vencer(id_correo)
+    assert despachador.procesar_lote(conexion) == 1
+    fallido = _correo(id_correo)
+    assert (fallido.estado, fallido.intentos) == ("fallido", 3)
+    assert despachador.fallidos == 1 and buzon.mensajes == []
+    # Un correo fallido ya no se reclama
+    _vencer(id_correo)
+    assert despachador.procesar_lote(conexion) == 0
+
+def test_se_recupera_tras_un_fallo(buzon, conexion):
+    buzon.rechazar = 1
+    id_correo = _encolar("carla@prueba.mx")
+    despachador = DespachadorCorreo(hilos=1)
+    despachador.procesar_lote(conexion)
+    _vencer(id_correo)
+    assert despachador.procesar_lote(conexion) == 1
+    enviado = _correo(id_correo)
+    assert (enviado.estado, enviado.intentos) == ("enviado", 1)
+    assert [m.rcpt_tos for m in buzon.mensajes] == [["carla@prueba.mx"]]
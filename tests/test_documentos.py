@@ -0,0 +1,75 @@
+import base64
+import os
+import pytest
+from sqlalchemy import update
+from app import almacen
+from app.auth import servicio_hash
+from app.basedatos import SesionLocal
+from app.modelos import Usuario
+
+PDF = os.urandom(300 * 1024)
+
+@pytest.fixture
+def subir_pdf(subir):
+    return lambda matricula: subir(matricula, PDF)
+
+@pytest.fixture
+def bytes_leidos(monkeypatch):
+    """Bytes que se leen del almacén de blobs."""
+    leidos = [0]
+    disco = almacen.obtener_almacen()
+    original = disco.leer_bloques
+
+    def leer_bloques(*args, **kwargs):
+        for bloque in original(*args, **kwargs):
+            leidos[0] += len(bloque)
+            yield bloque
+    monkeypatch.setattr(disco, "leer_bloques", leer_bloques)
+    return leidos
+
+def _descargar(cliente, id_documento: int, llave: bytes, **encabezados):
+    return cliente.post(f"/jefe/dashboard/descargarDocumento/{id_documento}", headers=encabezados,
+                        files={"llave_simetrica": ("llave.txt", base64.b64encode(llave))})
+
+def test_costo_de_una_descarga_no_depende_del_catalogo(cliente, llave, sembrar, subir_pdf, contar_consultas, bytes_leidos):
+    sembrar(0, 2, staff=False)
+    id_documento = subir_pdf("E00000")
+    assert _descargar(cliente, id_documento, llave).content == PDF
+
+    costos = []
+    for desde, hasta in ((2, 5), (5, 50)):
+        sembrar(desde, hasta, documentos=4, staff=False)
+        bytes_leidos[0] = 0
+        with contar_consultas() as consultas:
+            respuesta = _descargar(cliente, id_documento, llave, Range="bytes=1000-1999")
+        assert respuesta.status_code == 206 and respuesta.content == PDF[1000:2000]
+        costos.append((len(consultas), bytes_leidos[0]))
+    assert costos[0] == costos[1]
+    # Un rango lee solo los segmentos que lo cubren, no el blob completo
+    assert costos[0][1] < len(PDF) // 2
+
+def test_descarga_repetida_responde_304(cliente, llave, sembrar, subir_pdf):
+    sembrar(0, 1, staff=False)
+    id_documento = subir_pdf("E00000")
+    etag = _descargar(cliente, id_documento, llave).headers["ETag"]
+    assert _descargar(cliente, id_documento, llave, **{"If-None-Match": etag}).status_code == 304
+
+def test_un_estudiante_no_descarga_documentos_ajenos(iniciar_sesion, llave, sembrar, subir_pdf):
+    sembrar(0, 2, documentos=0, staff=False)
+    propio, ajeno = subir_pdf("E00000"), subir_pdf("E00001")
+    with SesionLocal() as db:
+        db.execute(update(Usuario).where(Usuario.matricula == "E00000").values(contraseña=servicio_hash.hasher.hash("Clave123!")))
+        db.commit()
+    estudiante = iniciar_sesion("E00000", "Clave123!")
+    assert _descargar(estudiante, propio, llave).content == PDF
+    respuesta = _descargar(estudiante, ajeno, llave)
+    assert respuesta.status_code == 404
+    # Igual que un id inexistente: no revela que el documento existe
+    assert respuesta.json() == _descargar(estudiante, ajeno + 1000, llave).json()
+
+def test_subida_con_llave_de_otro_tamano_se_rechaza(cliente, llave, sembrar):
+    sembrar(0, 1, documentos=0, staff=False)
+    respuesta = cliente.post("/jefe/dashboard/subirDocumento", data={"matricula": "E00000", "tipo": "acta"},
+                             files={"documento": ("acta.pdf", PDF), "llave_simetrica": ("llave.txt", base64.b64encode(llave[:16]))})
+    assert respuesta.status_code == 400
+    assert respuesta.json()["detail"] == "La llave simétrica debe ser de 32 bytes"
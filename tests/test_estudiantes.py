@@ -0,0 +1,57 @@
+import pytest
+from sqlalchemy import update
+from app.auth import servicio_hash
+from app.basedatos import SesionLocal
+from app.modelos import Historial_Academico, Usuario
+
+@pytest.fixture
+def staff(iniciar_sesion, sembrar):
+    """Sesión de S00000; también siembra a su estudiante E00000."""
+    sembrar(0, 1, calificaciones=1)
+    with SesionLocal() as db:
+        db.execute(update(Usuario).where(Usuario.matricula == "S00000").values(contraseña=servicio_hash.hasher.hash("Clave123!")))
+        db.commit()
+    return iniciar_sesion("S00000", "Clave123!")
+
+def _recorrer(cliente, ruta: str, **filtros) -> tuple:
+    """Matrículas de todas las páginas siguiendo `siguiente`, y cuántas páginas hubo."""
+    matriculas, paginas, despues_de = [], 0, None
+    while True:
+        parametros = dict(filtros, **({"despues_de": despues_de} if despues_de is not None else {}))
+        respuesta = cliente.get(ruta, params=parametros)
+        assert respuesta.status_code == 200, respuesta.text
+        pagina = respuesta.json()
+        paginas += 1
+        matriculas += [e["matricula"] for e in pagina["estudiantes"]]
+        despues_de = pagina["siguiente"]
+        if despues_de is None:
+            return matriculas, paginas
+
+@pytest.mark.parametrize("total", [20, 23])
+@pytest.mark.parametrize("ruta", ["/staff/estudiantes", "/jefe/estudiantes"])
+def test_recorrer_todas_las_paginas(staff, cliente, sembrar, total, ruta):
+    # Staff intercalado: los ids de los estudiantes no son consecutivos
+    sembrar(1, total, calificaciones=1)
+    matriculas, paginas = _recorrer(staff if ruta.startswith("/staff") else cliente, ruta, limite=5)
+    assert matriculas == [f"E{i:05d}" for i in range(total)]
+    # Con un múltiplo exacto del límite no queda una página vacía al final
+    assert paginas == -(-total // 5)
+
+def test_filtros_de_calificacion_con_paginacion(staff, sembrar):
+    sembrar(1, 30, calificaciones=1)
+    with SesionLocal() as db:
+        for id_estudiante, matricula in db.query(Usuario.id, Usuario.matricula).filter(Usuario.rol == "estudiante"):
+            valor = int(matricula[1:]) % 11
+            db.execute(update(Historial_Academico).where(Historial_Academico.id_estudiante == id_estudiante)
+                       .values(calificacion=str(valor), calificacion_numerica=float(valor)))
+        db.commit()
+
+    def esperadas(minimo, maximo):
+        return [f"E{i:05d}" for i in range(30) if minimo <= i % 11 <= maximo]
+    matriculas, paginas = _recorrer(staff, "/staff/estudiantes", limite=4, calificacion_min="5", calificacion_max="8")
+    assert matriculas == esperadas(5, 8) and paginas == 3
+    # Comparación numérica: como texto, "10" sería menor que "9" y quedaría fuera
+    matriculas, _ = _recorrer(staff, "/staff/estudiantes", limite=2, calificacion_min="9")
+    assert matriculas == esperadas(9, 10)
+    matriculas, _ = _recorrer(staff, "/staff/estudiantes", limite=3, calificacion_max="2")
+    assert matriculas == esperadas(0, 2)
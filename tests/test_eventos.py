@@ -0,0 +1,165 @@
+import asyncio
+import json
+import threading
+from datetime import datetime
+from app import eventos, versiones
+from app.basedatos import SesionLocal
+from app.eventos import DifusorEventos, podar, ultimo_evento
+from app.modelos import Evento_Cambio, Usuario
+
+class _Peticion:
+    """Lo único que usan respuesta_eventos y el flujo de una Request de Starlette."""
+
+    def __init__(self, encabezados: dict = None):
+        self.headers = encabezados or {}
+
+    async def is_disconnected(self):
+        return False
+
+def _cambiar(*estudiantes, staff: bool = False) -> int:
+    """Registra un cambio como lo haría una escritura y devuelve el id de su último evento."""
+    with SesionLocal() as db:
+        versiones.incrementar(db, *(("staff",) if staff else ()), estudiantes=estudiantes)
+        db.commit()
+        return ultimo_evento(db)
+
+def _estudiantes(sembrar) -> list:
+    sembrar(0, 3, documentos=0, staff=False)
+    with SesionLocal() as db:
+        return [id_ for id_, in db.query(Usuario.id).filter(Usuario.rol == "estudiante").order_by(Usuario.id)]
+
+def _mensaje(crudo: bytes) -> dict:
+    campos = dict(linea.split(": ", 1) for linea in crudo.decode().strip().split("\n"))
+    return {"id": int(campos["id"]), "event": campos["event"], "data": json.loads(campos["data"])}
+
+async def _leer(flujo, cuantos: int) -> list:
+    """Los siguientes `cuantos` eventos del flujo, sin el `retry:` inicial."""
+    mensajes = []
+    while len(mensajes) < cuantos:
+        crudo = await asyncio.wait_for(flujo.__anext__(), timeout=5)
+        if not crudo.startswith(b"retry:"):
+            mensajes.append(_mensaje(crudo))
+    return mensajes
+
+def test_reanuda_desde_last_event_id_sin_repetir_estudiantes(bd, sembrar, monkeypatch):
+    a, b, _ = _estudiantes(sembrar)
+    visto = _cambiar(a)
+    _cambiar(b)
+    ultimo = _cambiar(a)
+    monkeypatch.setattr(eventos, "difusor", DifusorEventos(intervalo=60))
+
+    async def reanudar():
+        respuesta = eventos.respuesta_eventos(_Peticion({"last-event-id": str(visto)}), {"estudiante"}, desde=0)
+        try:
+            return await _leer(respuesta.body_iterator, 2)
+        finally:
+            await respuesta.body_iterator.aclose()
+            await eventos.difusor.detener()
+    mensajes = asyncio.run(reanudar())
+    # `a` cambió dos veces: se envía una sola vez, con el id de su último evento y su fila actual
+    assert [(m["id"], m["data"]["id"]) for m in mensajes] == [(visto + 1, b), (ultimo, a)]
+    assert all(m["event"] == "estudiante" and "Estudiante" in m["data"]["html"] for m in mensajes)
+
+def test_eventos_ya_enviados_no_se_repiten(bd, sembrar):
+    a, b, _ = _estudiantes(sembrar)
+    desde = _cambiar(a) - 1
+    difusor = DifusorEventos(intervalo=60)
+
+    async def transmitir():
+        flujo = difusor.transmitir(_Peticion(), {"estudiante"}, desde)
+        try:
+            pendiente, = await _leer(flujo, 1)
+            # El difusor lee el mismo evento que la conexión ya envió al reanudar, y uno nuevo
+            nuevo = _cambiar(b)
+            suscriptor, = difusor.suscriptores
+            suscriptor.entregar([(pendiente["id"], "estudiante", json.dumps(pendiente["data"])),
+                                 (nuevo, "estudiante", json.dumps({"id": b, "html": None}))])
+            return pendiente, await _leer(flujo, 1), nuevo
+        finally:
+            await flujo.aclose()
+    pendiente, siguientes, nuevo = asyncio.run(transmitir())
+    assert pendiente["id"] == desde + 1
+    assert [m["id"] for m in siguientes] == [nuevo]
+
+def test_suscriptor_desbordado_se_desconecta(bd, monkeypatch):
+    monkeypatch.setattr(eventos, "BUFFER_EVENTOS", 2)
+    difusor = DifusorEventos(intervalo=60)
+
+    async def transmitir():
+        flujo = difusor.transmitir(_Peticion(), {"staff"}, None)
+        recibidos = [await flujo.__anext__()]
+        suscriptor, = difusor.suscriptores
+        suscriptor.entregar([(i, "staff", "{}") for i in range(100, 105)])
+        # Entrega lo que cabía en la cola y cierra en lugar de bloquear al difusor o saltarse eventos
+        recibidos += [mensaje async for mensaje in flujo]
+        return recibidos
+    recibidos = asyncio.run(transmitir())
+    assert [_mensaje(m)["id"] for m in recibidos[1:]] == [100, 101]
+    assert difusor.desconectados == 1 and not difusor.suscriptores
+
+def test_reanudar_despues_de_la_poda_pide_recargar(bd, sembrar):
+    a, b, c = _estudiantes(sembrar)
+    visto = _cambiar(a)
+    _cambiar(b)
+    ultimo = _cambiar(c)
+    with SesionLocal() as db:
+        db.query(Evento_Cambio).update({Evento_Cambio.creado: datetime(2000, 1, 1)})
+        db.commit()
+        # Se conserva siempre el último evento
+        assert podar(db) == ultimo - 1
+    difusor = DifusorEventos(intervalo=60)
+
+    async def reanudar(desde):
+        flujo = difusor.transmitir(_Peticion(), {"estudiante"}, desde)
+        try:
+            return await _leer(flujo, 1)
+        finally:
+            await flujo.aclose()
+    # Lo posterior a `visto` ya no existe: la página se recarga en lugar de quedar incompleta
+    assert asyncio.run(reanudar(visto)) == [{"id": visto, "event": "recargar", "data": {}}]
+    # Desde el evento anterior al conservado no falta nada
+    assert [m["id"] for m in asyncio.run(reanudar(ultimo - 1))] == [ultimo]
+
+def test_demasiados_eventos_pendientes_piden_recargar(bd, sembrar, monkeypatch):
+    estudiantes = _estudiantes(sembrar)
+    desde = _cambiar(estudiantes[0])
+    for id_estudiante in estudiantes:
+        _cambiar(id_estudiante)
+    monkeypatch.setattr(eventos, "MAXIMO_REANUDAR", 2)
+    difusor = DifusorEventos(intervalo=60)
+
+    async def reanudar():
+        flujo = difusor.transmitir(_Peticion(), {"estudiante"}, desde)
+        try:
+            return await _leer(flujo, 1)
+        finally:
+            await flujo.aclose()
+    assert asyncio.run(reanudar())[0]["event"] == "recargar"
+
+def test_eventos_se_confirman_en_orden_de_id(bd, sembrar):
+    # Leer por `id > desde` solo es seguro si un id no se vuelve visible antes que los anteriores.
+    # En PostgreSQL lo garantiza el candado de versiones.incrementar; en SQLite, el único escritor.
+    a, b, _ = _estudiantes(sembrar)
+    primera = SesionLocal()
+    versiones.incrementar(primera, estudiantes=[a])
+    segunda_termino = threading.Event()
+
+    def segunda():
+        _cambiar(b)
+        segunda_termino.set()
+    hilo = threading.Thread(target=segunda)
+    hilo.start()
+    try:
+        # Mientras la primera transacción no confirma, la segunda no puede registrar su evento
+        assert not segunda_termino.wait(0.5)
+        with SesionLocal() as lector:
+            visibles = [id_ for id_, in lector.query(Evento_Cambio.id).filter(Evento_Cambio.tipo == "estudiante")]
+        assert visibles == []
+        primera.commit()
+        assert segunda_termino.wait(10)
+    finally:
+        primera.close()
+        hilo.join()
+    with SesionLocal() as db:
+        registrados = db.query(Evento_Cambio.id, Evento_Cambio.id_usuario).filter(Evento_Cambio.tipo == "estudiante").order_by(Evento_Cambio.id).all()
+    assert [id_usuario for _, id_usuario in registrados] == [a, b]
@@ -0,0 +1,68 @@
+import base64
+import io
+import os
+import zipfile
+import pytest
+from app import importacion
+from app.basedatos import SesionLocal
+from app.modelos import Documento, Usuario
+
+PDF = os.urandom(30 * 1024)
+
+class _EjecutorInmediato:
+    def submit(self, funcion, *args):
+        funcion(*args)
+
+@pytest.fixture
+def importar(cliente, llave, monkeypatch):
+    """Importa el CSV y los PDFs dados en la misma petición y devuelve el estado final."""
+    monkeypatch.setattr(importacion, "_ejecutor", _EjecutorInmediato())
+
+    def importar(filas: list, pdfs: dict, llave_simetrica: bytes = llave) -> dict:
+        lista = "nombre,correo,matricula,telefono,documento\n" + "".join(",".join(fila) + "\n" for fila in filas)
+        zip_ = io.BytesIO()
+        with zipfile.ZipFile(zip_, "w") as archivo:
+            for nombre, contenido in pdfs.items():
+                archivo.writestr(f"pdfs/{nombre}", contenido)
+        respuesta = cliente.post("/jefe/dashboard/importarEstudiantes",
+                                 files={"lista": ("lista.csv", lista.encode()), "documentos": ("docs.zip", zip_.getvalue()),
+                                        "llave_simetrica": ("llave.txt", base64.b64encode(llave_simetrica))})
+        if respuesta.status_code != 200:
+            return respuesta
+        return cliente.get(f"/jefe/importaciones/{respuesta.json()['id']}").json()
+    return importar
+
+def test_importacion_aisla_las_filas_con_error(cliente, llave, sembrar, importar):
+    sembrar(0, 1, documentos=0, staff=False)
+    estado = importar([
+        ("Ana", "ana@prueba.mx", "I00001", "5512345678", "ana.pdf"),
+        ("Beto", "beto@prueba.mx", "I00002", "55-ABC", "ana.pdf"),
+        ("Carla", "", "I00003", "5512345678", "ana.pdf"),
+        ("Dora", "dora@prueba.mx", "I00004", "5512345678", "falta.pdf"),
+        ("Eva", "eva@prueba.mx", "I00001", "5512345678", "eva.pdf"),
+        ("Fer", "fer@prueba.mx", "E00000", "5512345678", "eva.pdf"),
+        ("Gil", "gil@prueba.mx", "I00007", "5512345678", "eva.pdf"),
+    ], {"ana.pdf": PDF, "eva.pdf": PDF[::-1]})
+
+    assert (estado["estado"], estado["total"], estado["procesados"], estado["exitosos"]) == ("terminado", 7, 7, 2)
+    # La línea 1 del CSV es el encabezado
+    assert [(e["fila"], e["matricula"], e["error"]) for e in estado["errores"]] == [
+        (3, "I00002", "Teléfono inválido"),
+        (4, "I00003", "Campos vacíos"),
+        (5, "I00004", "No se encontró falta.pdf en el ZIP"),
+        (6, "I00001", "Matrícula repetida o ya registrada"),
+        (7, "E00000", "Matrícula repetida o ya registrada"),
+    ]
+    with SesionLocal() as db:
+        importados = dict(db.query(Usuario.matricula, Documento.id).join(Documento, Documento.id_estudiante == Usuario.id)
+                          .filter(Usuario.matricula.like("I%")).all())
+    assert set(importados) == {"I00001", "I00007"}
+    descarga = cliente.post(f"/jefe/dashboard/descargarDocumento/{importados['I00007']}",
+                            files={"llave_simetrica": ("llave.txt", base64.b64encode(llave))})
+    assert descarga.content == PDF[::-1]
+
+def test_importacion_con_llave_de_otro_tamano_se_rechaza(importar):
+    # La longitud la valida crud.version_para_subir, igual que en las subidas individuales
+    respuesta = importar([("Ana", "ana@prueba.mx", "I00001", "5512345678", "ana.pdf")], {"ana.pdf": PDF}, os.urandom(16))
+    assert respuesta.status_code == 400
+    assert respuesta.json()["detail"] == "La llave simétrica debe ser de 32 bytes"
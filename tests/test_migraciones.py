@@ -0,0 +1,45 @@
+import pytest
+from sqlalchemy import inspect, select, text
+from app.migraciones import MIGRACIONES, _esquema_inicial, migrar, version_actual, version_esperada, version_esquema
+
+def _versiones(motor) -> list:
+    with motor.connect() as conexion:
+        return [v for (v,) in conexion.execute(select(version_esquema.c.version).order_by(version_esquema.c.version))]
+
+def test_migra_una_base_anterior_a_las_migraciones(backend):
+    # Base creada antes de version_esquema, con datos
+    with backend.motor.begin() as conexion:
+        _esquema_inicial().create_all(conexion)
+        conexion.execute(text("INSERT INTO usuarios (id, nombre, correo, matricula, rol, primer_login) "
+                              "VALUES (1, 'Ana', 'ana@x.com', '1001', 'estudiante', false)"))
+        conexion.execute(text("INSERT INTO estudiantes (id, telefono) VALUES (1, 55)"))
+        conexion.execute(text("INSERT INTO historiales (id, id_estudiante, semestre, materia, calificacion) "
+                              "VALUES (1, 1, '', 'Física', '8')"))
+
+    assert migrar(backend.motor) == [version for version, _, _ in MIGRACIONES]
+    assert _versiones(backend.motor) == list(range(1, version_esperada() + 1))
+    with backend.motor.connect() as conexion:
+        assert version_actual(conexion) == version_esperada()
+        tablas = set(inspect(conexion).get_table_names())
+        assert {"versiones_llave", "accesos_documento", "contadores_version", "eventos_cambios"} <= tablas
+        # Las columnas nuevas se llenan a partir de los datos existentes
+        assert conexion.execute(text("SELECT calificacion, calificacion_numerica FROM historiales")).all() == [("8", 8.0)]
+        assert conexion.execute(text("SELECT version FROM estudiantes WHERE id = 1")).scalar() == 1
+    # Volver a migrar no aplica nada
+    assert migrar(backend.motor) == []
+
+def test_migra_por_pasos(backend):
+    assert migrar(backend.motor, hasta=1) == [1]
+    with backend.motor.connect() as conexion:
+        assert version_actual(conexion) == 1
+    assert migrar(backend.motor) == list(range(2, version_esperada() + 1))
+    assert _versiones(backend.motor) == list(range(1, version_esperada() + 1))
+
+def test_los_workers_no_arrancan_con_una_base_atrasada(backend, monkeypatch):
+    from app import basedatos
+    monkeypatch.setattr(basedatos, "motor", backend.motor)
+    migrar(backend.motor, hasta=version_esperada() - 1)
+    with pytest.raises(RuntimeError, match="python -m app iniciar"):
+        basedatos.verificar_esquema()
+    migrar(backend.motor)
+    assert basedatos.verificar_esquema() == version_esperada()
@@ -0,0 +1,93 @@
+import base64
+import os
+import secrets
+from datetime import timedelta
+import pytest
+from app import recifrado
+from app.basedatos import SesionLocal
+from app.crud import resolver_version_llave
+from app.modelos import Documento, Recifrado
+
+PDF = os.urandom(20 * 1024)
+
+class _EjecutorInmediato:
+    """Ejecuta el recifrado dentro de la petición para revisar su resultado al volver."""
+
+    def submit(self, funcion, *args):
+        funcion(*args)
+
+class _Caida(BaseException):
+    """Simula que el proceso muere a mitad de un recifrado: ejecutar_recifrado no la atrapa."""
+
+@pytest.fixture
+def llave_nueva(bd) -> bytes:
+    llave = secrets.token_bytes(32)
+    with SesionLocal() as db:
+        resolver_version_llave(db, llave, registrar=True)
+    return llave
+
+@pytest.fixture
+def documentos(sembrar, subir) -> list:
+    sembrar(0, 1, documentos=0, staff=False)
+    return [subir("E00000", PDF, f"{i}.pdf") for i in range(3)]
+
+def _llaves(actual: bytes, nueva: bytes) -> dict:
+    return {"llave_actual": ("actual.txt", base64.b64encode(actual)), "llave_nueva": ("nueva.txt", base64.b64encode(nueva))}
+
+def _descargar(cliente, id_documento: int, llave: bytes):
+    return cliente.post(f"/jefe/dashboard/descargarDocumento/{id_documento}",
+                        files={"llave_simetrica": ("llave.txt", base64.b64encode(llave))})
+
+def test_recifrado_interrumpido_se_reanuda_sin_repetir_documentos(cliente, llave, llave_nueva, documentos, monkeypatch):
+    monkeypatch.setattr(recifrado, "_ejecutor", _EjecutorInmediato())
+    monkeypatch.setattr(recifrado, "LOTE_RECIFRADO", 1)
+    original = recifrado._reenvolver_documento
+    reenvueltos = []
+
+    def reenvolver(documento, *args):
+        if len(reenvueltos) == 2:
+            raise _Caida()
+        reenvueltos.append(documento.id)
+        return original(documento, *args)
+    monkeypatch.setattr(recifrado, "_reenvolver_documento", reenvolver)
+    with pytest.raises(_Caida):
+        cliente.post("/jefe/llaves/recifrar", files=_llaves(llave, llave_nueva))
+
+    with SesionLocal() as db:
+        trabajo = db.query(Recifrado).one()
+        assert (trabajo.estado, trabajo.procesados, trabajo.ultimo_id) == ("procesando", 2, documentos[1])
+        # Sin avances por más de SIN_AVANCE: su proceso murió
+        trabajo.actualizado -= recifrado.SIN_AVANCE + timedelta(seconds=1)
+        db.commit()
+        id_recifrado = trabajo.id
+    reenvueltos.append("reinicio")
+    respuesta = cliente.post(f"/jefe/llaves/recifrados/{id_recifrado}/reanudar", files=_llaves(llave, llave_nueva))
+    assert respuesta.status_code == 200, respuesta.text
+
+    # Retoma después del punto de control, en otra instancia que no se cae
+    assert reenvueltos == documentos[:2] + ["reinicio", documentos[2]]
+    estado = cliente.get(f"/jefe/llaves/recifrados/{id_recifrado}").json()
+    assert (estado["estado"], estado["procesados"], estado["fallidos"]) == ("terminado", 3, 0)
+    for id_documento in documentos:
+        assert _descargar(cliente, id_documento, llave_nueva).content == PDF
+        assert _descargar(cliente, id_documento, llave).status_code == 400
+
+def test_llave_actual_incorrecta_se_rechaza(cliente, llave, llave_nueva, documentos, monkeypatch):
+    monkeypatch.setattr(recifrado, "_ejecutor", _EjecutorInmediato())
+    respuesta = cliente.post("/jefe/llaves/recifrar", files=_llaves(secrets.token_bytes(32), llave_nueva))
+    assert respuesta.status_code == 400
+    assert "llave actual" in respuesta.json()["detail"]
+    with SesionLocal() as db:
+        assert db.query(Recifrado).count() == 0
+    assert all(_descargar(cliente, id_documento, llave).content == PDF for id_documento in documentos)
+
+def test_reenvolver_rechaza_llave_actual_incorrecta_y_envoltura_danada(llave, llave_nueva, documentos, monkeypatch):
+    with SesionLocal() as db:
+        documento = db.get(Documento, documentos[0])
+    contenido, error = recifrado._reenvolver_documento(documento, secrets.token_bytes(32), llave_nueva)
+    assert contenido is None and "Llave actual incorrecta" in error
+
+    envolver = recifrado.envolver_llave
+    monkeypatch.setattr(recifrado, "envolver_llave", lambda llave_datos, *args: envolver(secrets.token_bytes(32), *args))
+    contenido, error = recifrado._reenvolver_documento(documento, llave, llave_nueva)
+    assert contenido is None and "verificación" in error
@@ -0,0 +1,75 @@
+import base64
+import os
+import pytest
+from sqlalchemy import update
+from app.auth import servicio_hash
+from app.basedatos import SesionLocal
+from app.cifrado import envolver_llave, desenvolver_llave, generar_clave_chacha
+from app.crud import actualizar_clave_publica, obtener_usuario
+from app.llaves import generar_par_rsa
+from app.modelos import Documento, Usuario
+
+PDF = os.urandom(100 * 1024)
+
+def _registrar_par(matricula: str) -> bytes:
+    """Genera un par RSA, registra la llave pública del usuario y devuelve la privada en PEM."""
+    privada, publica = generar_par_rsa()
+    with SesionLocal() as db:
+        actualizar_clave_publica(db, obtener_usuario(db, matricula).id, publica.decode())
+    return privada
+
+def _descargar(cliente, ruta: str, id_documento: int, **archivos):
+    return cliente.post(f"/{ruta}/dashboard/descargarDocumento/{id_documento}",
+                        files={campo: ("llave", contenido) for campo, contenido in archivos.items()})
+
+def test_envolver_y_desenvolver_llave_de_datos():
+    llave_datos, llave = generar_clave_chacha(), generar_clave_chacha()
+    envuelta = envolver_llave(llave_datos, llave, "blob-a")
+    assert desenvolver_llave(envuelta, llave, "blob-a") == llave_datos
+    with pytest.raises(ValueError):
+        desenvolver_llave(envuelta, generar_clave_chacha(), "blob-a")
+    with pytest.raises(ValueError):
+        desenvolver_llave(envuelta, llave, "blob-b")
+
+def test_llave_envuelta_copiada_a_otro_documento_se_rechaza(cliente, llave, sembrar, subir):
+    sembrar(0, 1, documentos=0, staff=False)
+    origen, destino = subir("E00000", PDF, "a.pdf"), subir("E00000", PDF, "b.pdf")
+    with SesionLocal() as db:
+        envuelta = db.get(Documento, origen).llave_envuelta
+        db.execute(update(Documento).where(Documento.id == destino).values(llave_envuelta=envuelta))
+        db.commit()
+    assert _descargar(cliente, "jefe", origen, llave_simetrica=base64.b64encode(llave)).content == PDF
+    # El contexto de la envoltura es la referencia del blob: la llave de `origen` no abre `destino`
+    assert _descargar(cliente, "jefe", destino, llave_simetrica=base64.b64encode(llave)).status_code == 400
+
+def test_titular_descarga_solo_con_su_llave_privada(cliente, sembrar, subir):
+    sembrar(0, 1, documentos=0, staff=False)
+    privada = _registrar_par("12345")
+    id_documento = subir("E00000", PDF)
+    assert _descargar(cliente, "jefe", id_documento, llave_privada=privada).content == PDF
+    otra, _ = generar_par_rsa()
+    assert _descargar(cliente, "jefe", id_documento, llave_privada=otra).status_code == 400
+
+def test_titular_revocado_pierde_el_acceso(cliente, sembrar, subir):
+    sembrar(0, 1, documentos=0, staff=False)
+    privada = _registrar_par("12345")
+    id_documento = subir("E00000", PDF)
+    respuesta = cliente.delete("/jefe/accesos/12345")
+    assert respuesta.status_code == 200 and respuesta.json() == {"revocados": 1}
+    assert _descargar(cliente, "jefe", id_documento, llave_privada=privada).status_code == 403
+
+def test_titular_nuevo_recibe_acceso_a_documentos_existentes(cliente, iniciar_sesion, llave, sembrar, subir):
+    sembrar(0, 1, documentos=0)
+    id_documento = subir("E00000", PDF)
+    # S00000 registra su llave pública después de la subida: todavía no tiene copia de la llave de datos
+    privada = _registrar_par("S00000")
+    with SesionLocal() as db:
+        db.execute(update(Usuario).where(Usuario.matricula == "S00000").values(contraseña=servicio_hash.hasher.hash("Clave123!")))
+        db.commit()
+    staff = iniciar_sesion("S00000", "Clave123!")
+    assert _descargar(staff, "staff", id_documento, llave_privada=privada).status_code == 403
+
+    respuesta = cliente.post("/jefe/accesos/S00000", files={"llave_simetrica": ("llave.txt", base64.b64encode(llave))})
+    assert respuesta.status_code == 200, respuesta.text
+    assert respuesta.json()["concedidos"] == 1
+    assert _descargar(staff, "staff", id_documento, llave_privada=privada).content == PDF
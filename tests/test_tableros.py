@@ -0,0 +1,59 @@
+import pytest
+from sqlalchemy import update
+from app.auth import servicio_hash
+from app.basedatos import SesionLocal
+from app.modelos import Historial_Academico, Usuario
+from app.plantillas import cache_fragmentos
+from app.routes.jefe import TAMANO_PAGINA
+
+def _consultas_tablero(cliente, contar_consultas, ruta: str) -> list:
+    # Sin caché de fragmentos: se cargan y renderizan todos los estudiantes de la página
+    cache_fragmentos.limpiar()
+    with contar_consultas() as consultas:
+        respuesta = cliente.get(ruta)
+    assert respuesta.status_code == 200
+    return consultas
+
+def _con_contraseña(iniciar_sesion, matricula: str):
+    with SesionLocal() as db:
+        db.execute(update(Usuario).where(Usuario.matricula == matricula).values(contraseña=servicio_hash.hasher.hash("Clave123!")))
+        db.commit()
+    return iniciar_sesion(matricula, "Clave123!")
+
+@pytest.mark.parametrize("rol", ["jefe", "staff"])
+def test_consultas_del_tablero_no_crecen_con_los_estudiantes(cliente, iniciar_sesion, sembrar, contar_consultas, rol):
+    n = 4
+    sembrar(0, n)
+    sesion = cliente if rol == "jefe" else _con_contraseña(iniciar_sesion, "S00000")
+    ruta = f"/{rol}/dashboard"
+    sesion.get(ruta)
+    pocos = _consultas_tablero(sesion, contar_consultas, ruta)
+    # Más de una página: el tablero muestra solo la primera
+    sembrar(n, 3 * TAMANO_PAGINA)
+    muchos = _consultas_tablero(sesion, contar_consultas, ruta)
+    assert pocos and len(muchos) == len(pocos), muchos
+    assert sesion.get(ruta).text.count('class="staff-item" data-id=') == TAMANO_PAGINA
+
+def test_consultas_del_tablero_del_estudiante_no_crecen(iniciar_sesion, sembrar, contar_consultas):
+    sembrar(0, 1, calificaciones=2, staff=False)
+    estudiante = _con_contraseña(iniciar_sesion, "E00000")
+    estudiante.get("/estudiante/dashboard")
+    pocos = _consultas_tablero(estudiante, contar_consultas, "/estudiante/dashboard")
+    # Otros estudiantes con más calificaciones, y el mismo estudiante con muchas más materias
+    sembrar(1, 3 * TAMANO_PAGINA, calificaciones=5)
+    with SesionLocal() as db:
+        id_estudiante = db.query(Usuario.id).filter(Usuario.matricula == "E00000").scalar()
+        db.add_all(Historial_Academico(id_estudiante=id_estudiante, materia=f"Optativa {m}", semestre="",
+                                       calificacion="9", calificacion_numerica=9.0) for m in range(60))
+        db.commit()
+    muchos = _consultas_tablero(estudiante, contar_consultas, "/estudiante/dashboard")
+    assert pocos and len(muchos) == len(pocos), muchos
+    assert "Optativa 59" in estudiante.get("/estudiante/dashboard").text
+
+def test_tablero_repetido_responde_304(cliente, sembrar):
+    sembrar(0, 3)
+    primera = cliente.get("/jefe/dashboard")
+    repetida = cliente.get("/jefe/dashboard", headers={"If-None-Match": primera.headers["ETag"]})
+    assert repetida.status_code == 304
+    sembrar(3, 4)
+    assert cliente.get("/jefe/dashboard", headers={"If-None-Match": primera.headers["ETag"]}).status_code == 200
@@ -0,0 +1,52 @@
+from sqlalchemy import update
+from app import crud
+from app.auth import servicio_hash
+from app.basedatos import SesionLocal
+from app.cache import CacheTTL, cache_usuarios
+from app.crud import _ahora
+from app.modelos import Documento, Importacion, Recifrado, Usuario
+
+def test_eliminar_a_quien_subio_documentos_conserva_sus_registros(cliente, sembrar):
+    sembrar(0, 1, documentos=1)
+    with SesionLocal() as db:
+        staff = db.query(Usuario).filter(Usuario.matricula == "S00000").one()
+        documento = db.query(Documento).one()
+        documento.id_subido_por = staff.id
+        db.add(Importacion(id_usuario=staff.id, estado="terminado", errores="[]", creado=_ahora()))
+        db.add(Recifrado(id_usuario=staff.id, estado="terminado", errores="[]", creado=_ahora()))
+        db.commit()
+        id_documento = documento.id
+
+    respuesta = cliente.post("/jefe/dashboard/eliminarStaff", data={"matricula": "S00000"}, follow_redirects=False)
+    assert respuesta.status_code == 303, respuesta.text
+    with SesionLocal() as db:
+        assert db.query(Usuario).filter(Usuario.matricula == "S00000").first() is None
+        assert db.get(Documento, id_documento).id_subido_por is None
+        assert db.query(Importacion.id_usuario).scalar() is None
+        assert db.query(Recifrado.id_usuario).scalar() is None
+
+def _staff(iniciar_sesion, sembrar):
+    sembrar(0, 1, documentos=0)
+    with SesionLocal() as db:
+        db.execute(update(Usuario).where(Usuario.matricula == "S00000").values(contraseña=servicio_hash.hasher.hash("Clave123!")))
+        db.commit()
+    staff = iniciar_sesion("S00000", "Clave123!")
+    assert staff.get("/staff/estudiantes").status_code == 200
+    assert cache_usuarios.obtener("S00000") is not None
+    return staff
+
+def test_usuario_eliminado_en_otro_worker_pierde_la_sesion(iniciar_sesion, sembrar, monkeypatch):
+    staff = _staff(iniciar_sesion, sembrar)
+    # Otro worker elimina al usuario e invalida solo su propia caché
+    monkeypatch.setattr(crud, "cache_usuarios", CacheTTL(maximo=8, ttl=60))
+    with SesionLocal() as db:
+        assert crud.eliminar_usuario(db, "S00000")
+    assert staff.get("/staff/estudiantes").status_code == 401
+
+def test_usuario_cambiado_en_otro_worker_se_vuelve_a_leer(iniciar_sesion, sembrar, monkeypatch):
+    staff = _staff(iniciar_sesion, sembrar)
+    monkeypatch.setattr(crud, "cache_usuarios", CacheTTL(maximo=8, ttl=60))
+    with SesionLocal() as db:
+        crud.actualizar_clave_publica(db, db.query(Usuario.id).filter(Usuario.matricula == "S00000").scalar(), "PEM nuevo")
+    assert staff.get("/staff/estudiantes").status_code == 200
+    assert cache_usuarios.obtener("S00000").clave_publica == "PEM nuevo"